@@ -0,0 +1,86 @@
+# bench_barrier.py
+#
+# Fan-out/fan-in with N threads meeting at a barrier round after round.
+# Compares a barrier built from Condition (as commonly hand-rolled)
+# with thredo.Barrier, which releases everybody with one kernel
+# operation.  Reports rounds per second and trips to the kernel per
+# thread per round.  Also the time for a single thread to release N
+# threads waiting on a CountDownLatch.
+
+import time
+import thredo
+from thredo import thr
+from curio.thread import _locals
+
+ROUNDS = 50
+
+class ConditionBarrier:
+    def __init__(self, parties):
+        self.parties = parties
+        self.cond = thredo.Condition()
+        self.count = 0
+        self.generation = 0
+
+    def wait(self):
+        with self.cond:
+            gen = self.generation
+            self.count += 1
+            if self.count == self.parties:
+                self.count = 0
+                self.generation += 1
+                self.cond.notify_all()
+            else:
+                self.cond.wait_for(lambda: self.generation != gen)
+
+def run_rounds(barrier, nthreads):
+    def worker():
+        stats = thr.thread_stats(_locals.thread)
+        hops = stats.hops
+        for n in range(ROUNDS):
+            barrier.wait()
+        return stats.hops - hops
+
+    start = time.perf_counter()
+    threads = [ thredo.spawn(worker) for n in range(nthreads) ]
+    hops = sum(t.join() for t in threads)
+    elapsed = time.perf_counter() - start
+    return ROUNDS / elapsed, hops / (nthreads * ROUNDS)
+
+def release_latch(nthreads):
+    latch = thredo.CountDownLatch(1)
+    threads = [ thredo.spawn(latch.wait) for n in range(nthreads) ]
+    thredo.sleep(0.05)
+    start = time.perf_counter()
+    latch.count_down()
+    elapsed = time.perf_counter() - start
+    for t in threads:
+        t.join()
+    return elapsed
+
+def release_event(nthreads):
+    evt = thredo.Event()
+    threads = [ thredo.spawn(evt.wait) for n in range(nthreads) ]
+    thredo.sleep(0.05)
+    start = time.perf_counter()
+    evt.set()
+    elapsed = time.perf_counter() - start
+    for t in threads:
+        t.join()
+    return elapsed
+
+def main():
+    for nthreads in [8, 64]:
+        print('%d threads' % nthreads)
+        for name, barrier in [('Condition barrier', ConditionBarrier(nthreads)),
+                              ('Barrier', thredo.Barrier(nthreads))]:
+            rate, hops = run_rounds(barrier, nthreads)
+            print('  %-22s %8.0f rounds/sec %6.2f hops/thread/round' % (name, rate, hops))
+    print('Releasing waiters (best of 5)')
+    for nthreads in [1, 8, 64, 256]:
+        event = min(release_event(nthreads) for n in range(5))
+        latch = min(release_latch(nthreads) for n in range(5))
+        print('  %4d waiters   Event.set %8.1f us   CountDownLatch %8.1f us' %
+              (nthreads, event * 1e6, latch * 1e6))
+
+if __name__ == '__main__':
+    thredo.run(main)
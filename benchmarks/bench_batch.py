@@ -0,0 +1,62 @@
+# bench_batch.py
+#
+# Kernel round-trips and throughput of per-item operations compared with
+# batched operations.
+
+import time
+import thredo
+from thredo import thr
+
+COUNT = 1000
+
+hops = 0
+_await = thr.AWAIT
+def counting_await(*args, **kwargs):
+    global hops
+    hops += 1
+    return _await(*args, **kwargs)
+thr.AWAIT = counting_await
+
+def bench(name, func, *args):
+    global hops
+    hops = 0
+    start = time.perf_counter()
+    func(*args)
+    end = time.perf_counter()
+    print('%-20s %8d hops %10.0f items/sec' % (name, hops, COUNT / (end - start)))
+
+def queue_put(q):
+    for n in range(COUNT):
+        q.put(n)
+
+def queue_put_many(q):
+    q.put_many(range(COUNT))
+
+def sleeper():
+    try:
+        thredo.sleep(1000)
+    except thredo.ThreadCancelled:
+        pass
+
+def sleepers():
+    threads = [thredo.spawn(sleeper) for n in range(COUNT)]
+    thredo.sleep(0.5)
+    return threads
+
+def thread_cancel(threads):
+    for t in threads:
+        t.cancel()
+
+def thread_cancel_batch(threads):
+    with thredo.batch():
+        for t in threads:
+            t.cancel()
+
+def main():
+    bench('Queue.put', queue_put, thredo.Queue())
+    bench('Queue.put_many', queue_put_many, thredo.Queue())
+    bench('Thread.cancel', thread_cancel, sleepers())
+    bench('Thread.cancel (batch)', thread_cancel_batch, sleepers())
+
+if __name__ == '__main__':
+    thredo.run(main)
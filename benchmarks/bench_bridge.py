@@ -0,0 +1,72 @@
+# bench_bridge.py
+#
+# Throughput of thredo.UniversalQueue between each pairing of producer
+# and consumer: a thredo thread, a plain thread that is never promoted
+# and an asyncio coroutine running in a plain thread of its own.  Each
+# pairing is compared with curio.UniversalQueue, used the same way
+# except that thredo threads call its blocking methods as plain threads
+# would, because those waits are not cancellable in thredo.  The queue
+# is bounded, so both sides wait on each other.
+
+import asyncio
+import threading
+import time
+
+import curio
+import thredo
+
+COUNT = 20000
+MAXSIZE = 100
+
+def produce(q):
+    for n in range(COUNT):
+        q.put(n)
+    q.put(None)
+
+def consume(q):
+    while q.get() is not None:
+        pass
+
+async def aproduce(q):
+    for n in range(COUNT):
+        await q.put(n)
+    await q.put(None)
+
+async def aconsume(q):
+    while await q.get() is not None:
+        pass
+
+# Start func(q) on the given side. Returns a function that waits for it.
+def start(side, func, afunc, q):
+    if side == 'thredo':
+        return thredo.spawn(func, q).join
+    if side == 'thread':
+        t = threading.Thread(target=func, args=(q,))
+    else:
+        t = threading.Thread(target=asyncio.run, args=(afunc(q),))
+    t.start()
+    return lambda: thredo.spawn(t.join).join()
+
+def run(make, producer, consumer):
+    q = make(maxsize=MAXSIZE)
+    begin = time.perf_counter()
+    wait_consumer = start(consumer, consume, aconsume, q)
+    wait_producer = start(producer, produce, aproduce, q)
+    wait_producer()
+    wait_consumer()
+    return COUNT / (time.perf_counter() - begin)
+
+SIDES = ['thredo', 'thread', 'asyncio']
+
+def main():
+    print('%-8s -> %-8s %22s %22s' % ('producer', 'consumer',
+                                      'thredo.UniversalQueue', 'curio.UniversalQueue'))
+    for producer in SIDES:
+        for consumer in SIDES:
+            rates = [ max(run(make, producer, consumer) for n in range(3))
+                      for make in [thredo.UniversalQueue, curio.UniversalQueue] ]
+            print('%-8s -> %-8s %12.0f items/sec %12.0f items/sec' % (
+                (producer, consumer) + tuple(rates)))
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,73 @@
+# bench_bytequeue.py
+#
+# Memory-based backpressure.  A producer sends items whose sizes vary
+# from 100 bytes to 50 MB (mostly small, now and then huge) to a
+# consumer whose processing time is proportional to the size of the
+# item.  Items are represented by their sizes, so nothing is actually
+# allocated.  Compares a Queue bounded by item count with a ByteQueue
+# bounded by 64 MB on the peak number of bytes queued and throughput.
+
+import time
+import random
+import thredo
+
+COUNT = 2000
+RATE = 4e9              # Bytes/sec processed by the consumer
+
+def sizes():
+    r = random.Random(1)
+    return [ r.randint(50_000_000 // 2, 50_000_000) if r.random() < 0.02 else r.randint(100, 10_000)
+             for n in range(COUNT) ]
+
+def run(q, put, get, nbytes):
+    peak = 0
+    def producer():
+        nonlocal peak
+        for size in sizes():
+            put(size)
+            peak = max(peak, nbytes())
+        q.close()
+
+    def consumer():
+        for size in iter_get(get):
+            thredo.sleep(size / RATE)
+
+    start = time.perf_counter()
+    t1 = thredo.spawn(consumer)
+    t2 = thredo.spawn(producer)
+    t2.join()
+    t1.join()
+    return COUNT / (time.perf_counter() - start), peak
+
+def iter_get(get):
+    while True:
+        try:
+            yield get()
+        except thredo.QueueClosed:
+            return
+
+def counted(maxsize):
+    q = thredo.Queue(maxsize)
+    queued = 0
+    def put(size):
+        nonlocal queued
+        q.put(size)
+        queued += size
+    def get():
+        nonlocal queued
+        size = q.get()
+        queued -= size
+        return size
+    return q, put, get, lambda: queued
+
+def main():
+    for name, (q, put, get, nbytes) in [
+        ('Queue(maxsize=10)', counted(10)),
+        ('Queue(maxsize=100)', counted(100)),
+        ('ByteQueue(64 MB)', (lambda q: (q, q.put, q.get, lambda: q.nbytes))(thredo.ByteQueue(64_000_000, sizeof=int))),
+        ]:
+        rate, peak = run(q, put, get, nbytes)
+        print('%-20s %8.0f items/sec   peak %8.1f MB queued' % (name, rate, peak / 1e6))
+
+if __name__ == '__main__':
+    thredo.run(main)
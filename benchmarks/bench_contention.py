@@ -0,0 +1,48 @@
+# bench_contention.py
+#
+# Cost of lock contention profiling.  Profiling swaps instrumented
+# methods into the lock classes, so with it disabled the cost must be
+# exactly zero.  Measures uncontended acquire/release pairs with
+# profiling off and on, and prints the report for a small workload with
+# one hot lock.
+
+import time
+import thredo
+from thredo import contention
+
+OPS = 200000
+
+def uncontended():
+    lock = thredo.Lock()
+    start = time.perf_counter()
+    for n in range(OPS):
+        with lock:
+            pass
+    return OPS / (time.perf_counter() - start)
+
+def workload():
+    hot = thredo.Lock()
+    cold = thredo.Semaphore(8)
+    def worker():
+        for n in range(20):
+            with cold:
+                with hot:
+                    thredo.sleep(0.0005)
+    threads = [ thredo.spawn(worker) for n in range(16) ]
+    for t in threads:
+        t.join()
+
+def main():
+    off = max(uncontended() for n in range(3))
+    contention.enable()
+    on = max(uncontended() for n in range(3))
+    contention.reset()
+    workload()
+    contention.disable()
+    print('%-22s %10.0f acquire/release per sec' % ('profiling off', off))
+    print('%-22s %10.0f acquire/release per sec' % ('profiling on', on))
+    print()
+    contention.report()
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,67 @@
+# bench_echo.py
+#
+# Echo server throughput with an increasing number of Curio kernels.
+# The clients run in a separate process using ordinary blocking sockets.
+
+import sys
+import time
+import socket as _socket
+import threading
+import multiprocessing
+import thredo
+from thredo.socket import *
+
+CLIENTS = 100
+MESSAGES = 200
+MSG = b'x' * 100
+
+def echo_handler(client):
+    with client:
+        while True:
+            data = client.recv(1000)
+            if not data:
+                break
+            client.sendall(data)
+
+def echo_server(sock):
+    while True:
+        client, addr = sock.accept()
+        thredo.spawn(echo_handler, client, daemon=True)
+
+def client(address):
+    sock = _socket.create_connection(address)
+    with sock:
+        for n in range(MESSAGES):
+            sock.sendall(MSG)
+            nrecv = 0
+            while nrecv < len(MSG):
+                nrecv += len(sock.recv(1000))
+
+def clients(address, result):
+    threads = [threading.Thread(target=client, args=(address,)) for n in range(CLIENTS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result.put(time.perf_counter() - start)
+
+def main(kernels):
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(CLIENTS)
+    serv = thredo.spawn(echo_server, sock, daemon=True)
+    result = multiprocessing.Queue()
+    p = multiprocessing.Process(target=clients, args=(sock.getsockname(), result))
+    p.start()
+    while p.is_alive():
+        thredo.sleep(0.1)
+    elapsed = result.get()
+    serv.cancel()
+    sock.close()
+    print('kernels=%d %10.0f requests/sec' % (kernels, CLIENTS * MESSAGES / elapsed))
+
+if __name__ == '__main__':
+    for kernels in [1, 2, 4]:
+        thredo.run(main, kernels, kernels=kernels)
@@ -0,0 +1,27 @@
+# bench_executor.py
+#
+# Throughput of submitting small calls through ThreadPoolExecutor and
+# ThredoExecutor.
+
+import time
+from concurrent import futures
+import thredo
+
+COUNT = 20000
+
+def work(x):
+    return x + 1
+
+def bench(name, ex):
+    with ex:
+        start = time.perf_counter()
+        assert sum(ex.map(work, range(COUNT))) == sum(range(1, COUNT + 1))
+        end = time.perf_counter()
+    print('%-20s %10.0f calls/sec' % (name, COUNT / (end - start)))
+
+def main():
+    bench('ThreadPoolExecutor', futures.ThreadPoolExecutor(max_workers=8))
+    bench('ThredoExecutor', thredo.ThredoExecutor(max_workers=8))
+
+if __name__ == '__main__':
+    thredo.run(main)
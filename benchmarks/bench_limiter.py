@@ -0,0 +1,66 @@
+# bench_limiter.py
+#
+# Weighted admission with CapacityLimiter.  Threads needing several
+# units of a shared capacity either take them one at a time from a
+# Semaphore (serialized by a Lock so that two large requests can't
+# deadlock each other) or all at once with CapacityLimiter.acquire(n).
+# Reports requests per second, plus the limiter's own statistics.
+
+import time
+import random
+import thredo
+
+REQUESTS = 2000
+HOLD = 0.0005
+
+def run(admit, nthreads, total):
+    sizes = random.Random(0)
+    def worker():
+        for n in range(REQUESTS // nthreads):
+            units = sizes.randint(1, total // 2)
+            with admit(units):
+                thredo.sleep(HOLD)
+
+    start = time.perf_counter()
+    threads = [ thredo.spawn(worker) for n in range(nthreads) ]
+    for t in threads:
+        t.join()
+    return REQUESTS / (time.perf_counter() - start)
+
+class SemaphoreAdmit(object):
+    def __init__(self, total):
+        self.sema = thredo.Semaphore(total)
+        self.lock = thredo.Lock()
+
+    def __call__(self, units):
+        return _Units(self, units)
+
+class _Units(object):
+    def __init__(self, admit, units):
+        self.admit = admit
+        self.units = units
+
+    def __enter__(self):
+        with self.admit.lock:
+            for n in range(self.units):
+                self.admit.sema.acquire()
+
+    def __exit__(self, *args):
+        for n in range(self.units):
+            self.admit.sema.release()
+
+def main():
+    total = 16
+    for nthreads in [1, 8, 64]:
+        print('%d threads, total=%d' % (nthreads, total))
+        sema = SemaphoreAdmit(total)
+        print('  %-22s %8.0f requests/sec' % ('Semaphore + Lock', run(sema, nthreads, total)))
+        limiter = thredo.CapacityLimiter(total)
+        print('  %-22s %8.0f requests/sec' % ('CapacityLimiter', run(limiter.borrow, nthreads, total)))
+        stats = limiter.statistics()
+        print('  %-22s waited %d/%d, mean wait %.2f ms, peak borrowed %d' %
+              ('', stats['waited'], stats['acquired'], stats['mean_wait'] * 1e3,
+               stats['peak_borrowed']))
+
+if __name__ == '__main__':
+    thredo.run(main)
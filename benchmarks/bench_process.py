@@ -0,0 +1,58 @@
+# bench_process.py
+#
+# CPU-bound hashing in thredo threads and with run_in_process().  A
+# ticker thread measures how late its 10 ms sleeps wake up, which shows
+# how badly the computation stalls other threads.
+
+import time
+import hashlib
+import thredo
+
+TASKS = 16
+DATA = b'x' * 100000
+
+def work(rounds=200):
+    h = hashlib.sha256()
+    for n in range(rounds):
+        h.update(DATA)
+        h = hashlib.sha256(h.digest())
+    return h.hexdigest()
+
+def pure_work(rounds=20000):
+    # Pure Python, holds the GIL the whole time
+    x = 0
+    for n in range(rounds * 50):
+        x = (x * 31 + n) % 1000003
+    return x
+
+def ticker(lag):
+    while True:
+        start = time.perf_counter()
+        thredo.sleep(0.01)
+        lag.append(time.perf_counter() - start - 0.01)
+
+def bench(name, func, call):
+    lag = []
+    t = thredo.spawn(ticker, lag)
+    start = time.perf_counter()
+    g = thredo.ThreadGroup()
+    for n in range(TASKS):
+        g.spawn(call, func)
+    g.join()
+    elapsed = time.perf_counter() - start
+    t.cancel()
+    print('%-30s %8.2f tasks/sec   max ticker lag %7.1f ms' % (
+          name, TASKS / elapsed, max(lag, default=0) * 1000))
+
+def in_thread(func):
+    return func()
+
+def main():
+    thredo.run_in_process(work, 1)     # Start a worker
+    bench('sha256 in thread', work, in_thread)
+    bench('sha256 run_in_process', work, thredo.run_in_process)
+    bench('pure python in thread', pure_work, in_thread)
+    bench('pure python run_in_process', pure_work, thredo.run_in_process)
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,38 @@
+# bench_promote.py
+#
+# Latency of promoting foreign threads (threads not created by thredo)
+# the first time they touch a thredo primitive.  Promotion happens on
+# demand or from threads created ahead of time with prepromote().
+
+import threading
+import thredo
+
+COUNT = 200
+
+def foreign(evt):
+    evt.wait()
+
+def bench(name, prepare):
+    if prepare:
+        thredo.prepromote(COUNT)
+    before = thredo.promotion_stats()
+    evt = thredo.Event()
+    threads = [ threading.Thread(target=foreign, args=(evt,)) for n in range(COUNT) ]
+    for t in threads:
+        t.start()
+    while thredo.promotion_stats()['promotions'] - before['promotions'] < COUNT:
+        thredo.sleep(0.01)
+    evt.set()
+    for t in threads:
+        t.join()
+    after = thredo.promotion_stats()
+    mean = (after['total_latency'] - before['total_latency']) / COUNT
+    print('%-20s %8.1f us mean promotion latency' % (name, mean * 1e6))
+
+def main():
+    bench('on demand', False)
+    bench('prepromote()', True)
+    print('max latency %.1f us' % (thredo.promotion_stats()['max_latency'] * 1e6))
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,157 @@
+# bench_queue.py
+#
+# Producer/consumer throughput of small items.  Compares the standard
+# library queue.Queue (between two thredo threads), thredo.Queue with
+# one put()/get() per item, and thredo.Queue with put_many() and
+# get_many() moving batches of items.  Reports items per second and
+# trips to the kernel per item, for an unbounded queue and one bounded
+# to 1000 items.
+#
+# Then, the cost per operation of putting 1M items on each kind of
+# queue and getting them back, compared with the standard library
+# where it has an equivalent.  Finally, a producer sending 1M updates
+# for 1000 keys in bursts to a consumer through a CoalescingQueue,
+# where only the latest update for each key is delivered.  Last, the
+# time to shut down a fan-out of consumers waiting on an empty queue
+# with one sentinel per consumer compared with Queue.close().
+
+import time
+import queue
+import thredo
+from thredo import thr
+from curio.thread import _locals
+
+COUNT = 100000
+BATCH = 100
+MILLION = 1000000
+
+def per_item(q):
+    def producer():
+        for n in range(COUNT):
+            q.put(n)
+        q.put(None)
+
+    def consumer():
+        while q.get() is not None:
+            pass
+    return producer, consumer
+
+def batched(q):
+    def producer():
+        for n in range(0, COUNT, BATCH):
+            q.put_many(range(n, n + BATCH))
+        q.put(None)
+
+    def consumer():
+        while True:
+            items = q.get_many(BATCH)
+            if items[-1] is None:
+                break
+    return producer, consumer
+
+def counting_hops(func):
+    def wrapper():
+        stats = thr.thread_stats(_locals.thread)
+        hops = stats.hops
+        func()
+        return stats.hops - hops
+    return wrapper
+
+def run(producer, consumer):
+    start = time.perf_counter()
+    t1 = thredo.spawn(counting_hops(consumer))
+    t2 = thredo.spawn(counting_hops(producer))
+    hops = t2.join() + t1.join()
+    elapsed = time.perf_counter() - start
+    return COUNT / elapsed, hops / COUNT
+
+def fill_drain(q):
+    items = [ (n * 7919) % MILLION for n in range(MILLION) ]
+    start = time.perf_counter()
+    for item in items:
+        q.put(item)
+    middle = time.perf_counter()
+    for n in range(MILLION):
+        q.get()
+    end = time.perf_counter()
+    return (middle - start) / MILLION, (end - middle) / MILLION
+
+def coalescing():
+    q = thredo.CoalescingQueue(key=lambda item: item[0])
+    delivered = 0
+    def producer():
+        for n in range(MILLION // 1000):
+            for key in range(1000):
+                q.put((key, n))
+            thredo.sleep(0)
+        q.put((None, None))
+
+    def consumer():
+        nonlocal delivered
+        while True:
+            key, value = q.get()
+            if key is None:
+                break
+            delivered += 1
+            thredo.sleep(0)
+
+    start = time.perf_counter()
+    t1 = thredo.spawn(consumer)
+    t2 = thredo.spawn(producer)
+    t2.join()
+    t1.join()
+    return time.perf_counter() - start, delivered
+
+def shutdown(nconsumers, use_close):
+    q = thredo.Queue()
+    def consumer():
+        for item in q:
+            if item is None:
+                break
+
+    threads = [ thredo.spawn(consumer) for n in range(nconsumers) ]
+    thredo.sleep(0.1)
+    start = time.perf_counter()
+    if use_close:
+        q.close()
+    else:
+        for n in range(nconsumers):
+            q.put(None)
+    signalled = time.perf_counter()
+    for t in threads:
+        t.join()
+    end = time.perf_counter()
+    return signalled - start, end - start
+
+def main():
+    for maxsize in [0, 1000]:
+        print('maxsize=%d' % maxsize)
+        for name, make in [('queue.Queue', lambda: per_item(queue.Queue(maxsize))),
+                           ('thredo.Queue', lambda: per_item(thredo.Queue(maxsize))),
+                           ('put_many/get_many', lambda: batched(thredo.Queue(maxsize)))]:
+            rate, hops = max(run(*make()) for n in range(3))
+            print('  %-20s %10.0f items/sec %8.4f hops/item' % (name, rate, hops))
+
+    print('1M items, put all then get all')
+    for name, q in [('queue.Queue', queue.Queue()),
+                    ('thredo.Queue', thredo.Queue()),
+                    ('queue.LifoQueue', queue.LifoQueue()),
+                    ('thredo.LifoQueue', thredo.LifoQueue()),
+                    ('queue.PriorityQueue', queue.PriorityQueue()),
+                    ('thredo.PriorityQueue', thredo.PriorityQueue()),
+                    ('thredo.CoalescingQueue', thredo.CoalescingQueue())]:
+        put, get = fill_drain(q)
+        print('  %-24s put %6.2f us   get %6.2f us' % (name, put * 1e6, get * 1e6))
+
+    elapsed, delivered = coalescing()
+    print('1M updates to 1000 keys: %.2f sec, %d delivered' % (elapsed, delivered))
+
+    print('Shutting down consumers (best of 5)')
+    for nconsumers in [100, 1000]:
+        for name, use_close in [('sentinels', False), ('close()', True)]:
+            signal, total = min(shutdown(nconsumers, use_close) for n in range(5))
+            print('  %5d consumers %-10s signal %8.1f us   all done %8.1f ms' %
+                  (nconsumers, name, signal * 1e6, total * 1e3))
+
+if __name__ == '__main__':
+    thredo.run(main)
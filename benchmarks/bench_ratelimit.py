@@ -0,0 +1,58 @@
+# bench_ratelimit.py
+#
+# Throttling many threads to a shared rate.  The usual approach is a
+# token bucket that threads poll, sleeping in between.  Every poll is a
+# trip to the kernel and most of them find no token.  RateLimiter parks
+# the waiting threads and releases them as tokens come in.  Reports the
+# achieved rate and the trips to the kernel per request.
+
+import time
+import thredo
+from thredo import thr
+from curio.thread import _locals
+
+RATE = 1000
+REQUESTS = 1000
+
+class PollingBucket(object):
+    def __init__(self, rate, burst=1, poll=0.005):
+        self.rate = rate
+        self.burst = burst
+        self.poll = poll
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.stamp) * self.rate, self.burst)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            thredo.sleep(self.poll)
+
+def run(limiter, nthreads):
+    def worker():
+        stats = thr.thread_stats(_locals.thread)
+        hops = stats.hops
+        for n in range(REQUESTS // nthreads):
+            limiter.acquire()
+        return stats.hops - hops
+
+    start = time.perf_counter()
+    threads = [ thredo.spawn(worker) for n in range(nthreads) ]
+    hops = sum(t.join() for t in threads)
+    elapsed = time.perf_counter() - start
+    return REQUESTS / elapsed, hops / REQUESTS
+
+def main():
+    for nthreads in [10, 100, 1000]:
+        print('%d threads, rate=%d/sec' % (nthreads, RATE))
+        for name, limiter in [('sleep() polling', PollingBucket(RATE, 10)),
+                              ('RateLimiter', thredo.RateLimiter(RATE, 10))]:
+            rate, hops = run(limiter, nthreads)
+            print('  %-18s %8.0f requests/sec %8.2f hops/request' % (name, rate, hops))
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,78 @@
+# bench_rwlock.py
+#
+# Contention on a read-mostly structure.  1, 8 and 64 reader threads
+# (plus one writer doing a write for every 100 reads) look up a shared
+# dict while holding a lock across a short blocking operation, the way
+# a cache lookup followed by I/O would.  Compares a plain Lock with
+# RWLock in both modes.  Also compares a single Lock with a StripedLock
+# when 64 threads update different keys.
+
+import time
+import thredo
+
+READS = 2000
+HOLD = 0.0005
+
+def run_readers(nreaders, lock_read, lock_write):
+    data = { n: n for n in range(100) }
+    done = thredo.Event()
+    def reader(n):
+        for i in range(READS // nreaders):
+            with lock_read:
+                data[i % 100]
+                thredo.sleep(HOLD)
+
+    def writer():
+        i = 0
+        while not done.is_set():
+            with lock_write:
+                data[i % 100] = i
+            i += 1
+            thredo.sleep(HOLD * 100)
+
+    w = thredo.spawn(writer)
+    start = time.perf_counter()
+    readers = [ thredo.spawn(reader, n) for n in range(nreaders) ]
+    for t in readers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    w.join()
+    return READS / elapsed
+
+def run_updates(lock_for, nthreads=64, updates=2000):
+    counts = { }
+    def worker(key):
+        for n in range(updates // nthreads):
+            with lock_for(key):
+                value = counts.get(key, 0)
+                thredo.sleep(HOLD)
+                counts[key] = value + 1
+
+    start = time.perf_counter()
+    threads = [ thredo.spawn(worker, key) for key in range(nthreads) ]
+    for t in threads:
+        t.join()
+    return updates / (time.perf_counter() - start)
+
+def main():
+    for nreaders in [1, 8, 64]:
+        print('%d readers' % nreaders)
+        lock = thredo.Lock()
+        rw = thredo.RWLock()
+        rwp = thredo.RWLock(prefer_writers=True)
+        for name, lock_read, lock_write in [
+            ('Lock', lock, lock),
+            ('RWLock', rw.read_lock, rw.write_lock),
+            ('RWLock(prefer_writers)', rwp.read_lock, rwp.write_lock),
+            ]:
+            print('  %-24s %10.0f reads/sec' % (name, run_readers(nreaders, lock_read, lock_write)))
+
+    print('64 threads updating different keys')
+    lock = thredo.Lock()
+    striped = thredo.StripedLock(16)
+    print('  %-24s %10.0f updates/sec' % ('Lock', run_updates(lambda key: lock)))
+    print('  %-24s %10.0f updates/sec' % ('StripedLock(16)', run_updates(striped.__getitem__)))
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,31 @@
+# bench_spawn.py
+#
+# Spawn/join rate of short-lived threads with and without the thread pool.
+
+import time
+import curio
+import thredo
+from thredo.thr import TAWAIT as AWAIT
+
+COUNT = 2000
+
+def child():
+    pass
+
+def spawn_unpooled(callable):
+    # The old thredo.spawn(): a new OS thread per call
+    return thredo.core.Thread(AWAIT(curio.spawn_thread, callable))
+
+def bench(name, spawn):
+    start = time.perf_counter()
+    for n in range(COUNT):
+        spawn(child).join()
+    end = time.perf_counter()
+    print('%-20s %10.0f spawns/sec' % (name, COUNT / (end - start)))
+
+def main():
+    bench('new thread (old)', spawn_unpooled)
+    bench('pooled', thredo.spawn)
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,62 @@
+# bench_stats.py
+#
+# Overhead of collecting per-thread statistics.  Threads ping-pong over
+# a pair of queues so that every operation is a trip to the kernel.
+
+import time
+import thredo
+from thredo import thr
+
+COUNT = 5000
+ROUNDS = 10
+
+def ponger(inq, outq):
+    for n in range(COUNT):
+        outq.put(inq.get())
+
+def pingpong():
+    inq = thredo.Queue()
+    outq = thredo.Queue()
+    t = thredo.spawn(ponger, inq, outq)
+    start = time.perf_counter()
+    for n in range(COUNT):
+        inq.put(n)
+        outq.get()
+    end = time.perf_counter()
+    t.join()
+    return end - start
+
+def main():
+    best = { True: float('inf'), False: float('inf') }
+    for r in range(ROUNDS):
+        for collect in (False, True):
+            thr._collect = collect
+            best[collect] = min(best[collect], pingpong())
+    thr._collect = True
+    for collect in (False, True):
+        print('%-20s %10.0f round trips/sec' % ('stats on' if collect else 'stats off',
+                                               COUNT / best[collect]))
+    print('overhead %.2f%%' % ((best[True] / best[False] - 1) * 100))
+
+    # Cost of the bookkeeping alone, without the trip to the kernel
+    before = thredo.stats()['hops']
+    pingpong()
+    hops = thredo.stats()['hops'] - before
+    real_await = thr.AWAIT
+    thr.AWAIT = lambda coro, *args, **kwargs: None
+    try:
+        start = time.perf_counter()
+        for n in range(COUNT):
+            thr.AWAIT(None)
+        mid = time.perf_counter()
+        for n in range(COUNT):
+            thr._hop('bench', None, (), {})
+        end = time.perf_counter()
+    finally:
+        thr.AWAIT = real_await
+    cost = ((end - mid) - (mid - start)) / COUNT
+    hop = best[False] / hops
+    print('bookkeeping %.2f us per hop (%.2f%% of a %.1f us hop)' % (cost * 1e6, cost / hop * 100, hop * 1e6))
+
+if __name__ == '__main__':
+    thredo.run(main)
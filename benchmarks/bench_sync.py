@@ -0,0 +1,83 @@
+# bench_sync.py
+#
+# Uncontended acquire/release rate of the thredo locks compared with
+# the previous implementation that went through the Curio kernel on
+# every operation.  Also the rate of Event.set() and Condition.notify()
+# when nobody is waiting.
+
+import time
+import curio
+import thredo
+from thredo.thr import TAWAIT as AWAIT
+
+COUNT = 20000
+
+class CurioLock:
+    # The old thredo.Lock: every operation is a trip to the kernel
+    def __init__(self):
+        self._lock = curio.Lock()
+
+    def acquire(self):
+        AWAIT(self._lock.acquire)
+
+    def release(self):
+        AWAIT(self._lock.release)
+
+class CurioEvent:
+    # The old thredo.Event
+    def __init__(self):
+        self._evt = curio.Event()
+
+    def set(self):
+        AWAIT(self._evt.set)
+
+class GuardedEvent(thredo.Event):
+    # Event.set() before the no-waiter check
+    def set(self):
+        with self._guard:
+            self._set = True
+            self._waiting.wake(len(self._waiting))
+
+class GuardedCondition(thredo.Condition):
+    # Condition.notify() before the no-waiter check
+    def notify(self, n=1):
+        if not self.locked():
+            raise RuntimeError("Can't notify on unacquired lock")
+        with self._guard:
+            self._waiting.wake(n)
+
+def bench_call(name, func, count=COUNT):
+    start = time.perf_counter()
+    for n in range(count):
+        func()
+    end = time.perf_counter()
+    print('%-24s %12.0f ops/sec' % (name, count / (end - start)))
+
+def bench(name, lock, count=COUNT):
+    start = time.perf_counter()
+    for n in range(count):
+        lock.acquire()
+        lock.release()
+    end = time.perf_counter()
+    print('%-24s %12.0f ops/sec' % (name, count / (end - start)))
+
+def main():
+    bench('kernel Lock (old)', CurioLock())
+    bench('Lock', thredo.Lock(), COUNT*10)
+    bench('RLock', thredo.RLock(), COUNT*10)
+    bench('Semaphore', thredo.Semaphore(), COUNT*10)
+    bench('BoundedSemaphore', thredo.BoundedSemaphore(), COUNT*10)
+    rw = thredo.RWLock()
+    bench('RWLock read', rw.read_lock, COUNT*10)
+    bench('RWLock write', rw.write_lock, COUNT*10)
+    bench_call('kernel Event.set (old)', CurioEvent().set)
+    bench_call('Event.set (guarded)', GuardedEvent().set, COUNT*10)
+    bench_call('Event.set', thredo.Event().set, COUNT*10)
+    # (The old kernel Condition.notify() fails without waiters on Curio 0.9)
+    for name, cond in [('notify (guarded)', GuardedCondition()),
+                       ('Condition.notify', thredo.Condition())]:
+        with cond:
+            bench_call(name, cond.notify, COUNT*10)
+
+if __name__ == '__main__':
+    thredo.run(main)
@@ -0,0 +1,69 @@
+# bench_timer.py
+#
+# Cost of setting and cancelling a timeout while many other deadlines
+# are pending.  Compares the thredo timer wheel to Curio's kernel time
+# queue (which can only be used from inside the kernel).  Also measures a timeout block in a thread
+# with the old Curio timeout (a trip to the kernel to set and another
+# to clear it) and with thredo.timeout_after().
+
+import time
+import random
+import curio
+from curio.timequeue import TimeQueue
+import thredo
+from thredo.timer import TimerWheel
+
+OPS = 100000
+
+def bench_wheel(pending, resolution):
+    wheel = TimerWheel(resolution)
+    now = time.monotonic()
+    for n in range(pending):
+        wheel.add(now + random.uniform(1, 60), None)
+    start = time.perf_counter()
+    for n in range(OPS):
+        wheel.cancel(wheel.add(now + 30, None))
+    return time.perf_counter() - start
+
+def bench_timequeue(pending):
+    tq = TimeQueue()
+    now = time.monotonic()
+    for n in range(pending):
+        tq.push(n, now + random.uniform(1, 60))
+    start = time.perf_counter()
+    for n in range(OPS):
+        tq.push(-1, now + 30)
+        tq.cancel(-1, now + 30)
+    return time.perf_counter() - start
+
+def bench_blocks():
+    q = thredo.Queue()
+    count = 10000
+    start = time.perf_counter()
+    for n in range(count):
+        with curio.timeout_after(30):
+            q.put(n)
+            q.get()
+    old = time.perf_counter() - start
+    start = time.perf_counter()
+    for n in range(count):
+        with thredo.timeout_after(30):
+            q.put(n)
+            q.get()
+    new = time.perf_counter() - start
+    print('%-32s %10.0f blocks/sec' % ('curio.timeout_after in thread', count / old))
+    print('%-32s %10.0f blocks/sec' % ('thredo.timeout_after', count / new))
+
+def main():
+    for pending in [10000, 100000]:
+        print('%d pending deadlines' % pending)
+        for name, elapsed in [
+            ('curio TimeQueue', bench_timequeue(pending)),
+            ('TimerWheel (1 ms)', bench_wheel(pending, 0.001)),
+            ('TimerWheel (50 ms)', bench_wheel(pending, 0.05)),
+            ]:
+            print('  %-30s %8.2f us per set+cancel' % (name, elapsed / OPS * 1e6))
+    thredo.run(bench_blocks)
+
+if __name__ == '__main__':
+    main()
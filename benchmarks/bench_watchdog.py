@@ -0,0 +1,50 @@
+# bench_watchdog.py
+#
+# Cost of the blocking-call watchdog.  Threads aren't instrumented, so
+# the only costs are a single scan of the running threads every
+# interval and the bookkeeping done as pooled threads start and finish.
+# Measures the time of one scan with many threads parked in the kernel
+# and the rate of short operations (a hop to the kernel each) with
+# and without a watchdog running.
+
+import time
+import thredo
+from thredo.watchdog import Watchdog
+
+OPS = 50000
+
+def bench_scan():
+    evt = thredo.Event()
+    for nthreads in [100, 1000]:
+        g = thredo.ThreadGroup()
+        for n in range(nthreads):
+            g.spawn(evt.wait)
+        thredo.sleep(0.1)
+        w = Watchdog(0.1)
+        w.check()
+        start = time.perf_counter()
+        for n in range(100):
+            w.check()
+        elapsed = (time.perf_counter() - start) / 100
+        print('%-34s %8.1f us per scan' % ('scan, %d threads' % nthreads, elapsed * 1e6))
+        g.cancel_remaining()
+
+def hops():
+    start = time.perf_counter()
+    for n in range(OPS):
+        thredo.sleep(0)
+    return OPS / (time.perf_counter() - start)
+
+def ignore(*args):
+    pass
+
+def main():
+    thredo.run(bench_scan)
+    for label, threshold in [('no watchdog', None), ('watchdog (100 ms)', 0.1),
+                             ('watchdog (1 ms)', 0.001)]:
+        rate = max(thredo.run(hops, watchdog=threshold and Watchdog(threshold, callback=ignore))
+                   for n in range(3))
+        print('%-34s %8.0f hops/sec' % (label, rate))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,510 @@
+# suite.py
+#
+# Benchmark suite comparing thredo to the equivalent code written with
+# threading + queue, asyncio and plain Curio.  Everything runs offline
+# on the loopback interface.  Run as
+#
+#     python benchmarks/suite.py [--quick] [--json results.json] [names...]
+#
+# The JSON output is meant to be kept around and compared between
+# revisions to spot regressions.
+
+import sys
+import os
+import time
+import json
+import socket as _socket
+import threading
+import queue as _queue
+import multiprocessing
+import platform
+import argparse
+
+import asyncio
+import curio
+import curio.socket
+import curio.io
+import thredo
+import thredo.socket
+import thredo.io
+
+IMPLS = ['thredo', 'threading', 'asyncio', 'curio']
+
+# Scale factor applied to all counts (--quick makes it smaller)
+SCALE = 1.0
+
+def count(n):
+    return max(1, int(n * SCALE))
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+# ------------------------------------------------------------------------
+# Spawn/join rate of threads (or tasks) that do nothing
+
+def spawn_join(impl):
+    n = count(2000)
+    def child():
+        pass
+
+    async def achild():
+        pass
+
+    if impl == 'thredo':
+        def main():
+            for _ in range(n):
+                thredo.spawn(child).join()
+        elapsed = thredo.run(timed, main)
+    elif impl == 'threading':
+        def main():
+            for _ in range(n):
+                t = threading.Thread(target=child)
+                t.start()
+                t.join()
+        elapsed = timed(main)
+    elif impl == 'asyncio':
+        async def main():
+            start = time.perf_counter()
+            for _ in range(n):
+                await asyncio.get_running_loop().create_task(achild())
+            return time.perf_counter() - start
+        elapsed = asyncio.run(main())
+    else:
+        async def main():
+            start = time.perf_counter()
+            for _ in range(n):
+                await (await curio.spawn(achild)).join()
+            return time.perf_counter() - start
+        elapsed = curio.run(main)
+    return n / elapsed, 'spawns/sec'
+
+# ------------------------------------------------------------------------
+# Two workers taking turns with a lock
+
+def lock_pingpong(impl):
+    n = count(20000)
+
+    def worker(lock):
+        for _ in range(n):
+            with lock:
+                pass
+
+    # Tasks are not preempted.  They yield while holding the lock so
+    # that the two of them actually take turns.
+    async def aworker(lock, yield_):
+        for _ in range(n):
+            async with lock:
+                await yield_(0)
+
+    if impl == 'thredo':
+        def main():
+            lock = thredo.Lock()
+            t1 = thredo.spawn(worker, lock)
+            t2 = thredo.spawn(worker, lock)
+            t1.join()
+            t2.join()
+        elapsed = thredo.run(timed, main)
+    elif impl == 'threading':
+        def main():
+            lock = threading.Lock()
+            threads = [ threading.Thread(target=worker, args=(lock,)) for _ in range(2) ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        elapsed = timed(main)
+    elif impl == 'asyncio':
+        async def main():
+            lock = asyncio.Lock()
+            start = time.perf_counter()
+            await asyncio.gather(aworker(lock, asyncio.sleep), aworker(lock, asyncio.sleep))
+            return time.perf_counter() - start
+        elapsed = asyncio.run(main())
+    else:
+        async def main():
+            lock = curio.Lock()
+            start = time.perf_counter()
+            t1 = await curio.spawn(aworker, lock, curio.sleep)
+            t2 = await curio.spawn(aworker, lock, curio.sleep)
+            await t1.join()
+            await t2.join()
+            return time.perf_counter() - start
+        elapsed = curio.run(main)
+    return 2 * n / elapsed, 'acquires/sec'
+
+# ------------------------------------------------------------------------
+# Producer/consumer through a bounded queue
+
+def queue_throughput(impl):
+    n = count(50000)
+    maxsize = 100
+
+    def producer(q):
+        for i in range(n):
+            q.put(i)
+
+    def consumer(q):
+        for i in range(n):
+            q.get()
+
+    if impl == 'thredo':
+        def main():
+            q = thredo.Queue(maxsize=maxsize)
+            t = thredo.spawn(consumer, q)
+            producer(q)
+            t.join()
+        elapsed = thredo.run(timed, main)
+    elif impl == 'threading':
+        def main():
+            q = _queue.Queue(maxsize=maxsize)
+            t = threading.Thread(target=consumer, args=(q,))
+            t.start()
+            producer(q)
+            t.join()
+        elapsed = timed(main)
+    elif impl == 'asyncio':
+        async def aconsumer(q):
+            for i in range(n):
+                await q.get()
+        async def main():
+            q = asyncio.Queue(maxsize=maxsize)
+            start = time.perf_counter()
+            t = asyncio.get_running_loop().create_task(aconsumer(q))
+            for i in range(n):
+                await q.put(i)
+            await t
+            return time.perf_counter() - start
+        elapsed = asyncio.run(main())
+    else:
+        async def aconsumer(q):
+            for i in range(n):
+                await q.get()
+        async def main():
+            q = curio.Queue(maxsize=maxsize)
+            start = time.perf_counter()
+            t = await curio.spawn(aconsumer, q)
+            for i in range(n):
+                await q.put(i)
+            await t.join()
+            return time.perf_counter() - start
+        elapsed = curio.run(main)
+    return n / elapsed, 'items/sec'
+
+# ------------------------------------------------------------------------
+# One event waking many waiters.  Each waiter acknowledges on a queue.
+
+def event_fanout(impl):
+    waiters = 100
+    rounds = count(50)
+
+    def waiter(events, acks):
+        for evt in events:
+            evt.wait()
+            acks.put(None)
+
+    def setter(events, acks):
+        for evt in events:
+            evt.set()
+            for _ in range(waiters):
+                acks.get()
+
+    async def awaiter(events, acks):
+        for evt in events:
+            await evt.wait()
+            await acks.put(None)
+
+    async def asetter(events, acks):
+        for evt in events:
+            await evt.set() if impl == 'curio' else evt.set()
+            for _ in range(waiters):
+                await acks.get()
+
+    if impl == 'thredo':
+        def main():
+            events = [ thredo.Event() for _ in range(rounds) ]
+            acks = thredo.Queue()
+            threads = [ thredo.spawn(waiter, events, acks) for _ in range(waiters) ]
+            elapsed = timed(setter, events, acks)
+            for t in threads:
+                t.join()
+            return elapsed
+        elapsed = thredo.run(main)
+    elif impl == 'threading':
+        events = [ threading.Event() for _ in range(rounds) ]
+        acks = _queue.Queue()
+        threads = [ threading.Thread(target=waiter, args=(events, acks)) for _ in range(waiters) ]
+        for t in threads:
+            t.start()
+        elapsed = timed(setter, events, acks)
+        for t in threads:
+            t.join()
+    elif impl == 'asyncio':
+        async def main():
+            events = [ asyncio.Event() for _ in range(rounds) ]
+            acks = asyncio.Queue()
+            tasks = [ asyncio.get_running_loop().create_task(awaiter(events, acks)) for _ in range(waiters) ]
+            start = time.perf_counter()
+            await asetter(events, acks)
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(*tasks)
+            return elapsed
+        elapsed = asyncio.run(main())
+    else:
+        async def main():
+            events = [ curio.Event() for _ in range(rounds) ]
+            acks = curio.Queue()
+            tasks = [ await curio.spawn(awaiter, events, acks) for _ in range(waiters) ]
+            start = time.perf_counter()
+            await asetter(events, acks)
+            elapsed = time.perf_counter() - start
+            for t in tasks:
+                await t.join()
+            return elapsed
+        elapsed = curio.run(main)
+    return rounds * waiters / elapsed, 'wakeups/sec'
+
+# ------------------------------------------------------------------------
+# Reading lines from a socket
+
+def readline_throughput(impl):
+    n = count(50000)
+    line = b'x' * 63 + b'\n'
+    data = line * n
+
+    def writer(sock):
+        # A plain blocking socket
+        sock.sendall(data)
+        sock.close()
+
+    s1, s2 = _socket.socketpair()
+    t = threading.Thread(target=writer, args=(s2,))
+
+    if impl == 'thredo':
+        def main():
+            stream = thredo.io.Socket(s1).as_stream()
+            t.start()
+            start = time.perf_counter()
+            nlines = 0
+            while stream.readline():
+                nlines += 1
+            return time.perf_counter() - start
+        elapsed = thredo.run(main)
+    elif impl == 'threading':
+        f = s1.makefile('rb')
+        t.start()
+        start = time.perf_counter()
+        while f.readline():
+            pass
+        elapsed = time.perf_counter() - start
+        f.close()
+    elif impl == 'asyncio':
+        async def main():
+            reader, writer = await asyncio.open_unix_connection(sock=s1)
+            t.start()
+            start = time.perf_counter()
+            while await reader.readline():
+                pass
+            elapsed = time.perf_counter() - start
+            writer.close()
+            return elapsed
+        elapsed = asyncio.run(main())
+    else:
+        async def main():
+            stream = curio.io.Socket(s1).as_stream()
+            t.start()
+            start = time.perf_counter()
+            while await stream.readline():
+                pass
+            return time.perf_counter() - start
+        elapsed = curio.run(main)
+    t.join()
+    s1.close()
+    return n / elapsed, 'lines/sec'
+
+# ------------------------------------------------------------------------
+# Echo server.  Clients run in a separate process with blocking sockets
+# and record the latency of every request.
+
+ECHO_CLIENTS = 50
+ECHO_MSG = b'x' * 99 + b'\n'
+
+def _echo_client(address, nmessages, latencies):
+    sock = _socket.create_connection(address)
+    with sock:
+        for _ in range(nmessages):
+            start = time.perf_counter()
+            sock.sendall(ECHO_MSG)
+            nrecv = 0
+            while nrecv < len(ECHO_MSG):
+                nrecv += len(sock.recv(1000))
+            latencies.append(time.perf_counter() - start)
+
+def _echo_clients(address, nmessages, result):
+    latencies = [ [] for _ in range(ECHO_CLIENTS) ]
+    threads = [ threading.Thread(target=_echo_client, args=(address, nmessages, latencies[n]))
+                for n in range(ECHO_CLIENTS) ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    result.put((elapsed, [ x for lat in latencies for x in lat ]))
+
+def _start_clients(address, nmessages):
+    result = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_echo_clients, args=(address, nmessages, result))
+    p.start()
+    return p, result
+
+def _listener(sock):
+    sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(ECHO_CLIENTS)
+    return sock
+
+def echo_server(impl):
+    nmessages = count(200)
+
+    def handler(client):
+        with client:
+            while True:
+                data = client.recv(1000)
+                if not data:
+                    break
+                client.sendall(data)
+
+    if impl == 'thredo':
+        def main():
+            sock = _listener(thredo.socket.socket(_socket.AF_INET, _socket.SOCK_STREAM))
+            p, result = _start_clients(sock.getsockname(), nmessages)
+            for _ in range(ECHO_CLIENTS):
+                client, addr = sock.accept()
+                thredo.spawn(handler, client, daemon=True)
+            while p.is_alive():
+                thredo.sleep(0.05)
+            sock.close()
+            return result.get()
+        elapsed, latencies = thredo.run(main)
+    elif impl == 'threading':
+        sock = _listener(_socket.socket(_socket.AF_INET, _socket.SOCK_STREAM))
+        p, result = _start_clients(sock.getsockname(), nmessages)
+        for _ in range(ECHO_CLIENTS):
+            client, addr = sock.accept()
+            threading.Thread(target=handler, args=(client,), daemon=True).start()
+        p.join()
+        sock.close()
+        elapsed, latencies = result.get()
+    elif impl == 'asyncio':
+        async def ahandler(reader, writer):
+            while True:
+                data = await reader.read(1000)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+        async def main():
+            sock = _listener(_socket.socket(_socket.AF_INET, _socket.SOCK_STREAM))
+            server = await asyncio.start_server(ahandler, sock=sock)
+            p, result = _start_clients(sock.getsockname(), nmessages)
+            while p.is_alive():
+                await asyncio.sleep(0.05)
+            server.close()
+            return result.get()
+        elapsed, latencies = asyncio.run(main())
+    else:
+        async def ahandler(client):
+            async with client:
+                while True:
+                    data = await client.recv(1000)
+                    if not data:
+                        break
+                    await client.sendall(data)
+        async def main():
+            sock = _listener(curio.socket.socket(_socket.AF_INET, _socket.SOCK_STREAM))
+            p, result = _start_clients(sock.getsockname(), nmessages)
+            for _ in range(ECHO_CLIENTS):
+                client, addr = await sock.accept()
+                await curio.spawn(ahandler, client, daemon=True)
+            while p.is_alive():
+                await curio.sleep(0.05)
+            await sock.close()
+            return result.get()
+        elapsed, latencies = curio.run(main)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return ECHO_CLIENTS * nmessages / elapsed, 'requests/sec', { 'p99_latency_ms': p99 * 1000 }
+
+BENCHMARKS = [
+    spawn_join,
+    lock_pingpong,
+    queue_throughput,
+    event_fanout,
+    readline_throughput,
+    echo_server,
+    ]
+
+def run_one(bench, impl):
+    # Each benchmark runs in a fresh process so that one implementation
+    # doesn't leave threads or other state behind for the next one
+    ctx = multiprocessing.get_context('fork')
+    result = ctx.Queue()
+    def target():
+        try:
+            result.put(bench(impl))
+        except BaseException as e:
+            result.put(e)
+    p = ctx.Process(target=target)
+    p.start()
+    r = result.get()
+    p.join()
+    if isinstance(r, BaseException):
+        raise r
+    return r
+
+def main(argv):
+    global SCALE
+    parser = argparse.ArgumentParser(description='thredo benchmark suite')
+    parser.add_argument('--quick', action='store_true', help='run with reduced counts')
+    parser.add_argument('--json', metavar='FILE', help='write the results as JSON to FILE')
+    parser.add_argument('--impl', action='append', choices=IMPLS, help='implementation(s) to run')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    args = parser.parse_args(argv)
+    if args.quick:
+        SCALE = 0.1
+
+    benches = [ b for b in BENCHMARKS if not args.names or b.__name__ in args.names ]
+    impls = args.impl or IMPLS
+    results = { }
+    for bench in benches:
+        results[bench.__name__] = { }
+        for impl in impls:
+            r = run_one(bench, impl)
+            value, unit = r[:2]
+            entry = { 'value': value, 'unit': unit }
+            if len(r) > 2:
+                entry.update(r[2])
+            results[bench.__name__][impl] = entry
+            extra = ''.join('  %s=%.2f' % item for item in entry.items() if item[0] not in ('value', 'unit'))
+            print('%-20s %-10s %12.0f %s%s' % (bench.__name__, impl, value, unit, extra))
+            sys.stdout.flush()
+
+    if args.json:
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'curio': curio.__version__,
+            'scale': SCALE,
+            'time': time.time(),
+            'results': results,
+            }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+# test_contention.py
+
+import io
+
+import thredo
+from thredo import contention, sync
+
+def test_contention_profile():
+    def worker(lock):
+        with lock:
+            thredo.sleep(0.01)
+
+    def main():
+        hot = thredo.Lock()
+        cold = thredo.Lock()
+        threads = [ thredo.spawn(worker, hot) for n in range(4) ]
+        for t in threads:
+            t.join()
+        with cold:
+            pass
+
+    contention.enable()
+    try:
+        thredo.run(main)
+    finally:
+        contention.disable()
+    assert not contention.enabled()
+    stats = contention.stats()
+    contention.reset()
+    hot = stats[0]
+    assert hot['site'].endswith('test_contention.py:%d' % (main.__code__.co_firstlineno + 1))
+    assert hot['kind'] == 'Lock'
+    assert hot['acquired'] == 4
+    assert hot['contended'] == 3
+    # Each waits for the ones ahead of it
+    assert 0.05 <= hot['wait_total'] < 0.5
+    assert sum(hot['wait_hist'].values()) == 3
+    assert sum(hot['hold_hist'].values()) == 4
+    assert hot['hold_max'] >= 0.01
+    cold = stats[1]
+    assert cold['acquired'] == 1 and cold['contended'] == 0
+
+def test_contention_kinds():
+    def main():
+        cond = thredo.Condition()
+        rlock = thredo.RLock()
+        sema = thredo.BoundedSemaphore(2)
+        with cond:
+            pass
+        with rlock:
+            with rlock:
+                pass
+        with sema:
+            pass
+
+    contention.enable()
+    try:
+        thredo.run(main)
+    finally:
+        contention.disable()
+    kinds = { s['kind']: s for s in contention.stats() if s['site'].find('test_contention.py') >= 0 }
+    contention.reset()
+    assert set(kinds) == { 'Condition', 'RLock', 'BoundedSemaphore' }
+    # The RLock only takes its underlying lock once
+    assert kinds['RLock']['acquired'] == 1
+    assert kinds['BoundedSemaphore']['acquired'] == 1
+
+def test_contention_report():
+    def worker(lock):
+        with lock:
+            thredo.sleep(0.005)
+
+    def main():
+        lock = thredo.Lock()
+        threads = [ thredo.spawn(worker, lock) for n in range(3) ]
+        for t in threads:
+            t.join()
+
+    # Profiling has no effect on the classes once disabled
+    acquire = sync.Lock.acquire
+    contention.enable()
+    assert sync.Lock.acquire is not acquire
+    try:
+        thredo.run(main)
+    finally:
+        contention.disable()
+    assert sync.Lock.acquire is acquire
+    out = io.StringIO()
+    contention.report(file=out)
+    contention.reset()
+    lines = out.getvalue().splitlines()
+    assert lines[0].split()[:3] == ['kind', 'acquired', 'contended']
+    assert 'test_contention.py' in lines[1]
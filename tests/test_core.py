@@ -110,3 +110,547 @@ def test_ignore_context():
     thredo.run(main)
     end = time.time()
     assert (end-start) < 1
+
+def test_pool_reuse():
+    import threading
+    idents = set()
+    def child():
+        idents.add(threading.get_ident())
+
+    def main():
+        for n in range(5):
+            t = thredo.spawn(child)
+            t.join()
+
+    thredo.run(main)
+    assert len(idents) == 1
+
+def test_pool_size():
+    pool = thredo.ThreadPool(min_size=1, max_size=2, idle_timeout=0.1)
+    result = []
+    def child():
+        thredo.sleep(0.1)
+
+    def main():
+        result.append(pool.size)
+        threads = [thredo.spawn(child) for n in range(4)]
+        for t in threads:
+            t.join()
+        result.append(pool.idle)
+        thredo.sleep(0.5)
+        result.append(pool.size)
+
+    thredo.run(main, pool=pool)
+    assert result == [1, 2, 1]
+
+def test_pool_across_runs():
+    import threading
+    pool = thredo.ThreadPool()
+    idents = set()
+    def child():
+        idents.add(threading.get_ident())
+
+    def main():
+        thredo.spawn(child).join()
+
+    # A pool passed to run() is left running and can be used again
+    thredo.run(main, pool=pool)
+    thredo.run(main, pool=pool)
+    pool.shutdown()
+    assert len(idents) == 1
+
+def test_pool_cancel():
+    import threading
+    idents = []
+    result = []
+    def child():
+        idents.append(threading.get_ident())
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        t = thredo.spawn(child)
+        thredo.sleep(0.1)
+        t.cancel()
+        t = thredo.spawn(child)
+        thredo.sleep(0.1)
+        t.cancel()
+
+    thredo.run(main)
+    assert result == ['cancel', 'cancel']
+    assert idents[0] == idents[1]
+
+def test_batch(monkeypatch):
+    from thredo import thr
+    hops = []
+    real_await = thr.AWAIT
+    def counting_await(*args, **kwargs):
+        hops.append(args)
+        return real_await(*args, **kwargs)
+
+    result = []
+    def child():
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        threads = [thredo.spawn(child) for n in range(5)]
+        thredo.sleep(0.1)
+        monkeypatch.setattr(thr, 'AWAIT', counting_await)
+        with thredo.batch() as b:
+            for t in threads:
+                result.append(t.cancel())
+        result.append(len(hops))
+        result.append(b.results)
+
+    thredo.run(main)
+    assert result == [None]*5 + ['cancel']*5 + [1, [None]*5]
+
+def test_batch_flush():
+    lock = thredo.Lock()
+    result = []
+    seen = []
+    def sleeper():
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def holder():
+        with lock:
+            thredo.sleep(0.2)
+            seen.extend(result)
+
+    def main():
+        t1 = thredo.spawn(sleeper)
+        t2 = thredo.spawn(holder)
+        thredo.sleep(0.1)
+        with thredo.batch() as b:
+            t1.cancel()
+            # Blocks, so the cancel above must reach the kernel first
+            lock.acquire()
+            lock.release()
+        t2.join()
+        result.append(b.results)
+
+    thredo.run(main)
+    assert seen == ['cancel']
+    assert result == ['cancel', [None]]
+
+def test_await_many():
+    import curio
+    async def add(x, y):
+        return x + y
+    def main():
+        return thredo.await_many([(add, (1, 2), {}), (add, (3, 4), {}), (curio.sleep, (0,), {})])
+
+    assert thredo.run(main)[:2] == [3, 7]
+
+def test_threadgroup():
+    def child(x):
+        thredo.sleep(x)
+        return x
+
+    result = []
+    def main():
+        with thredo.ThreadGroup() as g:
+            for x in [0.3, 0.1, 0.2]:
+                g.spawn(child, x)
+            while True:
+                t = g.next_done()
+                if t is None:
+                    break
+                result.append(t.join())
+        result.append(g.completed is not None)
+
+    thredo.run(main)
+    assert result == [0.1, 0.2, 0.3, True]
+
+def test_threadgroup_error():
+    def child(x):
+        thredo.sleep(x)
+        return x + 'x'
+
+    def sleeper():
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+            raise
+
+    result = []
+    def main():
+        try:
+            with thredo.ThreadGroup() as g:
+                g.spawn(sleeper)
+                g.spawn(child, 0.1)
+        except thredo.ThreadGroupError as e:
+            result.append(type(e.failed[0]._exc))
+
+    thredo.run(main)
+    assert result == ['cancel', TypeError]
+
+def test_threadgroup_cancel_remaining():
+    result = []
+    def child():
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+            raise
+
+    def main():
+        g = thredo.ThreadGroup()
+        g.spawn(child)
+        g.spawn(child)
+        thredo.sleep(0.1)
+        g.cancel_remaining()
+        result.append(g.next_done())
+
+    thredo.run(main)
+    assert result == ['cancel', 'cancel', None]
+
+def test_kernels_spawn():
+    from thredo import kernel
+    def child(x):
+        thredo.sleep(0.1)
+        return (x, kernel.current().index)
+
+    def main():
+        threads = [thredo.spawn(child, x) for x in range(8)]
+        return [t.join() for t in threads]
+
+    result = thredo.run(main, kernels=4)
+    assert [x for x, k in result] == list(range(8))
+    assert {k for x, k in result} == {0, 1, 2, 3}
+
+def test_kernels_sync():
+    lock = thredo.Lock()
+    evt = thredo.Event()
+    q = thredo.Queue(maxsize=2)
+    n = 0
+    def incr(count):
+        nonlocal n
+        evt.wait()
+        while count > 0:
+            with lock:
+                n += 1
+            count -= 1
+
+    def producer():
+        for x in range(100):
+            q.put(x)
+        q.put(None)
+
+    def consumer():
+        total = 0
+        for x in q:
+            if x is None:
+                return total
+            total += x
+
+    def main():
+        threads = [thredo.spawn(incr, 10000) for x in range(4)]
+        evt.set()
+        for t in threads:
+            t.join()
+        thredo.spawn(producer)
+        return thredo.spawn(consumer).join()
+
+    assert thredo.run(main, kernels=3) == sum(range(100))
+    assert n == 40000
+
+def test_kernels_cancel_timeout():
+    result = []
+    def child():
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def timeout():
+        try:
+            thredo.timeout_after(0.1, thredo.sleep, 10)
+        except thredo.ThreadTimeout:
+            result.append('timeout')
+
+    def main():
+        t1 = thredo.spawn(child)
+        t2 = thredo.spawn(timeout)
+        thredo.sleep(0.2)
+        t1.cancel()
+        t2.join()
+
+    thredo.run(main, kernels=3)
+    assert sorted(result) == ['cancel', 'timeout']
+
+def test_kernels_threadgroup():
+    from thredo import kernel
+    def child(x):
+        thredo.sleep(0.1)
+        return kernel.current().index
+
+    def sleeper():
+        thredo.sleep(10)
+
+    def main():
+        g = thredo.ThreadGroup()
+        for x in range(4):
+            g.spawn(child, x)
+        kernels = set()
+        while True:
+            t = g.next_done()
+            if t is None:
+                break
+            kernels.add(t.join())
+        g = thredo.ThreadGroup()
+        for x in range(3):
+            g.spawn(sleeper)
+        g.cancel_remaining()
+        return kernels
+
+    assert thredo.run(main, kernels=2) == {0, 1}
+
+def test_enable_async_foreign_thread():
+    import threading
+    result = []
+    def foreign(evt):
+        evt.wait()
+        thredo.sleep(0.01)
+        result.append('done')
+
+    def main():
+        before = thredo.promotion_stats()['promotions']
+        evt = thredo.Event()
+        threads = [ threading.Thread(target=foreign, args=(evt,)) for n in range(4) ]
+        for t in threads:
+            t.start()
+        thredo.sleep(0.1)
+        evt.set()
+        for t in threads:
+            t.join()
+        return thredo.promotion_stats()['promotions'] - before
+
+    assert thredo.run(main) == 4
+    assert result == ['done'] * 4
+
+def test_prepromote():
+    import threading
+    def foreign():
+        thredo.sleep(0.01)
+
+    def main():
+        before = thredo.promotion_stats()
+        thredo.prepromote(3)
+        assert thredo.promotion_stats()['ready'] == 3
+        threads = [ threading.Thread(target=foreign) for n in range(3) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        after = thredo.promotion_stats()
+        return (after['prepromoted'] - before['prepromoted'], after['ready'])
+
+    assert thredo.run(main) == (3, 0)
+    stats = thredo.promotion_stats()
+    assert stats['max_latency'] >= stats['mean_latency'] > 0
+
+def test_thread_stats():
+    def child(lock):
+        thredo.sleep(0.05)
+        with lock:
+            pass
+
+    def main():
+        lock = thredo.Lock()
+        with lock:
+            t = thredo.spawn(child, lock)
+            thredo.sleep(0.1)
+        t.join()
+        return t.stats, thredo.stats()
+
+    tstats, allstats = thredo.run(main)
+    assert tstats['traps'] == { 'sleep': 1, 'lock': 1 }
+    assert tstats['hops'] == 2
+    assert tstats['blocked'] >= 0.05
+    assert tstats['running'] >= 0
+    assert allstats['threads'] >= 2
+    assert allstats['traps']['sleep'] >= 2
+    assert allstats['hops'] >= tstats['hops']
+
+def test_thread_stats_running():
+    def spin(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def child():
+        # Running time before the first and after the last hop counts
+        spin(0.1)
+        thredo.sleep(0)
+        spin(0.1)
+
+    def main():
+        t = thredo.spawn(child)
+        t.join()
+        return t.stats
+
+    stats = thredo.run(main)
+    assert stats['hops'] == 1
+    assert stats['running'] >= 0.2
+
+def test_timeout_lock():
+    result = []
+    def main():
+        lock = thredo.Lock()
+        lock.acquire()
+        try:
+            with thredo.timeout_after(0.1):
+                lock.acquire()
+        except thredo.ThreadTimeout:
+            result.append('timeout')
+        lock.release()
+        # The timed out waiter must not have been left behind
+        with thredo.timeout_after(0.1):
+            lock.acquire()
+        result.append(lock.locked())
+
+    thredo.run(main)
+    assert result == ['timeout', True]
+
+def test_timeout_nested():
+    result = []
+    def main():
+        try:
+            with thredo.timeout_after(0.1):
+                with thredo.ignore_after(5) as t:
+                    thredo.sleep(1)
+                result.append('not here')
+        except thredo.ThreadTimeout:
+            result.append('outer')
+        result.append(t.expired)
+        with thredo.ignore_after(0.05) as t:
+            with thredo.timeout_after(5):
+                thredo.sleep(1)
+        result.append(t.expired)
+        result.append(thredo.ignore_after(0.05, thredo.sleep, 1, timeout_result='ignored'))
+
+    thredo.run(main)
+    assert result == ['outer', False, True, 'ignored']
+
+def test_timeout_no_hops():
+    from thredo import thr
+    def main():
+        q = thredo.Queue()
+        before = thr.thread_stats(thr._locals.thread).hops
+        for n in range(100):
+            with thredo.timeout_after(1):
+                q.put(n)
+                q.get()
+        return thr.thread_stats(thr._locals.thread).hops - before
+
+    assert thredo.run(main) == 0
+
+def test_sleep_resolution():
+    def main():
+        start = time.monotonic()
+        thredo.sleep(0.01)
+        return time.monotonic() - start
+
+    assert 0.01 <= thredo.run(main) < 0.1
+    assert 0.01 <= thredo.run(main, timer_resolution=0.05) < 0.2
+
+def test_timer_wheel():
+    from thredo.timer import TimerWheel
+    fired = []
+    wheel = TimerWheel(0.1)
+    t1 = wheel.add(1.0, lambda: fired.append(1))
+    t2 = wheel.add(1.05, lambda: fired.append(2))
+    t3 = wheel.add(2.0, lambda: fired.append(3))
+    assert len(wheel) == 3
+    wheel.cancel(t2)
+    wheel.expire(0.95)
+    assert fired == []
+    wheel.expire(1.1)
+    assert fired == [1]
+    wheel.expire(5.0)
+    assert fired == [1, 3]
+    assert len(wheel) == 0
+
+def test_threadgroup_iter():
+    def child(x):
+        thredo.sleep(x)
+        return x
+
+    def main():
+        g = thredo.ThreadGroup()
+        for x in [0.2, 0.1, 0.0]:
+            g.spawn(child, x)
+        return [ t.join() for t in g ]
+
+    assert thredo.run(main) == [0.0, 0.1, 0.2]
+
+def test_threadgroup_map():
+    running = []
+    peak = []
+    taken = []
+    def items():
+        for n in range(50):
+            taken.append(n)
+            yield n
+
+    def child(x):
+        running.append(x)
+        peak.append(len(running))
+        thredo.sleep(0.01 * (x % 3))
+        running.remove(x)
+        return x * 2
+
+    def main():
+        g = thredo.ThreadGroup()
+        results = g.map(child, items(), limit=5)
+        first = next(results)
+        ahead = len(taken)
+        return first, ahead, sorted([first] + list(results))
+
+    first, ahead, results = thredo.run(main)
+    assert ahead <= 6
+    assert max(peak) <= 5
+    assert results == [ n * 2 for n in range(50) ]
+
+def test_threadgroup_map_ordered():
+    def child(x):
+        thredo.sleep(0.01 * (x % 4))
+        return x
+
+    def main():
+        g = thredo.ThreadGroup()
+        return list(g.map(child, range(20), limit=4, ordered=True))
+
+    assert thredo.run(main) == list(range(20))
+
+def test_threadgroup_map_error():
+    cancelled = []
+    def child(x):
+        if x == 3:
+            raise ValueError(x)
+        try:
+            thredo.sleep(10)
+        except thredo.ThreadCancelled:
+            cancelled.append(x)
+            raise
+
+    def main():
+        g = thredo.ThreadGroup()
+        try:
+            list(g.map(child, range(100), limit=5))
+            assert False
+        except ValueError:
+            pass
+
+    thredo.run(main)
+    assert sorted(cancelled) == [0, 1, 2, 4]
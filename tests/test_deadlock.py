@@ -0,0 +1,109 @@
+# test_deadlock.py
+
+import logging
+
+import thredo
+from thredo import deadlock
+
+def test_deadlock_two_threads():
+    cycles = []
+    result = []
+    def worker(first, second):
+        try:
+            with first:
+                thredo.sleep(0.02)
+                with second:
+                    result.append('done')
+        except deadlock.DeadlockError as e:
+            result.append('deadlock')
+
+    def main():
+        a = thredo.Lock()
+        b = thredo.RLock()
+        t1 = thredo.spawn(worker, a, b)
+        t2 = thredo.spawn(worker, b, a)
+        t1.join()
+        t2.join()
+
+    deadlock.enable(callback=cycles.append)
+    try:
+        thredo.run(main)
+    finally:
+        deadlock.disable()
+    # One thread is told about the deadlock. The other then goes ahead
+    assert sorted(result) == ['deadlock', 'done']
+    assert len(cycles) == 1
+    cycle = cycles[0]
+    assert len(cycle) == 2
+    for ident, lock, stack in cycle:
+        assert any(frame.line == 'with second:' for frame in stack)
+
+def test_deadlock_self():
+    def main():
+        lock = thredo.Lock()
+        lock.acquire()
+        try:
+            lock.acquire()
+            assert False
+        except deadlock.DeadlockError as e:
+            assert len(e.cycle) == 1
+        assert lock.locked()
+        lock.release()
+        assert not lock.locked()
+
+    deadlock.enable(callback=lambda cycle: None)
+    try:
+        thredo.run(main)
+    finally:
+        deadlock.disable()
+
+def test_deadlock_log(caplog):
+    def worker(first, second):
+        with first:
+            thredo.sleep(0.02)
+            with second:
+                pass
+
+    def main():
+        a = thredo.Lock()
+        b = thredo.Lock()
+        t1 = thredo.spawn(worker, a, b)
+        t2 = thredo.spawn(worker, b, a)
+        thredo.sleep(0.1)
+        # Both threads are still stuck. Break the deadlock.
+        t1.cancel()
+        t2.join()
+
+    deadlock.enable(raise_error=False)
+    try:
+        with caplog.at_level(logging.ERROR, logger='thredo.deadlock'):
+            thredo.run(main)
+    finally:
+        deadlock.disable()
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith('Deadlock between 2 threads')
+    assert message.count('with second:') == 2
+
+def test_deadlock_no_false_alarm():
+    result = []
+    def worker(a, b):
+        for n in range(50):
+            with a:
+                with b:
+                    result.append(n)
+                thredo.sleep(0)
+
+    def main():
+        a = thredo.Lock()
+        b = thredo.Lock()
+        threads = [ thredo.spawn(worker, a, b) for n in range(4) ]
+        for t in threads:
+            t.join()
+
+    deadlock.enable()
+    try:
+        thredo.run(main)
+    finally:
+        deadlock.disable()
+    assert len(result) == 200
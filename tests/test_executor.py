@@ -0,0 +1,120 @@
+# test_executor.py
+
+import time
+import threading
+from concurrent import futures
+import thredo
+
+def test_submit():
+    def main():
+        with thredo.ThredoExecutor(max_workers=4) as ex:
+            f1 = ex.submit(pow, 2, 10)
+            f2 = ex.submit(int, 'x')
+            return f1.result(), type(f2.exception())
+
+    assert thredo.run(main) == (1024, ValueError)
+
+def test_max_workers():
+    active = []
+    peak = []
+    def work(n):
+        active.append(n)
+        peak.append(len(active))
+        thredo.sleep(0.01)
+        active.remove(n)
+        return n
+
+    def main():
+        with thredo.ThredoExecutor(max_workers=3) as ex:
+            fs = [ ex.submit(work, n) for n in range(12) ]
+        return [ f.result() for f in fs ]
+
+    assert thredo.run(main) == list(range(12))
+    assert max(peak) == 3
+
+def test_cancel_running():
+    result = []
+    def work(evt):
+        try:
+            evt.wait()
+        except thredo.ThreadCancelled:
+            result.append('cancelled')
+            raise
+
+    def main():
+        evt = thredo.Event()
+        with thredo.ThredoExecutor(max_workers=1) as ex:
+            f1 = ex.submit(work, evt)
+            f2 = ex.submit(work, evt)
+            thredo.sleep(0.1)
+            assert f1.running()
+            assert f2.cancel()
+            assert f1.cancel()
+            assert f1.cancelled()
+            try:
+                f1.result()
+                assert False
+            except futures.CancelledError:
+                pass
+
+    thredo.run(main)
+    assert result == ['cancelled']
+
+def test_map_streaming():
+    submitted = []
+    def numbers():
+        for n in range(1000):
+            submitted.append(n)
+            yield n
+
+    def main():
+        with thredo.ThredoExecutor(max_workers=2) as ex:
+            results = ex.map(lambda x: x * x, numbers(), prefetch=4)
+            first = [ next(results) for _ in range(3) ]
+            pending = len(submitted)
+            rest = list(results)
+        return first, pending, rest
+
+    first, pending, rest = thredo.run(main)
+    assert first == [0, 1, 4]
+    assert pending <= 7
+    assert rest == [ n * n for n in range(3, 1000) ]
+
+def test_map_timeout():
+    def main():
+        with thredo.ThredoExecutor(max_workers=2) as ex:
+            try:
+                list(ex.map(thredo.sleep, [0.01, 10], timeout=0.2))
+                assert False
+            except futures.TimeoutError:
+                return True
+
+    start = time.time()
+    assert thredo.run(main)
+    assert time.time() - start < 2
+
+def test_submit_foreign_thread():
+    def main():
+        result = []
+        with thredo.ThredoExecutor() as ex:
+            t = threading.Thread(target=lambda: result.append(ex.submit(pow, 3, 2).result()))
+            t.start()
+            t.join()
+        return result
+
+    assert thredo.run(main) == [9]
+
+def test_shutdown():
+    def main():
+        ex = thredo.ThredoExecutor(max_workers=1)
+        f1 = ex.submit(thredo.sleep, 0.1)
+        f2 = ex.submit(thredo.sleep, 0.1)
+        ex.shutdown(cancel_futures=True)
+        try:
+            ex.submit(pow, 2, 2)
+            assert False
+        except RuntimeError:
+            pass
+        return f1.done(), f2.cancelled()
+
+    assert thredo.run(main) == (True, True)
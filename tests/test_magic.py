@@ -0,0 +1,317 @@
+# test_magic.py
+
+import sys
+import threading
+import queue
+import time
+import select
+import socket
+import ssl
+import shutil
+import subprocess
+import http.client
+import http.server
+import socketserver
+import urllib.request
+import smtplib
+
+import pytest
+
+import thredo
+from thredo import magic
+
+_sleep = time.sleep
+
+@pytest.fixture(autouse=True)
+def unpatch():
+    yield
+    magic.unpatch()
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/hang':
+            self.server.hung.wait()
+        body = ('hello %s' % self.path).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _serve_http(context=None):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    if context:
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.daemon_threads = True
+    server.hung = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.fixture
+def http_server():
+    server = _serve_http()
+    yield server
+    server.hung.set()
+    server.shutdown()
+    server.server_close()
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b'220 localhost ready\r\n')
+        data = False
+        for line in self.rfile:
+            if data:
+                if line == b'.\r\n':
+                    data = False
+                    self.wfile.write(b'250 queued\r\n')
+                else:
+                    self.server.messages.append(line)
+                continue
+            command = line[:4].upper()
+            if command == b'DATA':
+                data = True
+                self.wfile.write(b'354 go ahead\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 ok\r\n')
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_magic_sleep():
+    results = []
+    def child():
+        try:
+            time.sleep(10)
+        except thredo.ThreadCancelled:
+            results.append('cancelled')
+
+    def main():
+        with magic.more_magic('time'):
+            t = thredo.spawn(child)
+            thredo.sleep(0.05)
+            start = time.monotonic()
+            t.cancel()
+            results.append(time.monotonic() - start < 1)
+            try:
+                with thredo.timeout_after(0.05):
+                    time.sleep(10)
+            except thredo.ThreadTimeout:
+                results.append('timeout')
+
+    thredo.run(main)
+    assert results == [ 'cancelled', True, 'timeout' ]
+    assert time.sleep is _sleep
+
+def test_magic_only_thredo_threads():
+    results = []
+    def main():
+        with magic.more_magic('threading', 'queue'):
+            results.append(isinstance(threading.Lock(), thredo.Lock))
+            results.append(isinstance(threading.Event(), thredo.Event))
+            results.append(isinstance(queue.Queue(), thredo.Queue))
+            def native():
+                results.append(isinstance(threading.Lock(), thredo.Lock))
+                results.append(isinstance(threading.Event(), threading.Event))
+            t = threading.Thread(target=native)
+            t.start()
+            t.join()
+            # Subclasses keep working
+            class MyEvent(threading.Event):
+                pass
+            results.append(isinstance(MyEvent(), threading.Event))
+        results.append(isinstance(threading.Event(), thredo.Event))
+
+    thredo.run(main)
+    assert results == [ True, True, True, False, True, True, False ]
+
+def test_magic_threading_timeouts():
+    results = []
+    def main():
+        with magic.more_magic('threading', 'queue'):
+            lock = threading.Lock()
+            lock.acquire()
+            results.append(lock.acquire(False))
+            results.append(lock.acquire(timeout=0.05))
+            lock.release()
+            results.append(lock.acquire(timeout=0.05))
+
+            evt = threading.Event()
+            results.append(evt.wait(0.05))
+            thredo.spawn(evt.set)
+            results.append(evt.wait(1))
+
+            sema = threading.BoundedSemaphore(2)
+            results.append(sema.acquire() and sema.acquire())
+            results.append(sema.acquire(timeout=0.05))
+
+            cond = threading.Condition()
+            items = []
+            def producer():
+                with cond:
+                    items.append(1)
+                    cond.notify()
+            with cond:
+                results.append(cond.wait(0.05))
+                thredo.spawn(producer)
+                results.append(cond.wait_for(lambda: items, timeout=1))
+
+            q = queue.Queue(maxsize=1)
+            q.put_nowait(1)
+            try:
+                q.put(2, timeout=0.05)
+            except queue.Full:
+                results.append('full')
+            results.append(q.get_nowait())
+            try:
+                q.get(timeout=0.05)
+            except queue.Empty:
+                results.append('empty')
+
+    thredo.run(main)
+    assert results == [ False, False, True,
+                        False, True,
+                        True, False,
+                        False, [1],
+                        'full', 1, 'empty' ]
+
+def test_magic_select():
+    results = []
+    def main():
+        with magic.more_magic('select'):
+            s1, s2 = socket.socketpair()
+            start = time.monotonic()
+            results.append(select.select([s1], [], [], 0.1))
+            results.append(time.monotonic() - start >= 0.1)
+            def writer():
+                thredo.sleep(0.05)
+                s2.send(b'x')
+            thredo.spawn(writer)
+            results.append(select.select([s1], [], []))
+            results.append(select.select([], [s2], [], 0))
+            s1.close()
+            s2.close()
+
+    thredo.run(main)
+    r, _, _ = results[2]
+    assert results[0] == ([], [], [])
+    assert results[1]
+    assert len(r) == 1
+    assert len(results[3][1]) == 1
+
+def test_magic_http_client(http_server):
+    results = []
+    host, port = http_server.server_address
+    def fetch(path):
+        conn = http.client.HTTPConnection(host, port)
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        results.append((resp.status, resp.read()))
+        conn.close()
+
+    def main():
+        with magic.more_magic('all'):
+            g = thredo.ThreadGroup()
+            for n in range(5):
+                g.spawn(fetch, '/%d' % n)
+            g.join()
+            with urllib.request.urlopen('http://%s:%d/url' % (host, port)) as f:
+                results.append(f.read())
+
+    thredo.run(main)
+    assert sorted(results[:5]) == [ (200, b'hello /%d' % n) for n in range(5) ]
+    assert results[5] == b'hello /url'
+
+def test_magic_http_timeout(http_server):
+    results = []
+    host, port = http_server.server_address
+    def main():
+        with magic.more_magic('all'):
+            try:
+                with thredo.timeout_after(0.2):
+                    urllib.request.urlopen('http://%s:%d/hang' % (host, port))
+            except thredo.ThreadTimeout:
+                results.append('timeout')
+
+    thredo.run(main)
+    assert results == [ 'timeout' ]
+
+@pytest.mark.skipif(sys.version_info < (3, 11), reason='all_errors requires Python 3.11')
+def test_magic_connect_timeout():
+    # Connections beyond the backlog of a listener that never accepts
+    # are left hanging
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+    host, port = listener.getsockname()
+    filler = socket.create_connection((host, port))
+    results = []
+    def main():
+        with magic.more_magic('all'):
+            start = time.monotonic()
+            conn = http.client.HTTPConnection(host, port, timeout=0.1)
+            try:
+                conn.connect()
+            except socket.timeout:
+                results.append(time.monotonic() - start)
+            try:
+                socket.create_connection((host, port), timeout=0.1, all_errors=True)
+            except ExceptionGroup as e:
+                results.append([ type(exc) for exc in e.exceptions ])
+
+    try:
+        thredo.run(main)
+    finally:
+        filler.close()
+        listener.close()
+    assert results[0] < 1.0
+    assert results[1] == [ socket.timeout ]
+
+def test_magic_smtplib(smtp_server):
+    host, port = smtp_server.server_address
+    def main():
+        with magic.more_magic('all'):
+            with smtplib.SMTP(host, port) as smtp:
+                smtp.sendmail('a@example.com', ['b@example.com'], 'Subject: hi\r\n\r\nhello\r\n')
+
+    thredo.run(main)
+    assert b'hello\r\n' in smtp_server.messages
+
+@pytest.mark.skipif(shutil.which('openssl') is None, reason='openssl not available')
+def test_magic_https(tmp_path):
+    certfile = str(tmp_path / 'cert.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', certfile, '-out', certfile],
+                   check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    server = _serve_http(context)
+    host, port = server.server_address
+    results = []
+    def main():
+        with magic.more_magic('all'):
+            client = ssl.create_default_context()
+            client.check_hostname = False
+            client.verify_mode = ssl.CERT_NONE
+            conn = http.client.HTTPSConnection(host, port, context=client)
+            conn.request('GET', '/secure')
+            results.append(conn.getresponse().read())
+            conn.close()
+
+    try:
+        thredo.run(main)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert results == [ b'hello /secure' ]
@@ -0,0 +1,101 @@
+# test_process.py
+
+import os
+import time
+import thredo
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+    return os.getpid()
+
+def fail():
+    raise ValueError('bad')
+
+def test_run_in_process():
+    def main():
+        return thredo.run_in_process(pow, 2, 10)
+
+    assert thredo.run(main) == 1024
+
+def test_run_in_process_error():
+    def main():
+        try:
+            thredo.run_in_process(fail)
+            assert False
+        except ValueError as e:
+            return str(e)
+
+    assert thredo.run(main) == 'bad'
+
+def test_run_in_process_timeout():
+    def main():
+        pid = thredo.run_in_process(os.getpid)
+        try:
+            thredo.timeout_after(0.2, thredo.run_in_process, spin, 10)
+            assert False
+        except thredo.ThreadTimeout:
+            pass
+        # The worker was killed and is replaced
+        return pid, thredo.run_in_process(os.getpid)
+
+    pool = thredo.ProcessPool(1)
+    start = time.time()
+    try:
+        pid1, pid2 = thredo.run(main, process_pool=pool)
+    finally:
+        pool.shutdown()
+    assert time.time() - start < 5
+    assert pid1 != pid2
+
+def test_run_in_process_cancel():
+    def main():
+        t = thredo.spawn(thredo.run_in_process, spin, 10)
+        thredo.sleep(0.2)
+        t.cancel()
+        return thredo.run_in_process(pow, 3, 2)
+
+    pool = thredo.ProcessPool(1)
+    start = time.time()
+    try:
+        assert thredo.run(main, process_pool=pool) == 9
+    finally:
+        pool.shutdown()
+    assert time.time() - start < 5
+
+def test_process_recycle():
+    def main():
+        return [ thredo.run_in_process(os.getpid) for n in range(4) ]
+
+    pool = thredo.ProcessPool(1, max_tasks=2)
+    try:
+        pids = thredo.run(main, process_pool=pool)
+    finally:
+        pool.shutdown()
+    assert pids[0] == pids[1]
+    assert pids[1] != pids[2]
+    assert pids[2] == pids[3]
+
+def test_process_pool_size():
+    def main():
+        g = thredo.ThreadGroup()
+        for n in range(4):
+            g.spawn(thredo.run_in_process, spin, 0.1)
+        return { t.join() for t in g }
+
+    pool = thredo.ProcessPool(2)
+    try:
+        assert len(thredo.run(main, process_pool=pool)) <= 2
+    finally:
+        pool.shutdown()
+
+def test_process_pool_reuse():
+    # A pool passed to run() is left running
+    pool = thredo.ProcessPool(1)
+    try:
+        pid1 = thredo.run(thredo.run_in_process, os.getpid, process_pool=pool)
+        pid2 = thredo.run(thredo.run_in_process, os.getpid, process_pool=pool)
+    finally:
+        pool.shutdown()
+    assert pid1 == pid2
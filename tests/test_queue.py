@@ -1,6 +1,10 @@
 # test_queue.py
 
+import asyncio
+import threading
+
 import thredo
+from curio.thread import is_async_thread
 
 def test_queue_simple():
     results = []
@@ -100,3 +104,467 @@ def test_queue_join_cancel():
     
 
 
+def test_queue_put_many():
+    results = []
+    def consumer(q):
+        for item in q:
+            if item is None:
+                break
+            results.append(item)
+
+    def main():
+        q = thredo.Queue()
+        t = thredo.spawn(consumer, q)
+        q.put_many([0, 1, 2, None])
+        t.join()
+
+    thredo.run(main)
+    assert results == [0, 1, 2]
+
+def test_queue_bounded_race():
+    results = []
+    def producer(q, start):
+        for n in range(start, start+1000):
+            q.put(n)
+
+    def consumer(q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            results.append(item)
+            q.task_done()
+        q.task_done()
+
+    def main():
+        q = thredo.Queue(maxsize=1)
+        consumers = [thredo.spawn(consumer, q) for n in range(3)]
+        producers = [thredo.spawn(producer, q, n*1000) for n in range(3)]
+        for t in producers:
+            t.join()
+        q.put_many([None]*3)
+        q.join()
+        for t in consumers:
+            t.join()
+
+    thredo.run(main)
+    assert sorted(results) == list(range(3000))
+
+def test_queue_get_many():
+    results = []
+    def consumer(q):
+        while True:
+            items = q.get_many(10, min_items=3)
+            results.append(items)
+            q.task_done(len(items))
+            if None in items:
+                break
+
+    def main():
+        q = thredo.Queue()
+        assert q.get_many(5, min_items=0) == []
+        q.put_many(range(12))
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        q.put(12)
+        thredo.sleep(0.01)
+        # Not enough items yet
+        assert len(results) == 2
+        q.put_many([13, 14, None])
+        q.join()
+        t.join()
+
+    thredo.run(main)
+    assert results == [list(range(10)), [10, 11, 12], [13, 14, None]]
+
+def test_queue_put_many_bounded():
+    results = []
+    def consumer(q):
+        while True:
+            items = q.get_many(4)
+            results.extend(items)
+            if None in items:
+                break
+
+    def main():
+        q = thredo.Queue(maxsize=3)
+        t = thredo.spawn(consumer, q)
+        q.put_many(list(range(100)) + [None])
+        t.join()
+
+    thredo.run(main)
+    assert results == list(range(100)) + [None]
+
+def test_queue_get_many_cancel():
+    results = []
+    def consumer(q):
+        try:
+            q.get_many(10, min_items=5)
+        except thredo.ThreadCancelled:
+            results.append('cancel')
+
+    def main():
+        q = thredo.Queue()
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        q.put_many([0, 1])
+        thredo.sleep(0.01)
+        t.cancel()
+        # Items taken by the cancelled thread are put back in order
+        results.append(q.get_many(10))
+
+    thredo.run(main)
+    assert results == ['cancel', [0, 1]]
+
+def test_queue_task_done_many():
+    def main():
+        q = thredo.Queue()
+        q.put_many(range(5))
+        q.get_many(5)
+        try:
+            q.task_done(6)
+            assert False
+        except ValueError:
+            pass
+        q.task_done(5)
+        q.join()
+
+    thredo.run(main)
+
+def test_lifo_queue():
+    def main():
+        q = thredo.LifoQueue()
+        q.put_many(range(5))
+        assert q.get() == 4
+        assert q.get_many(10) == [3, 2, 1, 0]
+
+    thredo.run(main)
+
+def test_priority_queue():
+    results = []
+    def consumer(q):
+        while True:
+            priority, item = q.get()
+            if item is None:
+                break
+            results.append(item)
+
+    def main():
+        q = thredo.PriorityQueue()
+        q.put_many([(3, 'c'), (1, 'a'), (2, 'b'), (9, None)])
+        t = thredo.spawn(consumer, q)
+        t.join()
+        assert q.empty()
+        # A waiting getter is handed the next item directly
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        q.put((5, 'x'))
+        q.put((0, None))
+        t.join()
+
+    thredo.run(main)
+    assert results == ['a', 'b', 'c', 'x']
+
+def test_coalescing_queue():
+    results = []
+    def consumer(q):
+        while True:
+            key, value = q.get()
+            results.append((key, value))
+            q.task_done()
+            if key is None:
+                break
+
+    def main():
+        q = thredo.CoalescingQueue(maxsize=2, key=lambda item: item[0])
+        q.put(('a', 1))
+        q.put(('b', 1))
+        # Replacing queued items never waits for room
+        q.put(('a', 2))
+        q.put_many([('b', 2), ('a', 3)])
+        assert q.qsize() == 2
+        t = thredo.spawn(consumer, q)
+        q.put((None, None))
+        q.join()
+        t.join()
+
+    thredo.run(main)
+    # Latest values, in the order the keys were first put
+    assert results == [('a', 3), ('b', 2), (None, None)]
+
+def test_coalescing_queue_cancel():
+    results = []
+    def consumer(q):
+        try:
+            q.get_many(10, min_items=2)
+        except thredo.ThreadCancelled:
+            results.append('cancel')
+
+    def main():
+        q = thredo.CoalescingQueue()
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        q.put('x')
+        thredo.sleep(0.01)
+        t.cancel()
+        q.put('x')
+        q.put('y')
+        results.append(q.get_many(10))
+        q.task_done(2)
+        q.join()
+
+    thredo.run(main)
+    assert results == ['cancel', ['x', 'y']]
+
+def test_queue_close():
+    results = []
+    def consumer(q):
+        for item in q:
+            results.append(item)
+        results.append('closed')
+
+    def main():
+        q = thredo.Queue()
+        threads = [ thredo.spawn(consumer, q) for n in range(10) ]
+        q.put_many(range(5))
+        thredo.sleep(0.01)
+        q.close()
+        assert q.closed
+        for t in threads:
+            t.join()
+        try:
+            q.put(5)
+            assert False
+        except thredo.QueueClosed:
+            pass
+
+    thredo.run(main)
+    assert sorted(results[:5]) == list(range(5))
+    assert results[5:] == ['closed'] * 10
+
+def test_queue_close_drain():
+    results = []
+    def putter(q):
+        try:
+            q.put('x')
+        except thredo.QueueClosed:
+            results.append('put closed')
+
+    def main():
+        q = thredo.Queue(maxsize=2)
+        q.put_many([0, 1])
+        t = thredo.spawn(putter, q)
+        thredo.sleep(0.01)
+        q.close()
+        t.join()
+        # Remaining items can still be taken
+        results.append(q.get_many(10, min_items=5))
+        try:
+            q.get()
+            assert False
+        except thredo.QueueClosed:
+            results.append('get closed')
+        try:
+            q.get_many(10, min_items=0)
+            assert False
+        except thredo.QueueClosed:
+            results.append('get_many closed')
+
+    thredo.run(main)
+    assert results == ['put closed', [0, 1], 'get closed', 'get_many closed']
+
+def test_queue_close_get_many():
+    results = []
+    def consumer(q):
+        results.append(q.get_many(10, min_items=3))
+
+    def main():
+        q = thredo.Queue()
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        q.put(0)
+        thredo.sleep(0.01)
+        q.close()
+        t.join()
+
+    thredo.run(main)
+    assert results == [[0]]
+
+def test_byte_queue():
+    results = []
+    def producer(q):
+        for size in [40, 40, 40, 200, 10]:
+            q.put(b'x' * size)
+        q.close()
+
+    def main():
+        q = thredo.ByteQueue(100)
+        t = thredo.spawn(producer, q)
+        thredo.sleep(0.01)
+        # Only two of the items fit
+        assert q.qsize() == 2 and q.nbytes == 80 and q.full() is False
+        for item in q:
+            results.append(len(item))
+            thredo.sleep(0.01)
+            # The 200 byte item only goes in once the queue is empty
+            assert q.nbytes <= 100 or q.qsize() == 1
+        t.join()
+
+    thredo.run(main)
+    assert results == [40, 40, 40, 200, 10]
+
+def test_byte_queue_watermarks():
+    marks = []
+    def main():
+        q = thredo.ByteQueue(1000, sizeof=lambda item: item, high_water=50, low_water=20,
+                             on_high=lambda q: marks.append(('high', q.nbytes)),
+                             on_low=lambda q: marks.append(('low', q.nbytes)))
+        q.put_many([30, 30, 30])
+        assert q.get() == 30
+        assert q.get() == 30
+        q.put(10)
+        assert q.get() == 30
+        assert q.get_many(10) == [10]
+
+    thredo.run(main)
+    assert marks == [('high', 60), ('low', 10)]
+
+def test_byte_queue_default_watermarks():
+    marks = []
+    def main():
+        q = thredo.ByteQueue(10, sizeof=lambda item: item,
+                             on_high=lambda q: marks.append(('high', q.nbytes)),
+                             on_low=lambda q: marks.append(('low', q.nbytes)))
+        q.put(4)
+        q.put(6)
+        # Full. The putter has to wait
+        t = thredo.spawn(q.put, 3)
+        thredo.sleep(0.01)
+        assert marks == [('high', 10)]
+        assert q.nbytes == 10
+        assert q.get() == 4
+        t.join()
+        assert q.get() == 6
+        assert q.get() == 3
+
+    thredo.run(main)
+    assert marks == [('high', 10), ('low', 3)]
+
+def test_byte_queue_cancel_close():
+    results = []
+    def putter(q, size):
+        try:
+            q.put(b'x' * size)
+            results.append(size)
+        except thredo.ThreadCancelled:
+            results.append('cancel')
+        except thredo.QueueClosed:
+            results.append('closed')
+
+    def main():
+        q = thredo.ByteQueue(10)
+        q.put(b'x' * 8)
+        t1 = thredo.spawn(putter, q, 5)
+        thredo.sleep(0.01)
+        t2 = thredo.spawn(putter, q, 2)
+        thredo.sleep(0.01)
+        # The small item waits behind the larger one
+        assert results == []
+        t1.cancel()
+        t2.join()
+        t3 = thredo.spawn(putter, q, 5)
+        thredo.sleep(0.01)
+        q.close()
+        t3.join()
+        assert q.get_many(10) == [b'x' * 8, b'x' * 2]
+
+    thredo.run(main)
+    assert results == ['cancel', 2, 'closed']
+
+def test_universal_queue_threads():
+    results = []
+    def producer(q):
+        for n in range(100):
+            q.put(n)
+        q.put(None)
+        q.join()
+        # Never promoted to a thredo thread
+        results.append(is_async_thread())
+
+    def main():
+        q = thredo.UniversalQueue(maxsize=5)
+        t = threading.Thread(target=producer, args=(q,))
+        t.start()
+        while True:
+            item = q.get()
+            q.task_done()
+            if item is None:
+                break
+            results.append(item)
+        t.join()
+
+    thredo.run(main)
+    assert results == list(range(100)) + [False]
+
+def test_universal_queue_asyncio():
+    results = []
+    async def echo(inq, outq):
+        while True:
+            item = await inq.get()
+            await outq.put(item)
+            if item is None:
+                break
+
+    def main():
+        inq = thredo.UniversalQueue()
+        outq = thredo.UniversalQueue(maxsize=2)
+        t = threading.Thread(target=asyncio.run, args=(echo(inq, outq),))
+        t.start()
+        inq.put_many(list(range(20)) + [None])
+        while True:
+            item = outq.get()
+            if item is None:
+                break
+            results.append(item)
+        t.join()
+
+    thredo.run(main)
+    assert results == list(range(20))
+
+def test_universal_queue_cancel():
+    results = []
+    def consumer(q):
+        try:
+            results.append(q.get())
+        except thredo.ThreadCancelled:
+            results.append('cancel')
+
+    def producer(q):
+        q.put(1)
+
+    def main():
+        q = thredo.UniversalQueue()
+        t = thredo.spawn(consumer, q)
+        thredo.sleep(0.01)
+        t.cancel()
+        p = threading.Thread(target=producer, args=(q,))
+        p.start()
+        p.join()
+        assert q.get() == 1
+
+    thredo.run(main)
+    assert results == ['cancel']
+
+def test_universal_queue_asyncio_cancel():
+    async def main(q):
+        try:
+            await asyncio.wait_for(q.get(), 0.01)
+            assert False
+        except asyncio.TimeoutError:
+            pass
+        # The cancelled getter doesn't take the item
+        await q.put(1)
+        return await q.get()
+
+    q = thredo.UniversalQueue()
+    assert asyncio.run(main(q)) == 1
@@ -0,0 +1,108 @@
+# test_ratelimit.py
+
+import time
+
+import thredo
+
+def test_rate_limiter_rate():
+    result = []
+    def worker(limiter, n):
+        for i in range(4):
+            limiter.acquire()
+            result.append(n)
+
+    def main():
+        limiter = thredo.RateLimiter(100)
+        start = time.monotonic()
+        threads = [ thredo.spawn(worker, limiter, n) for n in range(5) ]
+        for t in threads:
+            t.join()
+        return time.monotonic() - start
+
+    elapsed = thredo.run(main)
+    assert len(result) == 20
+    # The first one goes right away. The rest wait 10 ms each
+    assert 0.18 <= elapsed < 0.5
+    assert sorted(result) == sorted(list(range(5)) * 4)
+
+def test_rate_limiter_bulk_release():
+    released = []
+    def worker(limiter):
+        limiter.acquire()
+        released.append(time.monotonic())
+
+    def main():
+        limiter = thredo.RateLimiter(50, burst=5)
+        assert limiter.try_acquire(5)
+        assert not limiter.try_acquire()
+        threads = [ thredo.spawn(worker, limiter) for n in range(5) ]
+        thredo.sleep(0.15)
+        for t in threads:
+            t.join()
+        try:
+            limiter.acquire(6)
+            assert False
+        except ValueError:
+            pass
+
+    thredo.run(main)
+    # Tokens come every 20 ms.  All five threads were waiting in the
+    # kernel, so all were released over the first 100 ms
+    assert len(released) == 5
+    assert released[-1] - released[0] < 0.12
+
+def test_rate_limiter_cancel():
+    result = []
+    def worker(limiter, n):
+        try:
+            limiter.acquire(n)
+            result.append(n)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        limiter = thredo.RateLimiter(10, burst=4)
+        limiter.acquire(4)
+        t1 = thredo.spawn(worker, limiter, 4)
+        thredo.sleep(0.01)
+        t2 = thredo.spawn(worker, limiter, 1)
+        thredo.sleep(0.01)
+        t1.cancel()
+        # The second thread now only waits for a single token
+        start = time.monotonic()
+        t2.join()
+        return time.monotonic() - start
+
+    elapsed = thredo.run(main)
+    assert result == ['cancel', 1]
+    assert elapsed < 0.2
+
+def test_rate_limiter_timeout():
+    def main():
+        limiter = thredo.RateLimiter(1)
+        limiter.acquire()
+        try:
+            with thredo.timeout_after(0.05):
+                limiter.acquire()
+            assert False
+        except thredo.ThreadTimeout:
+            pass
+        assert limiter.tokens < 1
+
+    thredo.run(main)
+
+def test_keyed_rate_limiter():
+    def main():
+        limiter = thredo.KeyedRateLimiter(1, maxsize=2)
+        assert limiter.try_acquire('a')
+        assert limiter.try_acquire('b')
+        assert not limiter.try_acquire('a')
+        # Least recently used is 'b'
+        assert limiter.try_acquire('c')
+        assert len(limiter) == 2
+        assert 'b' not in limiter and 'a' in limiter
+        start = time.monotonic()
+        limiter.acquire('d')
+        assert time.monotonic() - start < 0.1
+
+    thredo.run(main)
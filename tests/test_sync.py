@@ -1,3 +1,4 @@
+import time
 import thredo
 
 def test_event_wait():
@@ -378,3 +379,566 @@ def test_condition_wait_notify():
         
 
     
+
+def test_condition_notify_unlocked():
+    lock = thredo.Condition()
+    try:
+        lock.notify()
+        assert False
+    except RuntimeError:
+        pass
+
+def test_condition_rlock_wait_notify():
+    lock = thredo.Condition(thredo.RLock())
+    result = []
+    def waiter():
+        with lock:
+            with lock:
+                lock.wait()
+                result.append('waiter')
+
+    def main():
+        t = thredo.spawn(waiter)
+        thredo.sleep(0.1)
+        with lock:
+            result.append('notify')
+            lock.notify()
+        t.join()
+        result.append(lock.locked())
+
+    thredo.run(main)
+    assert result == ['notify', 'waiter', False]
+
+def test_lock_no_kernel_hop(monkeypatch):
+    from thredo import thr
+    hops = []
+    def counting_await(*args, **kwargs):
+        hops.append(args)
+        return real_await(*args, **kwargs)
+    real_await = thr.AWAIT
+    monkeypatch.setattr(thr, 'AWAIT', counting_await)
+
+    locks = [ thredo.Lock(), thredo.RLock(), thredo.Semaphore(),
+              thredo.BoundedSemaphore(), thredo.Condition() ]
+    def main():
+        for lock in locks:
+            for n in range(10):
+                lock.acquire()
+                lock.release()
+                with lock:
+                    pass
+
+    thredo.run(main)
+    assert hops == []
+
+def test_lock_unpromoted_thread():
+    import threading
+    from curio.thread import is_async_thread
+    lock = thredo.Lock()
+    result = []
+    def worker():
+        with lock:
+            result.append(lock.locked())
+        result.append(lock.locked())
+        result.append(is_async_thread())
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert result == [True, False, False]
+
+def test_waitqueue_skip_cancelled():
+    from thredo.thr import WaitQueue
+    q = WaitQueue()
+    fut1 = q.add()
+    fut2 = q.add()
+    fut1.cancel()
+    assert q.wake() == 1
+    assert fut2.done() and not q
+    assert not q.abandon(fut1)
+    assert q.abandon(fut2)
+
+def test_lock_handoff_on_cancel(monkeypatch):
+    lock = thredo.Lock()
+    lock.acquire()
+    other = []
+    def park(fut, trap):
+        # Another thread queues up behind us, then the lock is handed to
+        # us at the same moment that we get cancelled
+        other.append(lock._waiting.add())
+        lock.release()
+        raise thredo.ThreadCancelled()
+    monkeypatch.setattr(thredo.sync, 'park', park)
+    try:
+        lock.acquire()
+        assert False
+    except thredo.ThreadCancelled:
+        pass
+    assert lock.locked()
+    assert other[0].done()
+
+def test_semaphore_handoff_on_cancel(monkeypatch):
+    lock = thredo.Semaphore()
+    lock.acquire()
+    def park(fut, trap):
+        lock.release()
+        raise thredo.ThreadCancelled()
+    monkeypatch.setattr(thredo.sync, 'park', park)
+    try:
+        lock.acquire()
+        assert False
+    except thredo.ThreadCancelled:
+        pass
+    assert lock.value == 1
+
+def test_condition_notify_cancel(monkeypatch):
+    lock = thredo.Condition()
+    other = []
+    def park(fut, trap, timeout=None):
+        other.append(lock._waiting.add())
+        with lock:
+            lock.notify()
+        raise thredo.ThreadCancelled()
+    monkeypatch.setattr(thredo.sync, 'park', park)
+    with lock:
+        try:
+            lock.wait()
+            assert False
+        except thredo.ThreadCancelled:
+            pass
+        assert lock.locked()
+    assert other[0].done()
+
+def test_rwlock_readers():
+    rw = thredo.RWLock()
+    result = []
+    def reader(n):
+        with rw.read_lock:
+            result.append(('read', n, rw.readers))
+            thredo.sleep(0.05)
+
+    def writer():
+        with rw.write_lock:
+            result.append(('write', rw.readers))
+
+    def main():
+        readers = [ thredo.spawn(reader, n) for n in range(3) ]
+        thredo.sleep(0.01)
+        w = thredo.spawn(writer)
+        for t in readers:
+            t.join()
+        w.join()
+
+    thredo.run(main)
+    assert result == [ ('read', 0, 1), ('read', 1, 2), ('read', 2, 3), ('write', 0) ]
+    assert not rw.locked()
+
+def test_rwlock_prefer_writers():
+    for prefer_writers, expected in [(False, ['reader', 'writer']), (True, ['writer', 'reader'])]:
+        rw = thredo.RWLock(prefer_writers=prefer_writers)
+        result = []
+        def reader():
+            with rw.read_lock:
+                result.append('reader')
+
+        def writer():
+            with rw.write_lock:
+                result.append('writer')
+
+        def main():
+            with rw.read_lock:
+                w = thredo.spawn(writer)
+                thredo.sleep(0.01)
+                r = thredo.spawn(reader)
+                thredo.sleep(0.01)
+            w.join()
+            r.join()
+
+        thredo.run(main)
+        assert result == expected
+
+def test_rwlock_writer_cancel():
+    rw = thredo.RWLock(prefer_writers=True)
+    result = []
+    def reader():
+        with rw.read_lock:
+            result.append('reader')
+
+    def writer():
+        try:
+            with rw.write_lock:
+                result.append('writer')
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        with rw.read_lock:
+            w = thredo.spawn(writer)
+            thredo.sleep(0.01)
+            r = thredo.spawn(reader)
+            thredo.sleep(0.01)
+            # The waiting writer keeps the reader out until it's cancelled
+            w.cancel()
+            r.join()
+
+    thredo.run(main)
+    assert result == ['cancel', 'reader']
+
+def test_rwlock_upgrade_downgrade():
+    rw = thredo.RWLock()
+    result = []
+    def reader():
+        with rw.read_lock:
+            thredo.sleep(0.05)
+            result.append('reader done')
+
+    def main():
+        t = thredo.spawn(reader)
+        thredo.sleep(0.01)
+        rw.acquire_read()
+        try:
+            rw.upgrade()
+        except RuntimeError:
+            assert False
+        result.append('upgraded')
+        assert rw.readers == 0 and rw.locked()
+        rw.downgrade()
+        assert rw.readers == 1
+        r = thredo.spawn(rw.acquire_read)
+        r.join()
+        assert rw.readers == 2
+        rw.release_read()
+        rw.release_read()
+        t.join()
+        assert not rw.locked()
+
+    thredo.run(main)
+    assert result == ['reader done', 'upgraded']
+
+def test_rwlock_upgrade_conflict():
+    rw = thredo.RWLock()
+    result = []
+    def other():
+        rw.acquire_read()
+        rw.upgrade()
+        result.append('upgraded')
+        rw.release_write()
+
+    def main():
+        rw.acquire_read()
+        t = thredo.spawn(other)
+        thredo.sleep(0.01)
+        # other waits to upgrade. It can't while main holds a read lock.
+        try:
+            rw.upgrade()
+        except RuntimeError:
+            result.append('conflict')
+        rw.release_read()
+        t.join()
+
+    thredo.run(main)
+    assert result == ['conflict', 'upgraded']
+    assert not rw.locked()
+
+def test_striped_lock():
+    striped = thredo.StripedLock(4)
+    counts = { }
+    def worker(key):
+        for n in range(10):
+            with striped[key]:
+                value = counts.get(key, 0)
+                thredo.sleep(0)
+                counts[key] = value + 1
+
+    def main():
+        threads = [ thredo.spawn(worker, key % 6) for key in range(12) ]
+        for t in threads:
+            t.join()
+        with striped.many(range(6)):
+            assert all(lock.locked() for lock in striped._locks)
+        assert not any(lock.locked() for lock in striped._locks)
+
+    thredo.run(main)
+    assert counts == { key: 20 for key in range(6) }
+    assert len(striped) == 4
+
+def test_event_wait_timeout():
+    evt = thredo.Event()
+    result = []
+    def main():
+        start = time.monotonic()
+        result.append(evt.wait(timeout=0.05))
+        result.append(time.monotonic() - start >= 0.05)
+        result.append(evt.wait(timeout=0))
+        thredo.spawn(evt.set)
+        result.append(evt.wait(timeout=1))
+        result.append(evt.wait(timeout=0))
+        # An enclosing timeout still raises
+        evt.clear()
+        try:
+            with thredo.timeout_after(0.01):
+                evt.wait(timeout=1)
+        except thredo.ThreadTimeout:
+            result.append('timeout')
+        assert not evt._waiting
+
+    thredo.run(main)
+    assert result == [False, True, False, True, True, 'timeout']
+
+def test_condition_wait_timeout():
+    cond = thredo.Condition()
+    items = []
+    result = []
+    def producer():
+        with cond:
+            items.append(1)
+            cond.notify()
+
+    def main():
+        with cond:
+            result.append(cond.wait(timeout=0.05))
+            result.append(cond.locked())
+            result.append(cond.wait_for(lambda: len(items), timeout=0.05))
+            thredo.spawn(producer)
+            result.append(cond.wait_for(lambda: len(items), timeout=1))
+        assert not cond._waiting
+
+    thredo.run(main)
+    assert result == [False, True, 0, 1]
+
+def test_barrier():
+    barrier = thredo.Barrier(3, action=lambda: result.append('action'))
+    result = []
+    def party(n):
+        thredo.sleep(n * 0.01)
+        index = barrier.wait()
+        result.append(index)
+        index = barrier.wait()
+        result.append(index)
+
+    def main():
+        threads = [ thredo.spawn(party, n) for n in range(3) ]
+        for t in threads:
+            t.join()
+
+    thredo.run(main)
+    assert result[0] == 'action' and result[4] == 'action'
+    assert sorted(result[1:4]) == [0, 1, 2]
+    assert sorted(result[5:]) == [0, 1, 2]
+    assert barrier.n_waiting == 0
+
+def test_barrier_broken():
+    barrier = thredo.Barrier(3)
+    result = []
+    def party():
+        try:
+            barrier.wait()
+        except thredo.BrokenBarrierError:
+            result.append('broken')
+
+    def main():
+        t = thredo.spawn(party)
+        try:
+            with thredo.timeout_after(0.05):
+                barrier.wait()
+        except thredo.ThreadTimeout:
+            result.append('timeout')
+        t.join()
+        assert barrier.broken
+        party()
+        barrier.reset()
+        assert not barrier.broken
+
+    thredo.run(main)
+    assert sorted(result) == ['broken', 'broken', 'timeout']
+
+def test_countdown_latch():
+    latch = thredo.CountDownLatch(3)
+    result = []
+    def waiter(n):
+        latch.wait()
+        result.append(n)
+
+    def main():
+        waiters = [ thredo.spawn(waiter, n) for n in range(5) ]
+        thredo.sleep(0.01)
+        for n in range(3):
+            result.append('count')
+            latch.count_down()
+        for t in waiters:
+            t.join()
+        latch.count_down()
+        assert latch.count == 0
+        latch.wait()
+
+    thredo.run(main)
+    assert result[:3] == ['count'] * 3
+    assert sorted(result[3:]) == [0, 1, 2, 3, 4]
+
+def test_countdown_latch_cancel():
+    latch = thredo.CountDownLatch(1)
+    result = []
+    def waiter():
+        try:
+            latch.wait()
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        t = thredo.spawn(waiter)
+        thredo.sleep(0.01)
+        t.cancel()
+        latch.count_down()
+        latch.wait()
+
+    thredo.run(main)
+    assert result == ['cancel']
+
+def test_future():
+    result = []
+    def waiter(fut):
+        try:
+            result.append(fut.result())
+        except ValueError as e:
+            result.append('error')
+
+    def main():
+        fut = thredo.Future()
+        threads = [ thredo.spawn(waiter, fut) for n in range(3) ]
+        thredo.sleep(0.01)
+        assert not fut.done()
+        fut.set_result(42)
+        for t in threads:
+            t.join()
+        assert fut.done() and fut.result() == 42
+        try:
+            fut.set_result(0)
+            assert False
+        except RuntimeError:
+            pass
+        fut = thredo.Future()
+        t = thredo.spawn(waiter, fut)
+        fut.set_exception(ValueError())
+        t.join()
+        assert isinstance(fut.exception(), ValueError)
+
+    thredo.run(main)
+    assert result == [42, 42, 42, 'error']
+
+def test_latch_kernels():
+    latch = thredo.CountDownLatch(8)
+    def worker():
+        latch.count_down()
+        latch.wait()
+
+    def main():
+        threads = [ thredo.spawn(worker) for n in range(8) ]
+        for t in threads:
+            t.join()
+
+    thredo.run(main, kernels=2)
+    assert latch.count == 0
+
+def test_semaphore_value():
+    result = []
+    def worker(sema, n):
+        with sema:
+            result.append(n)
+            thredo.sleep(0.02)
+
+    def main():
+        sema = thredo.Semaphore(2)
+        threads = [ thredo.spawn(worker, sema, n) for n in range(4) ]
+        thredo.sleep(0.01)
+        assert len(result) == 2
+        for t in threads:
+            t.join()
+        bsema = thredo.BoundedSemaphore(2)
+        bsema.acquire()
+        bsema.release()
+        try:
+            bsema.release()
+            assert False
+        except ValueError:
+            pass
+
+    thredo.run(main)
+    assert len(result) == 4
+
+def test_capacity_limiter_fifo():
+    result = []
+    def worker(limiter, n):
+        limiter.acquire(n)
+        result.append(n)
+        thredo.sleep(0.01)
+        limiter.release(n)
+
+    def main():
+        limiter = thredo.CapacityLimiter(10)
+        limiter.acquire(6)
+        t1 = thredo.spawn(worker, limiter, 8)
+        thredo.sleep(0.01)
+        # Would fit, but must not overtake the request for 8
+        t2 = thredo.spawn(worker, limiter, 2)
+        thredo.sleep(0.01)
+        assert result == []
+        assert limiter.borrowed == 6 and limiter.available == 4
+        limiter.release(6)
+        t1.join()
+        t2.join()
+        stats = limiter.statistics()
+        assert stats['acquired'] == 3
+        assert stats['waited'] == 2
+        assert stats['peak_borrowed'] == 10
+        assert stats['borrowed'] == 0 and stats['waiting'] == 0
+
+    thredo.run(main)
+    # Both are granted at once by release(6)
+    assert sorted(result) == [2, 8]
+
+def test_capacity_limiter_resize():
+    result = []
+    def worker(limiter):
+        with limiter.borrow(4):
+            result.append(limiter.borrowed)
+
+    def main():
+        limiter = thredo.CapacityLimiter(2)
+        t = thredo.spawn(worker, limiter)
+        thredo.sleep(0.01)
+        assert result == []
+        assert limiter.statistics()['waiting_units'] == 4
+        limiter.total = 4
+        t.join()
+        try:
+            limiter.release()
+            assert False
+        except RuntimeError:
+            pass
+
+    thredo.run(main)
+    assert result == [4]
+
+def test_capacity_limiter_cancel():
+    result = []
+    def worker(limiter, n):
+        try:
+            with limiter.borrow(n):
+                result.append(n)
+        except thredo.ThreadCancelled:
+            result.append('cancel')
+
+    def main():
+        limiter = thredo.CapacityLimiter(4)
+        with limiter:
+            t1 = thredo.spawn(worker, limiter, 4)
+            thredo.sleep(0.01)
+            t2 = thredo.spawn(worker, limiter, 1)
+            thredo.sleep(0.01)
+            t1.cancel()
+            # The cancelled request no longer holds back the others
+            t2.join()
+        assert limiter.borrowed == 0
+
+    thredo.run(main)
+    assert result == ['cancel', 1]
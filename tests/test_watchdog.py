@@ -0,0 +1,83 @@
+# test_watchdog.py
+
+import time
+import logging
+
+import thredo
+from thredo import deadlock
+
+def test_watchdog_blocking_call():
+    reports = []
+    def callback(athread, seconds, stack):
+        reports.append((seconds, stack[-1].line))
+
+    def blocker():
+        time.sleep(0.3)
+
+    def main():
+        t = thredo.spawn(blocker)
+        t.join()
+
+    watchdog = thredo.Watchdog(0.05, callback=callback)
+    thredo.run(main, watchdog=watchdog)
+    assert len(reports) == 1
+    seconds, line = reports[0]
+    assert seconds >= 0.05
+    assert line == 'time.sleep(0.3)'
+    assert watchdog.detected == 1
+
+def test_watchdog_ignores_kernel():
+    reports = []
+    def busy():
+        # Runs for a long time, but enters the kernel often
+        end = time.monotonic() + 0.3
+        while time.monotonic() < end:
+            thredo.sleep(0)
+
+    def main():
+        t = thredo.spawn(busy)
+        thredo.sleep(0.3)
+        t.join()
+
+    watchdog = thredo.Watchdog(0.05, callback=lambda *args: reports.append(args))
+    thredo.run(main, watchdog=watchdog)
+    assert reports == []
+
+def test_watchdog_log(caplog):
+    def main():
+        time.sleep(0.2)
+
+    with caplog.at_level(logging.WARNING, logger='thredo.watchdog'):
+        thredo.run(main, watchdog=0.05)
+    assert len(caplog.records) == 1
+    assert 'time.sleep(0.2)' in caplog.records[0].getMessage()
+
+def test_watchdog_holding_only(caplog):
+    reports = []
+    def blocker(lock):
+        if lock:
+            with lock:
+                time.sleep(0.3)
+        else:
+            time.sleep(0.3)
+
+    def main():
+        lock = thredo.Lock()
+        threads = [ thredo.spawn(blocker, lock), thredo.spawn(blocker, None) ]
+        for t in threads:
+            t.join()
+
+    deadlock.enable()
+    try:
+        watchdog = thredo.Watchdog(0.05, callback=lambda *args: reports.append(args),
+                                   holding_only=True)
+        thredo.run(main, watchdog=watchdog)
+        with caplog.at_level(logging.WARNING, logger='thredo.watchdog'):
+            thredo.run(main, watchdog=0.05)
+    finally:
+        deadlock.disable()
+    # Only the thread holding the lock
+    assert len(reports) == 1
+    holding = [ 'while holding [<thredo.sync.Lock' in record.getMessage()
+                for record in caplog.records ]
+    assert sorted(holding) == [False, True]
@@ -1,8 +1,14 @@
 # __init__.py
 
 from .core import *
+from .thr import await_many, batch, prepromote, promotion_stats, stats
 from .sync import *
+from .ratelimit import *
+from .pool import *
 from .signal import *
 from .queue import *
+from .executor import *
+from .process import *
+from .watchdog import *
 from .mixin import *
 from .magic import more_magic
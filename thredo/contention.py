@@ -0,0 +1,255 @@
+# contention.py
+#
+# Lock contention profiling.  enable() swaps instrumented versions of
+# acquire() and release() into Lock and Semaphore (and so also RLock,
+# Condition and BoundedSemaphore, which are built on them or inherit
+# from them).  disable() puts the originals back, so that there is no
+# cost at all when profiling is off.
+#
+# Each lock is charged to the place in the program that created it.
+# All of the locks created on the same line share a single profile.
+# The profile records the number of acquisitions, how many of them had
+# to wait, and histograms of wait and hold times.  Locks created before
+# profiling was enabled get a profile of their own the first time they
+# are used.
+
+__all__ = ['enable', 'disable', 'enabled', 'reset', 'stats', 'report']
+
+import sys
+import threading
+import time
+from collections import deque
+
+from . import sync
+
+_clock = time.perf_counter
+
+# Histograms have power-of-two buckets in microseconds. Bucket i counts
+# times below 2**i microseconds (and at least half of that)
+_BUCKETS = 32
+
+def _bucket(seconds):
+    return min(int(seconds * 1e6).bit_length(), _BUCKETS - 1)
+
+def _percentile(hist, fraction):
+    total = sum(hist)
+    if not total:
+        return 0.0
+    count = 0
+    for i, n in enumerate(hist):
+        count += n
+        if count >= total * fraction:
+            return (1 << i) / 1e6
+    return (1 << (_BUCKETS - 1)) / 1e6
+
+class LockProfile(object):
+    '''
+    Contention statistics of all the locks created at one site.
+    '''
+    def __init__(self, site, kind):
+        self.site = site
+        self.kind = kind
+        self.locks = 0
+        self.acquired = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.wait_hist = [0] * _BUCKETS
+        self.hold_hist = [0] * _BUCKETS
+        self._guard = threading.Lock()
+
+    def __repr__(self):
+        return '<LockProfile %s %s acquired=%d contended=%d wait=%.6f>' % (
+            self.kind, self.site, self.acquired, self.contended, self.wait_total)
+
+    def _acquired(self):
+        with self._guard:
+            self.acquired += 1
+
+    def _waited(self, seconds):
+        with self._guard:
+            self.contended += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+            self.wait_hist[_bucket(seconds)] += 1
+
+    def _held(self, seconds):
+        with self._guard:
+            self.hold_total += seconds
+            if seconds > self.hold_max:
+                self.hold_max = seconds
+            self.hold_hist[_bucket(seconds)] += 1
+
+    def as_dict(self):
+        with self._guard:
+            return {
+                'site': self.site,
+                'kind': self.kind,
+                'locks': self.locks,
+                'acquired': self.acquired,
+                'contended': self.contended,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+                'hold_total': self.hold_total,
+                'hold_max': self.hold_max,
+                # Upper bound of each bucket in seconds -> count
+                'wait_hist': { (1 << i) / 1e6: n for i, n in enumerate(self.wait_hist) if n },
+                'hold_hist': { (1 << i) / 1e6: n for i, n in enumerate(self.hold_hist) if n },
+                }
+
+_profiles = { }                # (site, kind) -> LockProfile
+_profiles_lock = threading.Lock()
+_originals = { }               # (class, name) -> original method
+
+# The kind of a lock is the public class it belongs to.  The adapters
+# installed by magic are private subclasses.
+def _kind(lock):
+    for cls in type(lock).__mro__:
+        if not cls.__name__.startswith('_'):
+            return cls.__name__
+    return type(lock).__name__
+
+# Find where a lock was created by skipping frames inside thredo itself.
+# A Lock created by an RLock or Condition is charged to the place that
+# created that RLock or Condition and takes on its kind.
+def _creation_site(lock, frame):
+    kind = _kind(lock)
+    while frame and frame.f_globals.get('__name__', '').startswith('thredo.'):
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, sync._LockBase):
+            kind = _kind(owner)
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>', kind
+    return '%s:%d' % (frame.f_code.co_filename, frame.f_lineno), kind
+
+def _profile_for(site, kind):
+    with _profiles_lock:
+        prof = _profiles.get((site, kind))
+        if prof is None:
+            prof = _profiles[site, kind] = LockProfile(site, kind)
+        prof.locks += 1
+        return prof
+
+def _get_profile(lock):
+    try:
+        return lock._prof
+    except AttributeError:
+        # Created before profiling was enabled
+        lock._prof = _profile_for('<created before profiling at 0x%x>' % id(lock), _kind(lock))
+        lock._prof_holds = deque()
+        return lock._prof
+
+def _instrument_init(init):
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self._prof = _profile_for(*_creation_site(self, sys._getframe(1)))
+        self._prof_holds = deque()
+    return __init__
+
+def _instrument_acquire(acquire):
+    def acquire_(self, *args, **kwargs):
+        result = acquire(self, *args, **kwargs)
+        _get_profile(self)._acquired()
+        self._prof_holds.append(_clock())
+        return result
+    return acquire_
+
+def _instrument_release(release):
+    def release_(self):
+        now = _clock()
+        release(self)
+        prof = _get_profile(self)
+        # Semaphores may be released by a different thread. Releases are
+        # matched with acquisitions in order.
+        try:
+            prof._held(now - self._prof_holds.popleft())
+        except IndexError:
+            pass
+    return release_
+
+# _wait() is only called by an acquire() that has to wait
+def _instrument_wait(wait):
+    def _wait(self, fut):
+        start = _clock()
+        wait(self, fut)
+        _get_profile(self)._waited(_clock() - start)
+    return _wait
+
+_instrumented = [
+    (sync._LockBase, '_wait', _instrument_wait),
+    (sync.Lock, '__init__', _instrument_init),
+    (sync.Lock, 'acquire', _instrument_acquire),
+    (sync.Lock, 'release', _instrument_release),
+    (sync.Semaphore, '__init__', _instrument_init),
+    (sync.Semaphore, 'acquire', _instrument_acquire),
+    (sync.Semaphore, 'release', _instrument_release),
+    (sync.BoundedSemaphore, 'release', _instrument_release),
+    ]
+
+def enable():
+    '''
+    Start profiling lock contention.
+    '''
+    if _originals:
+        return
+    for cls, name, instrument in _instrumented:
+        original = cls.__dict__[name]
+        _originals[cls, name] = original
+        setattr(cls, name, instrument(original))
+
+def disable():
+    '''
+    Stop profiling.  The statistics collected so far are kept.
+    '''
+    while _originals:
+        (cls, name), original = _originals.popitem()
+        setattr(cls, name, original)
+
+def enabled():
+    return bool(_originals)
+
+def reset():
+    '''
+    Discard all of the statistics collected so far.
+    '''
+    with _profiles_lock:
+        for prof in _profiles.values():
+            with prof._guard:
+                prof.acquired = prof.contended = 0
+                prof.wait_total = prof.wait_max = 0.0
+                prof.hold_total = prof.hold_max = 0.0
+                prof.wait_hist = [0] * _BUCKETS
+                prof.hold_hist = [0] * _BUCKETS
+
+def stats():
+    '''
+    Return the statistics of every creation site as a list of dicts,
+    ranked by total time spent waiting.
+    '''
+    with _profiles_lock:
+        profiles = list(_profiles.values())
+    result = [ prof.as_dict() for prof in profiles if prof.acquired ]
+    result.sort(key=lambda s: (s['wait_total'], s['contended'], s['acquired']), reverse=True)
+    return result
+
+def report(limit=10, file=None):
+    '''
+    Print the limit locks with the most total time spent waiting.
+    '''
+    file = file or sys.stdout
+    with _profiles_lock:
+        profiles = [ prof for prof in _profiles.values() if prof.acquired ]
+    profiles.sort(key=lambda p: (p.wait_total, p.contended, p.acquired), reverse=True)
+    print('%-10s %9s %9s %10s %10s %10s %10s  %s' % (
+        'kind', 'acquired', 'contended', 'wait', 'wait p99', 'hold mean', 'hold p99', 'site'), file=file)
+    for prof in profiles[:limit]:
+        with prof._guard:
+            print('%-10s %9d %8.1f%% %9.3fs %8.1fus %8.1fus %8.1fus  %s' % (
+                prof.kind, prof.acquired, 100.0 * prof.contended / prof.acquired,
+                prof.wait_total, _percentile(prof.wait_hist, 0.99) * 1e6,
+                prof.hold_total / prof.acquired * 1e6,
+                _percentile(prof.hold_hist, 0.99) * 1e6, prof.site), file=file)
@@ -2,18 +2,48 @@
 
 __all__ = ['run', 'sleep', 'spawn', 'timeout_after', 'ignore_after',
            'ThreadTimeout', 'ThreadCancelled', 'CancelledError',
-           'ThreadError', 'ThreadGroup']
+           'ThreadError', 'ThreadGroup', 'ThreadGroupError']
+
+import threading
+import time
+import math
+import itertools
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
 
 import curio
-from .thr import TAWAIT as AWAIT
+from curio.thread import _locals
+from curio.errors import TimeoutCancellationError, UncaughtTimeoutError
+from .thr import TAWAIT as AWAIT, WaitQueue, park
 from . import thr
+from . import pool as _pool
+from . import kernel as _kernel
+from . import timer as _timer
+from . import process as _process
+from . import watchdog as _watchdog
 
 class Thread:
     def __init__(self, atask):
         self.atask = atask
 
-    def cancel(self):
-        AWAIT(self.atask.cancel)
+    def cancel(self, blocking=True):
+        '''
+        Cancel the thread.  Unless blocking is False, wait for it to
+        terminate.
+        '''
+        kernel = _kernel.owner(self.atask)
+        if kernel is _kernel.current():
+            if blocking:
+                AWAIT(self.atask.cancel)
+            else:
+                AWAIT(self.atask._task.cancel, blocking=False)
+        else:
+            # The task belongs to a different kernel. It has to be
+            # cancelled there.
+            kernel.call(self.atask._task.cancel, blocking=False)
+            if blocking:
+                AWAIT(self.atask.wait)
 
     def join(self):
         return AWAIT(self.atask.join)
@@ -21,48 +51,280 @@ class Thread:
     def wait(self):
         return AWAIT(self.atask.wait)
 
+    @property
+    def stats(self):
+        '''
+        Scheduling statistics of the thread as a dict.
+        '''
+        return thr.thread_stats(self.atask).as_dict()
+
+def _spawn_thread(callable, args, daemon):
+    kernel = _kernel.assign()
+    if kernel is _kernel.current():
+        return AWAIT(_pool.spawn_thread, callable, *args, daemon=daemon, kernel=kernel)
+    else:
+        return kernel.call(_pool.spawn_thread, callable, *args, daemon=daemon, kernel=kernel)
+
 class ThreadGroup:
-    def __init__(self, *args, **kwargs):
-        self._tg = curio.TaskGroup(*args, **kwargs)
+    '''
+    A collection of threads that are managed together.  When used as a
+    context manager, exiting the block waits for all of the threads.
+    If the block exits with an exception, the remaining threads are
+    cancelled.
+    '''
+    def __init__(self, *, wait=all):
+        self._guard = threading.Lock()
+        self._running = set()
+        self._finished = deque()
+        self._waiting = WaitQueue()
+        self._wait = wait
+        self._closed = False
+        self.completed = None     # First thread that completed successfully
 
     def spawn(self, callable, *args, daemon=False):
-        t = AWAIT(curio.spawn_thread, callable, *args, daemon=daemon)
-        AWAIT(self._tg.add_task, t)
-        return Thread(t)
+        thread = Thread(None)
+        thread._done = False
+        thread._result = None
+        thread._exc = None
+        def _runner():
+            try:
+                thread._result = callable(*args)
+                return thread._result
+            except BaseException as e:
+                thread._exc = e
+                raise
+            finally:
+                self._thread_done(thread)
+
+        with self._guard:
+            if self._closed:
+                raise RuntimeError('ThreadGroup is closed')
+            self._running.add(thread)
+        atask = _spawn_thread(_runner, (), daemon)
+        with self._guard:
+            thread.atask = atask
+            # The thread might already be finished
+            if thread._done:
+                self._finish(thread)
+        return thread
+
+    def _thread_done(self, thread):
+        with self._guard:
+            thread._done = True
+            if thread.atask is not None:
+                self._finish(thread)
+
+    # Must be called with the guard held
+    def _finish(self, thread):
+        if thread not in self._running:
+            return
+        self._running.discard(thread)
+        self._finished.append(thread)
+        if self.completed is None and thread._exc is None:
+            self.completed = thread
+        self._waiting.wake(len(self._waiting))
+
+    def cancel_remaining(self):
+        '''
+        Cancel all remaining threads.  Cancelled threads are removed
+        from the group.
+        '''
+        with self._guard:
+            self._closed = True
+            running = list(self._running)
+        for thread in running:
+            if thread.atask is not None:
+                thread.cancel()
+            with self._guard:
+                self._running.discard(thread)
+                if thread in self._finished:
+                    self._finished.remove(thread)
+
+    def cancel(self):
+        self.cancel_remaining()
+
+    def join(self, *, wait=None):
+        '''
+        Wait for the threads in the group to terminate.  If wait=all,
+        wait for all of them.  If wait=any, wait for the first one and
+        cancel the rest.  If any thread fails with an exception, the
+        remaining threads are cancelled and ThreadGroupError is raised.
+        '''
+        if wait is None:
+            wait = self._wait
+        failed = []
+        try:
+            while True:
+                thread = self.next_done()
+                if thread is None:
+                    break
+                if thread._exc is not None and not isinstance(thread._exc, CancelledError):
+                    failed.append(thread)
+                    self.cancel_remaining()
+                elif wait is any:
+                    self.cancel_remaining()
+        except CancelledError:
+            self.cancel_remaining()
+            raise
+        self._closed = True
+        if failed:
+            raise ThreadGroupError(failed)
+
+    def next_done(self):
+        '''
+        Wait for the next thread to finish and return it.  Returns None
+        if no threads are left.
+        '''
+        while True:
+            with self._guard:
+                if self._finished:
+                    return self._finished.popleft()
+                if not self._running:
+                    return None
+                fut = self._waiting.add()
+            try:
+                park(fut, 'threadgroup')
+            except BaseException:
+                with self._guard:
+                    self._waiting.abandon(fut)
+                raise
 
-    def cancel(self, *args, **kwargs):
-        AWAIT(self._tg.cancel, *args, **kwargs)
+    def next_result(self):
+        thread = self.next_done()
+        if thread is None:
+            raise RuntimeError('No threads remaining')
+        return thread.join()
 
-    def cancel_remaining(self, *args, **kwargs):
-        AWAIT(self._tg.cancel_remaining, *args, **kwargs)
+    def __iter__(self):
+        '''
+        Iterate over the threads as they finish.  See next_done().
+        '''
+        return iter(self.next_done, None)
 
-    def join(self, *args, **kwargs):
-        return AWAIT(self._tg.cancel, *args, **kwargs)
+    def map(self, func, iterable, *, limit=100, ordered=False):
+        '''
+        Call func on each item of iterable in a thread of the group and
+        generate the results.  Items are only taken from iterable as
+        threads finish so that at most limit of them are outstanding.
+        Results are generated as the threads finish.  If ordered is
+        true, they are in the order of iterable instead.  If func raises
+        an exception, the remaining threads are cancelled and the
+        exception is raised.  Don't spawn other threads in the group
+        while the results are being consumed.
+        '''
+        items = iter(iterable)
+        index = itertools.count()
 
-    def next_result(self, *args, **kwargs):
-        return AWAIT(self._tg.next_result, *args, **kwargs)
+        def spawn_next():
+            for item in itertools.islice(items, 1):
+                thread = self.spawn(func, item)
+                thread._index = next(index)
+                return True
+            return False
 
-    def next_done(self, *args, **kwargs):
-        return AWAIT(self._tg.next_done, *args, **kwargs)
+        results = { }
+        next_index = 0
+        outstanding = 0
+        try:
+            while outstanding < limit and spawn_next():
+                outstanding += 1
+            while outstanding:
+                thread = self.next_done()
+                if thread._exc is not None:
+                    raise thread._exc
+                if ordered:
+                    results[thread._index] = thread._result
+                    while next_index in results:
+                        result = results.pop(next_index)
+                        next_index += 1
+                        outstanding -= 1
+                        if spawn_next():
+                            outstanding += 1
+                        yield result
+                else:
+                    outstanding -= 1
+                    if spawn_next():
+                        outstanding += 1
+                    yield thread._result
+        finally:
+            if outstanding:
+                self.cancel_remaining()
 
     def __enter__(self):
-        self._tg.__enter__()
         return self
 
-    def __exit__(self, *args):
-        return self._tg.__exit__(*args)
-
-    @property
-    def completed(self):
-        return self._tg.completed
+    def __exit__(self, ty, val, tb):
+        if ty:
+            self.cancel_remaining()
+        else:
+            self.join()
 
-def run(callable, *args):
+def run(callable, *args, pool=None, kernels=1, timer_resolution=0.001, process_pool=None,
+        watchdog=None):
+    '''
+    Run callable as the main thredo thread.  pool is the ThreadPool
+    used to run spawned threads.  By default, a new pool is created
+    and shut down when run() returns.  A pool passed in is left
+    running, so that it can be used again.
+    kernels is the number of Curio kernels to run, each in its own OS
+    thread.  Spawned threads are spread over the kernels round-robin.
+    SignalEvent may only be used by threads in the first kernel.
+    timer_resolution is the granularity in seconds of sleep() and
+    timeouts.  A coarse resolution makes timers cheaper when there are
+    very many of them.  process_pool is the ProcessPool used by
+    run_in_process().  As with pool, a new one is created and shut
+    down by default, and one passed in is left running.  watchdog is
+    a Watchdog (or its threshold in seconds) used to report threads
+    that block without entering the kernel.  By default, there is none.
+    '''
+    own_pool = pool is None
+    if own_pool:
+        pool = _pool.ThreadPool()
+    own_process_pool = process_pool is None
+    if own_process_pool:
+        process_pool = _process.ProcessPool()
+    if watchdog is not None and not isinstance(watchdog, _watchdog.Watchdog):
+        watchdog = _watchdog.Watchdog(watchdog)
     async def _runner():
+        await _kernel.prepare()
         t = await curio.spawn(thr.thread_handler)
+        _pool._pool = pool
+        _process._pool = process_pool
+        _timer._wheel = _timer.TimerWheel(timer_resolution)
+        wheel = await curio.spawn(_timer._wheel.run, daemon=True)
+        if kernels > 1:
+            _kernel._kernels[:] = [ _kernel.Kernel(n) for n in range(kernels) ]
+            serve = await curio.spawn(_kernel._kernels[0].serve, daemon=True)
+            for k in _kernel._kernels[1:]:
+                k.start()
+        if watchdog:
+            watchdog.start()
         try:
             async with curio.spawn_thread():
-                return callable(*args)
+                ident = threading.get_ident()
+                thr._threads[ident] = _locals.thread
+                thr._stats_start(_locals.thread)
+                try:
+                    return callable(*args)
+                finally:
+                    thr._stats_exit(_locals.thread)
+                    del thr._threads[ident]
         finally:
+            if watchdog:
+                watchdog.stop()
+            if kernels > 1:
+                for k in _kernel._kernels[1:]:
+                    k.stop()
+                await serve.cancel()
+                _kernel._kernels[:] = []
+            _pool._pool = None
+            if own_pool:
+                pool.shutdown()
+            _process._pool = None
+            if own_process_pool:
+                process_pool.shutdown()
+            await wheel.cancel()
+            _timer._wheel = None
             await t.cancel()
     return curio.run(_runner)
 
@@ -70,32 +332,96 @@ def enable():
     thr.enable_async()
 
 def sleep(seconds):
-    return AWAIT(curio.sleep, seconds)
+    if seconds <= 0:
+        return AWAIT(curio.sleep, 0)
+    fut = Future()
+    t = _timer._wheel.add(time.monotonic() + seconds, partial(_timer.wake, fut))
+    try:
+        park(fut, 'sleep')
+    finally:
+        _timer._wheel.cancel(t)
+    return time.monotonic()
 
 def spawn(callable, *args, daemon=False):
-    atask = AWAIT(curio.spawn_thread, callable, *args, daemon=daemon)
+    atask = _spawn_thread(callable, args, daemon)
     return Thread(atask)
 
+class _TimeoutAfter(object):
+    '''
+    Timeout applied to a block of code in a thread.  The deadline is
+    kept by the thread itself and only comes into play when the thread
+    blocks, so entering and leaving the block is free.  The handling of
+    nested timeouts follows Curio.
+    '''
+    def __init__(self, delay, ignore=False, timeout_result=None):
+        self._delay = delay
+        self._ignore = ignore
+        self._timeout_result = timeout_result
+        self.expired = False
+        self.result = True
+
+    def __enter__(self):
+        deadlines = getattr(_locals, 'deadlines', None)
+        if deadlines is None:
+            deadlines = _locals.deadlines = []
+        self._deadlines = deadlines
+        deadlines.append(math.inf if self._delay is None else time.monotonic() + self._delay)
+        return self
+
+    def __exit__(self, ty, val, tb):
+        try:
+            if ty in (curio.TaskTimeout, TimeoutCancellationError):
+                timeout_clock = val.args[0]
+                # Find the outermost deadline that has expired
+                for n, deadline in enumerate(self._deadlines):
+                    if deadline <= timeout_clock:
+                        break
+                else:
+                    raise UncaughtTimeoutError('Uncaught timeout received')
+
+                if n < len(self._deadlines) - 1:
+                    # Time expired in an enclosing block
+                    if ty is curio.TaskTimeout:
+                        raise TimeoutCancellationError(timeout_clock).with_traceback(tb) from None
+                    return False
+                self.result = self._timeout_result
+                self.expired = True
+                if self._ignore:
+                    return True
+                if ty is TimeoutCancellationError:
+                    raise curio.TaskTimeout(timeout_clock).with_traceback(tb) from None
+                return False
+        finally:
+            self._deadlines.pop()
+
 def timeout_after(delay, callable=None, *args):
-    thr.enable_async()
     if callable:
-        with curio.timeout_after(delay):
+        with _TimeoutAfter(delay):
             return callable(*args)
     else:
-        return curio.timeout_after(delay)
+        return _TimeoutAfter(delay)
 
-def ignore_after(delay, callable=None, *args):
-    thr.enable_async()
+def ignore_after(delay, callable=None, *args, timeout_result=None):
     if callable:
-        with curio.ignore_after(delay):
+        with _TimeoutAfter(delay, ignore=True, timeout_result=timeout_result) as t:
             return callable(*args)
+        return t.result
     else:
-        return curio.ignore_after(delay)
+        return _TimeoutAfter(delay, ignore=True, timeout_result=timeout_result)
 
 ThreadTimeout = curio.TaskTimeout
 ThreadCancelled = curio.TaskCancelled
 CancelledError = curio.CancelledError
 ThreadError = curio.TaskError
 
+class ThreadGroupError(ThreadError):
+    '''
+    Raised by ThreadGroup.join() if threads in the group failed.  The
+    .failed attribute is a list of the failed threads.
+    '''
+    def __init__(self, failed):
+        self.args = (failed,)
+        self.failed = failed
+
 
 
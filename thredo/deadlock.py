@@ -0,0 +1,195 @@
+# deadlock.py
+#
+# Deadlock detection.  A thread can only wait on a Lock by going through
+# Lock._wait(), so thredo knows exactly who waits on whom.  enable()
+# swaps in versions of Lock.acquire() and release() that record the
+# owning thread, and a version of _wait() that records which lock each
+# thread waits on.  Before parking, a thread follows the chain of owner
+# -> lock waited on -> owner ...  If the chain comes back to the thread
+# itself, waiting would complete a cycle that nobody can ever leave.
+# Because every thread checks before it waits, the thread that closes a
+# cycle always finds it, right when it happens.
+#
+# RLock and Condition are built on Lock and are covered as well.
+# Semaphores have no owner and are not.  The locks each thread holds
+# are also available to other tools through held_locks().
+
+__all__ = ['DeadlockError']
+
+import sys
+import threading
+import logging
+import traceback
+
+from . import sync
+
+log = logging.getLogger('thredo.deadlock')
+
+class DeadlockError(RuntimeError):
+    '''
+    Raised by an acquire() that would deadlock.  cycle is a list of
+    (thread ident, lock waited on, traceback.StackSummary) tuples, one
+    for each thread in the cycle, starting with the calling thread.
+    '''
+    def __init__(self, message, cycle):
+        super().__init__(message)
+        self.cycle = cycle
+
+_graph_lock = threading.Lock()
+_waiting_for = { }             # thread ident -> Lock
+_held = { }                    # thread ident -> list of Locks it owns
+_originals = { }               # (class, name) -> original method or None
+_raise_error = True
+_callback = None
+
+# Owners are recorded on the locks themselves, along with the token of
+# the enable() that was in effect.  Owners recorded before the latest
+# enable() may be stale and are ignored.
+_token = None
+
+def _owner(lock):
+    if getattr(lock, '_owner_token', None) is _token:
+        return lock._owner
+    return None
+
+def _format_cycle(cycle):
+    lines = []
+    for ident, lock, stack in cycle:
+        lines.append('Thread %d waits for %r. Stack:\n%s' % (
+            ident, lock, ''.join(stack.format()).rstrip()))
+    return '\n'.join(lines)
+
+def _log_deadlock(cycle):
+    log.error('Deadlock between %d threads:\n%s', len(cycle), _format_cycle(cycle))
+
+# Must be called with _graph_lock held.  Returns the list of (thread,
+# lock waited on) in the cycle that thread me would close by waiting
+# on lock, or None.
+def _find_cycle(lock, me):
+    path = [(me, lock)]
+    seen = { me }
+    owner = _owner(lock)
+    while owner is not None:
+        if owner == me:
+            return path
+        if owner in seen:
+            # A cycle that doesn't involve us. It was reported when it formed.
+            return None
+        seen.add(owner)
+        lock = _waiting_for.get(owner)
+        if lock is None:
+            return None
+        path.append((owner, lock))
+        owner = _owner(lock)
+    return None
+
+def _stacks(path):
+    frames = sys._current_frames()
+    me = threading.get_ident()
+    cycle = []
+    for ident, lock in path:
+        frame = sys._getframe(1) if ident == me else frames.get(ident)
+        stack = traceback.extract_stack(frame) if frame else traceback.StackSummary()
+        cycle.append((ident, lock, stack))
+    return cycle
+
+def _acquire(acquire):
+    def acquire_(self, *args, **kwargs):
+        result = acquire(self, *args, **kwargs)
+        me = threading.get_ident()
+        self._owner = me
+        self._owner_token = _token
+        _held.setdefault(me, []).append(self)
+        return result
+    return acquire_
+
+def _release(release):
+    def release_(self):
+        owner = _owner(self)
+        self._owner = None
+        if owner is not None:
+            # A Lock may be released by a thread other than its owner
+            try:
+                _held[owner].remove(self)
+            except (KeyError, ValueError):
+                pass
+        release(self)
+    return release_
+
+# Lock inherits _wait() from _LockBase.  The base class version is looked
+# up on every call so that contention profiling can be enabled as well.
+def _wait(wait):
+    def _wait(self, fut):
+        me = threading.get_ident()
+        with _graph_lock:
+            path = _find_cycle(self, me)
+            if path is None or not _raise_error:
+                _waiting_for[me] = self
+        if path:
+            cycle = _stacks(path)
+            (_callback or _log_deadlock)(cycle)
+            if _raise_error:
+                with self._guard:
+                    handed = self._waiting.abandon(fut)
+                if not handed:
+                    raise DeadlockError('Deadlock between %d threads' % len(cycle), cycle)
+                # The lock was handed over after all
+                return
+        try:
+            sync._LockBase._wait(self, fut)
+        finally:
+            with _graph_lock:
+                del _waiting_for[me]
+    return _wait
+
+_instrumented = [
+    (sync.Lock, 'acquire', _acquire),
+    (sync.Lock, 'release', _release),
+    (sync.Lock, '_wait', _wait),
+    ]
+
+def enable(raise_error=True, callback=None):
+    '''
+    Start detecting deadlocks.  When an acquire() would deadlock,
+    callback(cycle) is called with the cycle described as for
+    DeadlockError.  By default, the cycle is logged to the
+    'thredo.deadlock' logger with the stacks of all the threads in it.
+    Then, unless raise_error is False, DeadlockError is raised in
+    the thread that would have closed the cycle.  Otherwise, that
+    thread waits anyway.  Ownership is only known for locks acquired
+    after enable().
+    '''
+    global _raise_error, _callback, _token
+    _raise_error = raise_error
+    _callback = callback
+    if _originals:
+        return
+    _token = object()
+    _held.clear()
+    for cls, name, instrument in _instrumented:
+        original = cls.__dict__.get(name)
+        _originals[cls, name] = original
+        setattr(cls, name, instrument(original or getattr(cls, name)))
+
+def disable():
+    '''
+    Stop detecting deadlocks.
+    '''
+    while _originals:
+        (cls, name), original = _originals.popitem()
+        if original is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, original)
+    _held.clear()
+
+def enabled():
+    return bool(_originals)
+
+def held_locks(ident):
+    '''
+    Return a list of the Locks owned by the thread with the given
+    ident, oldest first.  Only locks acquired while detection is
+    enabled are known.  Empty if it isn't enabled.
+    '''
+    return list(_held.get(ident, ()))
@@ -0,0 +1,179 @@
+# executor.py
+#
+# A concurrent.futures Executor that runs work in thredo threads.
+# Unlike the threads of ThreadPoolExecutor, a thredo thread can be
+# cancelled while it's blocked, so Future.cancel() also works on work
+# that is already running.
+
+__all__ = ['ThredoExecutor']
+
+import threading
+import itertools
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import _base
+
+from curio.thread import _locals
+from . import core
+from . import timer
+from .thr import park
+from .queue import Queue
+
+class _ThredoFuture(futures.Future):
+    '''
+    Future whose cancel() also cancels the thread running the work.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+
+    def cancel(self):
+        with self._condition:
+            if self._state != _base.RUNNING:
+                thread = None
+            else:
+                thread = self._thread
+                self._state = _base.CANCELLED_AND_NOTIFIED
+                for waiter in self._waiters:
+                    waiter.add_cancelled(self)
+                self._condition.notify_all()
+        if thread is None:
+            return super().cancel()
+        self._invoke_callbacks()
+        thread.cancel(blocking=False)
+        return True
+
+def wait(fut, timeout=None):
+    '''
+    Wait for a concurrent.futures Future to complete in a way that can
+    be cancelled.  Raises concurrent.futures.TimeoutError if it takes
+    longer than timeout seconds.
+    '''
+    if fut.done():
+        return
+    waiter = futures.Future()
+    fut.add_done_callback(lambda f: timer.wake(waiter))
+    if timeout is None:
+        park(waiter, 'future')
+        return
+    try:
+        with core.timeout_after(timeout):
+            park(waiter, 'future')
+    except core.ThreadTimeout:
+        raise futures.TimeoutError() from None
+
+class ThredoExecutor(futures.Executor):
+    '''
+    Executor that runs submitted callables in thredo threads.  At most
+    max_workers threads are used.  Must be used while thredo.run() is
+    active, but work may be submitted from any thread.
+    '''
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = 32
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than 0')
+        self._max_workers = max_workers
+        self._guard = threading.Lock()
+        self._work = Queue()
+        self._nworkers = 0
+        self._shutdown = False
+        self._cancel_futures = False
+
+    def submit(self, fn, *args, **kwargs):
+        fut = _ThredoFuture()
+        with self._guard:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            start = self._nworkers < self._max_workers
+            if start:
+                self._nworkers += 1
+        self._work.put((fut, fn, args, kwargs))
+        if start:
+            core.spawn(self._worker, daemon=True)
+        return fut
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1, prefetch=None):
+        '''
+        Like Executor.map(), but only prefetch calls (by default twice
+        max_workers) are submitted ahead of the result being consumed.
+        Remaining calls are submitted as results are consumed, so an
+        arbitrarily long iterable can be used.
+        '''
+        if prefetch is None:
+            prefetch = 2 * self._max_workers
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        args = zip(*iterables)
+        fs = deque(self.submit(fn, *a) for a in itertools.islice(args, prefetch))
+
+        def results():
+            try:
+                while fs:
+                    for a in itertools.islice(args, 1):
+                        fs.append(self.submit(fn, *a))
+                    if timeout is None:
+                        wait(fs[0])
+                    else:
+                        wait(fs[0], deadline - time.monotonic())
+                    yield fs.popleft().result()
+            finally:
+                for fut in fs:
+                    fut.cancel()
+        return results()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._guard:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            self._cancel_futures = cancel_futures
+            nworkers = self._nworkers
+        for n in range(nworkers):
+            self._work.put(None)
+        if wait:
+            self._work.join()
+
+    def _worker(self):
+        while True:
+            work = self._work.get()
+            try:
+                if work is None:
+                    return
+                if self._cancel_futures:
+                    work[0].cancel()
+                elif not self._run(*work):
+                    # The work was cancelled while running.  The
+                    # cancellation might not have been delivered yet, so
+                    # this thread can't be used for anything else.
+                    core.spawn(self._worker, daemon=True)
+                    return
+            finally:
+                self._work.task_done()
+
+    def _run(self, fut, fn, args, kwargs):
+        '''
+        Run the work for fut.  Returns False if fut was cancelled while
+        the work was running.
+        '''
+        with fut._condition:
+            if not fut.set_running_or_notify_cancel():
+                return True
+            fut._thread = core.Thread(_locals.thread)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            result = None
+            exc = e
+        else:
+            exc = None
+        try:
+            if exc is None:
+                fut.set_result(result)
+            else:
+                fut.set_exception(exc)
+        except futures.InvalidStateError:
+            # Cancelled
+            return False
+        return True
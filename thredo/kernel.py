@@ -0,0 +1,116 @@
+# kernel.py
+#
+# Support for running more than one Curio kernel.  Each kernel runs in
+# its own OS thread and every thredo thread is assigned to one of
+# them.  The synchronization primitives in thredo only use Futures to
+# wake waiting threads, so they work regardless of the kernel that a
+# thread belongs to.  Operations that manipulate Curio tasks directly
+# (spawning and cancellation) are forwarded to the kernel that owns
+# the task.
+
+import threading
+import itertools
+from concurrent.futures import Future
+
+import curio
+from curio.thread import _locals
+from curio.traps import _get_kernel
+
+class _NotifySocket(object):
+    '''
+    Wrapper of the socket used to wake up a Curio kernel.  A byte is
+    written to it for every Future completed on behalf of one of its
+    tasks.  When very many threads are woken at once, its buffer fills
+    up.  The kernel is then certain to wake up anyway, so the byte can
+    be dropped.
+    '''
+    def __init__(self, sock):
+        self._sock = sock
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def send(self, data):
+        try:
+            return self._sock.send(data)
+        except BlockingIOError:
+            return 0
+
+async def prepare():
+    '''
+    Prepare the running Curio kernel for use by thredo.
+    '''
+    kernel = await _get_kernel()
+    if not isinstance(kernel._notify_sock, _NotifySocket):
+        kernel._notify_sock = _NotifySocket(kernel._notify_sock)
+
+class Kernel(object):
+    '''
+    A Curio kernel that accepts requests from threads in other kernels.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self._requests = curio.UniversalQueue()
+        self._thread = None
+
+    def __repr__(self):
+        return '<thredo.Kernel %d>' % self.index
+
+    async def serve(self):
+        await prepare()
+        while True:
+            request = await self._requests.get()
+            if request is None:
+                break
+            fut, corofunc, args, kwargs = request
+            # Requests are short non-blocking operations. They run inline.
+            try:
+                fut.set_result(await corofunc(*args, **kwargs))
+            except Exception as e:
+                fut.set_exception(e)
+
+    def call(self, corofunc, *args, **kwargs):
+        '''
+        Run corofunc(*args, **kwargs) in this kernel and return its result.
+        '''
+        fut = Future()
+        self._requests.put((fut, corofunc, args, kwargs))
+        return fut.result()
+
+    def start(self):
+        self._thread = threading.Thread(target=curio.run, args=(self.serve,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._requests.put(None)
+        if self._thread:
+            self._thread.join()
+
+# Kernels in use by thredo.run().  Empty if only one kernel is used.
+_kernels = []
+_counter = itertools.count()
+
+def assign():
+    '''
+    Pick the kernel for a newly spawned thread (round-robin).
+    '''
+    if not _kernels:
+        return None
+    return _kernels[next(_counter) % len(_kernels)]
+
+def current():
+    '''
+    Return the kernel of the calling thread.
+    '''
+    if not _kernels:
+        return None
+    return owner(getattr(_locals, 'thread', None))
+
+def owner(athread):
+    '''
+    Return the kernel that runs the given AsyncThread.
+    '''
+    kernel = getattr(athread, '_kernel', None)
+    if kernel is None and _kernels:
+        kernel = _kernels[0]
+    return kernel
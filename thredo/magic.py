@@ -1,17 +1,262 @@
 # magic.py
+#
+# Making code written for the standard library cooperate with thredo.
+#
+# more_magic() swaps the socket module for thredo.socket while a block
+# of code runs, so modules imported in the block pick up thredo sockets.
+# Most libraries are already imported, and they block in many other
+# places such as time.sleep(), select.select(), threading and queue.
+# The patches below replace those functions and classes in place.  A
+# patched function checks who is calling.  Calls from a thredo thread
+# are routed to the thredo equivalent so that they become cancellable.
+# Calls from any other thread go to the original.  Objects created by
+# the standard library itself (or by thredo and curio) are never
+# replaced.
 
 from contextlib import contextmanager
 import sys
+import time
+import select
+import socket as _socket
+import ssl
+import threading
+import queue
+
+import curio
+from curio.thread import is_async_thread
+from curio.traps import _read_wait, _write_wait
 
 from . import socket
+from . import io
+from . import sync
+from .core import sleep, ignore_after
+from .queue import Queue
+from .thr import TAWAIT as AWAIT
 
 __all__ = ['more_magic']
 
+# Modules that can be patched
+PATCHES = ('socket', 'ssl', 'select', 'time', 'threading', 'queue')
+
+# Modules whose use of a patched function or class always gets the
+# original.  These implement the standard library or thredo itself.
+_native_callers = frozenset(['thredo', 'curio', 'threading', 'queue', 'socket', 'ssl',
+                             'selectors', 'concurrent', 'asyncio', 'multiprocessing',
+                             'logging', 'importlib', 'weakref', '_weakrefset'])
+
+def _use_thredo(depth=2):
+    '''
+    Decide whether a patched function called depth frames up should
+    use the thredo version.
+    '''
+    if not is_async_thread():
+        return False
+    module = sys._getframe(depth).f_globals.get('__name__') or ''
+    return module.partition('.')[0] not in _native_callers
+
+def _dispatch(native, replacement):
+    '''
+    Make a function that calls replacement from thredo threads and
+    native otherwise.
+    '''
+    def func(*args, **kwargs):
+        if _use_thredo():
+            return replacement(*args, **kwargs)
+        return native(*args, **kwargs)
+    func.__name__ = native.__name__
+    func.__qualname__ = native.__qualname__
+    func.__doc__ = native.__doc__
+    return func
+
+def _dispatch_class(native, replacement):
+    '''
+    Make a subclass of native whose instances are replacement objects
+    when created from thredo threads.  Subclasses of the patched class
+    behave like subclasses of native.
+    '''
+    def __new__(cls, *args, **kwargs):
+        if cls is patched and _use_thredo():
+            return replacement(*args, **kwargs)
+        if native.__new__ is object.__new__:
+            return object.__new__(cls)
+        return native.__new__(cls, *args, **kwargs)
+    patched = type(native.__name__, (native,), {
+        '__new__': __new__,
+        '__module__': native.__module__,
+        '__qualname__': native.__qualname__,
+        '__doc__': native.__doc__,
+        })
+    return patched
+
+# Timeouts as taken by the standard library. A negative timeout
+# (as used by threading) is the same as no timeout.
+def _limit(blocking=True, timeout=None):
+    if not blocking:
+        timeout = 0
+    elif timeout is not None and timeout < 0:
+        timeout = None
+    return ignore_after(timeout)
+
+# -- threading
+
+class _Lock(sync.Lock):
+    def acquire(self, blocking=True, timeout=-1):
+        with _limit(blocking, timeout) as t:
+            super().acquire()
+        return not t.expired
+
+class _RLock(sync.RLock):
+    def acquire(self, blocking=True, timeout=-1):
+        with _limit(blocking, timeout) as t:
+            super().acquire()
+        return not t.expired
+
+class _Semaphore(sync.Semaphore):
+    def acquire(self, blocking=True, timeout=None):
+        with _limit(blocking, timeout) as t:
+            super().acquire()
+        return not t.expired
+
+class _BoundedSemaphore(_Semaphore, sync.BoundedSemaphore):
+    pass
+
+class _Condition(sync.Condition):
+    def __init__(self, lock=None):
+        super().__init__(_RLock() if lock is None else lock)
+
+# -- queue
+
+class _Queue(Queue):
+    def get(self, block=True, timeout=None):
+        with _limit(block, timeout):
+            return super().get()
+        raise queue.Empty
+
+    def put(self, item, block=True, timeout=None):
+        with _limit(block, timeout):
+            return super().put(item)
+        raise queue.Full
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+# -- select
+
+async def _readable(fd):
+    await _read_wait(fd)
+
+async def _writable(fd):
+    await _write_wait(fd)
+
+async def _select_wait(rlist, wlist):
+    if not rlist and not wlist:
+        await curio.Event().wait()
+    async with curio.TaskGroup(wait=any) as g:
+        for fd in rlist:
+            await g.spawn(_readable, fd)
+        for fd in wlist:
+            await g.spawn(_writable, fd)
+
+def _fds(objs):
+    return { obj if isinstance(obj, int) else obj.fileno() for obj in objs }
+
+def _select(rlist, wlist, xlist, timeout=None, *, _native=select.select):
+    result = _native(rlist, wlist, xlist, 0)
+    if any(result) or timeout == 0:
+        return result
+    # Exceptional conditions are only reported if something else happens
+    with ignore_after(timeout):
+        AWAIT(_select_wait, _fds(rlist), _fds(wlist))
+    return _native(rlist, wlist, xlist, 0)
+
+# -- ssl
+
+def _wrap_socket(self, sock, *args, do_handshake_on_connect=True, _native=ssl.SSLContext.wrap_socket, **kwargs):
+    if not isinstance(sock, io.Socket):
+        return _native(self, sock, *args, do_handshake_on_connect=do_handshake_on_connect, **kwargs)
+    sslsock = io.Socket(_native(self, sock._socket, *args, do_handshake_on_connect=False, **kwargs))
+    if do_handshake_on_connect:
+        try:
+            sslsock.getpeername()
+        except OSError:
+            # Not connected yet
+            sslsock.do_handshake_on_connect = True
+        else:
+            sslsock.do_handshake()
+    return sslsock
+
+def _patches(name):
+    '''
+    Return a list of (object, attribute, replacement) for the named patch.
+    '''
+    if name == 'socket':
+        return [ (_socket, attr, _dispatch(getattr(_socket, attr), getattr(socket, attr)))
+                 for attr in ('socketpair', 'fromfd', 'create_connection', 'getaddrinfo',
+                              'getnameinfo', 'gethostbyname', 'gethostbyname_ex', 'gethostbyaddr') ] + \
+               [ (_socket, 'socket', _dispatch_class(_socket.socket, socket.socket)) ]
+    elif name == 'ssl':
+        return [ (ssl.SSLContext, 'wrap_socket', _wrap_socket) ]
+    elif name == 'select':
+        return [ (select, 'select', _dispatch(select.select, _select)) ]
+    elif name == 'time':
+        return [ (time, 'sleep', _dispatch(time.sleep, sleep)) ]
+    elif name == 'threading':
+        return [ (threading, 'Lock', _dispatch(threading.Lock, _Lock)),
+                 (threading, 'RLock', _dispatch(threading.RLock, _RLock)),
+                 (threading, 'Semaphore', _dispatch_class(threading.Semaphore, _Semaphore)),
+                 (threading, 'BoundedSemaphore', _dispatch_class(threading.BoundedSemaphore, _BoundedSemaphore)),
+                 (threading, 'Event', _dispatch_class(threading.Event, sync.Event)),
+                 (threading, 'Condition', _dispatch_class(threading.Condition, _Condition)) ]
+    elif name == 'queue':
+        return [ (queue, 'Queue', _dispatch_class(queue.Queue, _Queue)) ]
+    else:
+        raise ValueError('Unknown patch %r' % name)
+
+_applied = { }          # name -> [(object, attribute, original)]
+
+def patch(*names):
+    '''
+    Apply the named patches (by default, all of them). Returns the
+    names of the patches that weren't already applied.
+    '''
+    names = names or PATCHES
+    applied = []
+    for name in names:
+        if name in _applied:
+            continue
+        saved = []
+        for obj, attr, replacement in _patches(name):
+            saved.append((obj, attr, obj.__dict__[attr]))
+            setattr(obj, attr, replacement)
+        _applied[name] = saved
+        applied.append(name)
+    return applied
+
+def unpatch(*names):
+    '''
+    Undo the named patches (by default, all of them).
+    '''
+    for name in (names or list(_applied)):
+        for obj, attr, original in reversed(_applied.pop(name, [])):
+            setattr(obj, attr, original)
+
 @contextmanager
-def more_magic():
+def more_magic(*patches):
+    '''
+    Make the socket module imported in the block be thredo.socket.
+    If patches are given, the named patches ('all' for all of them)
+    are also applied for the duration of the block.
+    '''
+    if 'all' in patches:
+        patches = PATCHES
+    applied = patch(*patches) if patches else []
     sockmod = sys.modules['socket']
     sys.modules['socket'] = socket
     try:
         yield
     finally:
         sys.modules['socket'] = sockmod
+        unpatch(*applied)
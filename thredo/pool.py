@@ -0,0 +1,151 @@
+# pool.py
+#
+# A pool of reusable OS threads for running thredo threads.  Creating
+# a brand new OS thread for every spawn() is expensive compared to the
+# amount of work done by a typical short-lived handler.  Instead,
+# finished threads park themselves in the pool and wait for the next
+# thread to be spawned.
+
+__all__ = ['ThreadPool']
+
+import threading
+import queue
+
+from curio.thread import AsyncThread, _locals
+import curio
+from . import thr
+
+class ThreadPool(object):
+    '''
+    Pool of OS threads.  min_size threads are started up front and are
+    always kept around.  At most max_size idle threads are retained.
+    Idle threads in excess of min_size exit after idle_timeout seconds.
+    Spawning never blocks.  If no idle thread is available, a new one
+    is created regardless of max_size.
+    '''
+    def __init__(self, min_size=0, max_size=64, idle_timeout=60.0):
+        if min_size > max_size:
+            raise ValueError('min_size must not exceed max_size')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = []            # Job queues of idle workers (LIFO)
+        self._nthreads = 0
+        self._closed = False
+        with self._lock:
+            for n in range(min_size):
+                self._start_worker(None)
+
+    def __repr__(self):
+        return '<thredo.ThreadPool threads=%d idle=%d>' % (self._nthreads, len(self._idle))
+
+    @property
+    def size(self):
+        return self._nthreads
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    # Must be called with self._lock held
+    def _start_worker(self, athread):
+        jobs = queue.SimpleQueue()
+        if athread is None:
+            self._idle.append(jobs)
+        else:
+            jobs.put(athread)
+        self._nthreads += 1
+        threading.Thread(target=self._worker, args=(jobs,), daemon=True).start()
+
+    def submit(self, athread):
+        '''
+        Run the target of the AsyncThread athread in a pooled OS thread.
+        '''
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('ThreadPool is shut down')
+            if self._idle:
+                self._idle.pop().put(athread)
+            else:
+                self._start_worker(athread)
+
+    def shutdown(self):
+        '''
+        Make all idle threads exit. Busy threads exit when they finish.
+        '''
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._nthreads -= len(idle)
+        for jobs in idle:
+            jobs.put(None)
+
+    def _next_job(self, jobs):
+        while True:
+            try:
+                return jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if jobs in self._idle and self._nthreads > self.min_size:
+                        self._idle.remove(jobs)
+                        self._nthreads -= 1
+                        return None
+
+    def _worker(self, jobs):
+        ident = threading.get_ident()
+        while True:
+            athread = self._next_job(jobs)
+            if athread is None:
+                return
+            _locals.thread = athread
+            thr._threads[ident] = athread
+            thr._stats_start(athread)
+            try:
+                athread._result_value = athread.target(*athread.args, **athread.kwargs)
+                athread._result_exc = None
+            except BaseException as e:
+                athread._result_value = None
+                athread._result_exc = e
+            finally:
+                thr._stats_exit(athread)
+                del thr._threads[ident]
+                _locals.__dict__.clear()
+
+            # Return to the pool *before* reporting completion so that a
+            # spawn() following a join() finds this thread idle
+            with self._lock:
+                retire = self._closed or len(self._idle) >= self.max_size
+                if retire:
+                    self._nthreads -= 1
+                else:
+                    self._idle.append(jobs)
+            athread._request.set_result(None)
+            if retire:
+                return
+
+class _PooledAsyncThread(AsyncThread):
+    def __init__(self, pool, target, args=(), kwargs={}, daemon=False):
+        super().__init__(target, args=args, kwargs=kwargs, daemon=daemon)
+        self._pool = pool
+
+    async def start(self):
+        self._task = await curio.spawn(self._coro_runner, daemon=True)
+        self._pool.submit(self)
+
+# Pool used by spawn().  Installed by thredo.run()
+_pool = None
+
+async def spawn_thread(func, *args, daemon=False, kernel=None):
+    '''
+    Launch a thredo thread.  Mirrors curio.spawn_thread(), but the thread
+    is taken from the pool if one is installed.  kernel is the thredo
+    Kernel that the calling task runs in (if several are used).
+    '''
+    if _pool is None:
+        return await curio.spawn_thread(func, *args, daemon=daemon)
+    t = _PooledAsyncThread(_pool, func, args=args, daemon=daemon)
+    t._kernel = kernel
+    await t.start()
+    return t
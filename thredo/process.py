@@ -0,0 +1,130 @@
+# process.py
+#
+# Running CPU-bound work in other processes.  All thredo threads share
+# the GIL, so a long computation in one of them stalls all others.
+# run_in_process() sends the work to a worker process.  The calling
+# thread waits for the reply in the kernel, so the wait can be
+# cancelled or timed out like any other thredo operation.  Since there
+# is no way to interrupt the computation itself, the worker process is
+# killed when that happens and a fresh one is started when needed.
+
+__all__ = ['ProcessPool', 'run_in_process']
+
+import os
+import signal
+import multiprocessing
+
+from curio.traps import _read_wait
+from curio.workers import ExceptionWithTraceback
+from .thr import TAWAIT as AWAIT
+from .queue import Queue
+
+def _serve(conn):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        func, args = conn.recv()
+        try:
+            result = func(*args)
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, ExceptionWithTraceback(e, e.__traceback__)))
+        del func, args
+
+class _ProcessWorker(object):
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ntasks = 0
+
+    def apply(self, func, args):
+        '''
+        Returns a tuple (success, result).  If success is false, result
+        is the exception raised by func.
+        '''
+        self.conn.send((func, args))
+        AWAIT(_read_wait, self.conn.fileno())
+        self.ntasks += 1
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class ProcessPool(object):
+    '''
+    Pool of worker processes.  At most max_workers processes are used
+    (by default, the number of CPUs).  They are started as needed.  If
+    max_tasks is given, a process is replaced after carrying out that
+    many calls.
+    '''
+    def __init__(self, max_workers=None, max_tasks=None, context=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than 0')
+        self.max_workers = max_workers
+        self.max_tasks = max_tasks
+        self._context = context or multiprocessing.get_context()
+        # Idle workers.  None stands for a worker that hasn't been started.
+        self._idle = Queue()
+        for n in range(max_workers):
+            self._idle.put(None)
+
+    def __repr__(self):
+        return '<thredo.ProcessPool max_workers=%d>' % self.max_workers
+
+    def apply(self, func, *args):
+        '''
+        Call func(*args) in a worker process and return the result.
+        If the calling thread is cancelled or times out while waiting,
+        the worker process is killed.
+        '''
+        worker = self._idle.get()
+        try:
+            if worker is None:
+                worker = _ProcessWorker(self._context)
+            try:
+                success, result = worker.apply(func, args)
+            except BaseException:
+                # Cancelled (or a communication failure) while the
+                # worker was busy.  The worker is in an unknown state.
+                worker.kill()
+                worker = None
+                raise
+            if self.max_tasks and worker.ntasks >= self.max_tasks:
+                worker.kill()
+                worker = None
+            if success:
+                return result
+            raise result
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        '''
+        Kill all idle worker processes.
+        '''
+        workers = []
+        while not self._idle.empty():
+            workers.append(self._idle.get())
+        for worker in workers:
+            if worker is not None:
+                worker.kill()
+            self._idle.put(None)
+
+# Pool used by run_in_process().  Installed by thredo.run()
+_pool = None
+
+def run_in_process(func, *args):
+    '''
+    Call func(*args) in a separate process and return the result.
+    func, args and the result must be picklable.  The wait can be
+    cancelled.  In that case, the process running func is killed.
+    '''
+    if _pool is None:
+        raise RuntimeError('thredo.run() not active')
+    return _pool.apply(func, *args)
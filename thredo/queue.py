@@ -1,41 +1,640 @@
 # queue.py
 #
-# A basic queue
+# A basic queue.  Like the primitives in sync.py, the queue state is
+# protected by a short-lived guard lock and threads only enter the
+# kernel if they actually have to wait.  Subclasses only change how
+# items are stored, which determines the order they come out in.
 
-__all__ = [ 'Queue' ]
+__all__ = [ 'Queue', 'LifoQueue', 'PriorityQueue', 'CoalescingQueue', 'ByteQueue',
+            'UniversalQueue', 'QueueClosed' ]
 
-import curio
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+import asyncio
+import heapq
+import threading
+
+# -- Curio
+from curio.meta import awaitable, asyncioable
+from curio.thread import is_async_thread
+from curio.traps import _future_wait
 
 # -- Thredo
-from .thr import TAWAIT as AWAIT
+from .thr import WaitQueue, park
+
+class QueueClosed(Exception):
+    '''
+    Raised by put() on a closed queue, and by get() once a closed queue
+    has been emptied.
+    '''
+
+# Handed to waiting threads by close() in place of an item or a slot
+_CLOSED = object()
 
 class Queue(object):
     def __init__(self, maxsize=0):
-        self._queue = curio.Queue(maxsize)
+        self.maxsize = maxsize
+        self._guard = threading.Lock()
+        self._items = self._init_items()
+        self._getting = WaitQueue()
+        self._putting = WaitQueue()
+        self._joining = WaitQueue()
+        self._reserved = 0         # Free slots promised to woken putters
+        self._unfinished = 0
+        self._closed = False
+
+    def __repr__(self):
+        return '<thredo.%s size=%d>' % (type(self).__name__, len(self._items))
+
+    # Storage of the items.  Called with the guard held.  _insert()
+    # returns False if the item didn't take up a slot of its own.
+    # _reinsert() puts back an item that was removed by _remove().
+    def _init_items(self):
+        return deque()
+
+    def _insert(self, item):
+        self._items.append(item)
+        return True
+
+    def _remove(self):
+        return self._items.popleft()
+
+    def _reinsert(self, item):
+        self._items.appendleft(item)
+        return True
 
     def empty(self):
-        return self._queue.empty()
+        return not self._items
 
     def full(self):
-        return self._queue.full()
+        return self.maxsize > 0 and len(self._items) + self._reserved >= self.maxsize
+
+    def qsize(self):
+        return len(self._items)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        '''
+        Close the queue.  Items already in the queue can still be taken.
+        After that, get() raises QueueClosed, as does put() right away.
+        All waiting threads are released at once.
+        '''
+        with self._guard:
+            if self._closed:
+                return
+            self._closed = True
+            # Threads waiting to get only wait if the queue is empty
+            self._getting.wake(len(self._getting), _CLOSED)
+            self._putting.wake(len(self._putting), _CLOSED)
+
+    # Must be called with the guard held after an item is removed
+    def _wake_putter(self):
+        if self._putting.wake():
+            self._reserved += 1
+
+    # Wait for the Future of a get(), put() or join() to complete
+    def _park(self, fut):
+        park(fut, 'queue')
 
     def get(self):
-        return AWAIT(self._queue.get)
+        fut, item = self._get_begin()
+        if fut is None:
+            return item
+        try:
+            self._park(fut)
+        except BaseException:
+            self._get_abandon(fut)
+            raise
+        return self._get_result(fut)
+
+    # The steps of get(), put() and join() before and after waiting.
+    # _begin() returns the Future to wait on, if any.  _abandon() is
+    # called if the wait ends with an exception.
+    def _get_begin(self):
+        with self._guard:
+            if self._items:
+                item = self._remove()
+                self._wake_putter()
+                return None, item
+            if self._closed:
+                raise QueueClosed()
+            return self._getting.add(), None
+
+    def _get_abandon(self, fut):
+        with self._guard:
+            # An item handed to us as we were cancelled goes back
+            if self._getting.abandon(fut) and fut.result() is not _CLOSED:
+                self._requeue(fut.result())
+
+    def _get_result(self, fut):
+        item = fut.result()
+        if item is _CLOSED:
+            raise QueueClosed()
+        return item
+
+    # Must be called with the guard held
+    def _requeue(self, item):
+        getter = self._getting.claim()
+        if getter:
+            getter.set_result(item)
+        elif not self._reinsert(item):
+            # Superseded while it was away
+            self._unfinished -= 1
+
+    def put(self, item):
+        fut = self._put_begin(item)
+        if fut is None:
+            return
+        try:
+            self._park(fut)
+        except BaseException:
+            self._put_abandon(fut)
+            raise
+        self._put_end(fut, item)
+
+    def _put_begin(self, item):
+        with self._guard:
+            if self._closed:
+                raise QueueClosed()
+            if not self._putting and not self.full():
+                self._put(item)
+                return None
+            return self._putting.add()
+
+    def _put_abandon(self, fut):
+        with self._guard:
+            # Pass a free slot promised to us on to the next putter
+            if self._putting.abandon(fut) and fut.result() is not _CLOSED:
+                self._reserved -= 1
+                self._wake_putter()
+
+    def _put_end(self, fut, item):
+        if fut.result() is _CLOSED:
+            raise QueueClosed()
+        with self._guard:
+            self._reserved -= 1
+            if self._closed:
+                raise QueueClosed()
+            # If the item didn't use the slot, it's still free
+            if self._put(item):
+                self._wake_putter()
+
+    # Must be called with the guard held. Returns True if the item
+    # didn't take up a slot in the queue, either because it was handed
+    # directly to a waiting getter or because it was merged.
+    def _put(self, item):
+        getter = self._getting.claim()
+        if getter:
+            self._unfinished += 1
+            getter.set_result(item)
+            return True
+        if self._insert(item):
+            self._unfinished += 1
+            return False
+        return True
+
+    # Must be called with the guard held.  Puts items[i:] for as long
+    # as there is room without getting ahead of waiting putters.
+    # Returns the index of the first item not put.
+    def _put_some(self, items, i):
+        while i < len(items) and not self._putting and not self.full():
+            self._put(items[i])
+            i += 1
+        return i
+
+    def put_many(self, items):
+        '''
+        Put all of the items on the queue.  As many items as there is
+        room for are put at once.
+        '''
+        items = list(items)
+        with self._guard:
+            if self._closed:
+                raise QueueClosed()
+            i = self._put_some(items, 0)
+        while i < len(items):
+            # Wait for room in turn with other putters
+            self.put(items[i])
+            with self._guard:
+                if self._closed:
+                    raise QueueClosed()
+                i = self._put_some(items, i + 1)
+
+    # Must be called with the guard held
+    def _get_some(self, result, max_items):
+        n = min(max_items - len(result), len(self._items))
+        if n > 0:
+            remove = self._remove
+            result.extend(remove() for _ in range(n))
+            self._reserved += self._putting.wake(n)
+
+    def get_many(self, max_items, min_items=1):
+        '''
+        Get at least min_items and at most max_items items from the queue
+        as a list.  Waits until min_items are available.  With a
+        min_items of 0, never waits.  If the queue is closed, returns
+        whatever is left, raising QueueClosed if nothing is.
+        '''
+        if min_items > max_items:
+            raise ValueError('min_items must be <= max_items')
+        result = []
+        with self._guard:
+            self._get_some(result, max_items)
+            if not result and self._closed:
+                raise QueueClosed()
+        if len(result) >= min_items:
+            return result
+        try:
+            while len(result) < min_items:
+                try:
+                    result.append(self.get())
+                except QueueClosed:
+                    if result:
+                        break
+                    raise
+                with self._guard:
+                    self._get_some(result, max_items)
+        except BaseException:
+            with self._guard:
+                # Items already taken go back to the front of the queue
+                for item in reversed(result):
+                    self._requeue(item)
+            raise
+        return result
 
     def join(self):
-        return AWAIT(self._queue.join)
+        fut = self._join_begin()
+        if fut is None:
+            return
+        try:
+            self._park(fut)
+        except BaseException:
+            self._join_abandon(fut)
+            raise
+
+    def _join_begin(self):
+        with self._guard:
+            if not self._unfinished:
+                return None
+            return self._joining.add()
+
+    def _join_abandon(self, fut):
+        with self._guard:
+            self._joining.abandon(fut)
+
+    def task_done(self, n=1):
+        '''
+        Indicate that n items taken from the queue have been processed.
+        '''
+        with self._guard:
+            if self._unfinished < n:
+                raise ValueError('task_done() called too many times')
+            self._unfinished -= n
+            if not self._unfinished:
+                self._joining.wake(len(self._joining))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.get()
+        except QueueClosed:
+            raise StopIteration
+
+class LifoQueue(Queue):
+    '''
+    Queue that returns the most recently added item first.
+    '''
+    def _init_items(self):
+        return []
+
+    def _remove(self):
+        return self._items.pop()
+
+    def _reinsert(self, item):
+        self._items.append(item)
+        return True
+
+class PriorityQueue(Queue):
+    '''
+    Queue that returns the lowest item first.  Items are typically
+    (priority, data) tuples.
+    '''
+    def _init_items(self):
+        return []
+
+    def _insert(self, item):
+        heapq.heappush(self._items, item)
+        return True
+
+    def _remove(self):
+        return heapq.heappop(self._items)
+
+    _reinsert = _insert
+
+class CoalescingQueue(Queue):
+    '''
+    FIFO queue that holds at most one item per key.  key(item) gives the
+    key of an item (by default, the item itself).  Putting an item whose
+    key is already queued replaces the queued item in its place in line.
+    So only the latest item for each key is delivered, and it never waits
+    for room.
+    '''
+    def __init__(self, maxsize=0, key=None):
+        self._key = key or (lambda item: item)
+        super().__init__(maxsize)
+
+    def _init_items(self):
+        return OrderedDict()
+
+    def _insert(self, item):
+        key = self._key(item)
+        new = key not in self._items
+        self._items[key] = item
+        return new
+
+    def _remove(self):
+        return self._items.popitem(last=False)[1]
+
+    def _reinsert(self, item):
+        key = self._key(item)
+        if key in self._items:
+            # A newer item has been put since
+            return False
+        self._items[key] = item
+        self._items.move_to_end(key, last=False)
+        return True
 
     def put(self, item):
-        return AWAIT(self._queue.put, item)
+        key = self._key(item)
+        with self._guard:
+            if key in self._items and not self._closed:
+                self._items[key] = item
+                return
+        super().put(item)
+
+class UniversalQueue(Queue):
+    '''
+    Queue that can also be used outside of thredo.  Plain threads block
+    on the Future of a get(), put() or join() directly instead of being
+    promoted to thredo threads.  In Curio tasks and asyncio coroutines,
+    the same methods must be awaited.  Thredo threads wait cancellably,
+    just as on a Queue.  Only get(), put() and join() may be awaited.
+    '''
+    def _park(self, fut):
+        if is_async_thread():
+            park(fut, 'queue')
+        else:
+            fut.result()
+
+    # Waits for fut in a Curio task or asyncio coroutine
+    async def _curio_wait(self, fut):
+        await _future_wait(fut)
+
+    async def _asyncio_wait(self, fut):
+        await asyncio.wrap_future(fut)
+
+    # The rest of a get(), put() or join() that has to wait on fut
+    async def _async_get(self, fut, wait):
+        try:
+            await wait(fut)
+        except BaseException:
+            self._get_abandon(fut)
+            raise
+        return self._get_result(fut)
+
+    async def _async_put(self, fut, wait, item):
+        try:
+            await wait(fut)
+        except BaseException:
+            self._put_abandon(fut)
+            raise
+        self._put_end(fut, item)
+
+    async def _async_join(self, fut, wait):
+        try:
+            await wait(fut)
+        except BaseException:
+            self._join_abandon(fut)
+            raise
+
+    get = Queue.get
+
+    @awaitable(get)
+    async def get(self):
+        fut, item = self._get_begin()
+        if fut is None:
+            return item
+        return await self._async_get(fut, self._curio_wait)
+
+    @asyncioable(get)
+    async def get(self):
+        fut, item = self._get_begin()
+        if fut is None:
+            return item
+        return await self._async_get(fut, self._asyncio_wait)
+
+    put = Queue.put
+
+    @awaitable(put)
+    async def put(self, item):
+        fut = self._put_begin(item)
+        if fut is not None:
+            await self._async_put(fut, self._curio_wait, item)
+
+    @asyncioable(put)
+    async def put(self, item):
+        fut = self._put_begin(item)
+        if fut is not None:
+            await self._async_put(fut, self._asyncio_wait, item)
+
+    join = Queue.join
+
+    @awaitable(join)
+    async def join(self):
+        fut = self._join_begin()
+        if fut is not None:
+            await self._async_join(fut, self._curio_wait)
+
+    @asyncioable(join)
+    async def join(self):
+        fut = self._join_begin()
+        if fut is not None:
+            await self._async_join(fut, self._asyncio_wait)
+
+class ByteQueue(object):
+    '''
+    FIFO queue bounded by the total size of its items rather than their
+    number.  sizeof(item) gives the size of an item (by default, len()).
+    put() waits until the item fits within maxbytes.  Putters waiting
+    for room go in order, so a large item isn't held back by smaller
+    ones behind it.  An item larger than maxbytes is let in once the
+    queue is empty.
+
+    on_high(queue) is called when the size of the queue reaches
+    high_water (by default, maxbytes).  After that, on_low(queue) is
+    called when it has fallen to low_water (by default, half of
+    high_water).  Both are called by the thread that crossed the mark
+    and must not block.
+    '''
+    def __init__(self, maxbytes, sizeof=len, high_water=None, low_water=None,
+                 on_high=None, on_low=None):
+        self.maxbytes = maxbytes
+        self.high_water = maxbytes if high_water is None else high_water
+        self.low_water = self.high_water // 2 if low_water is None else low_water
+        self._sizeof = sizeof
+        self._on_high = on_high
+        self._on_low = on_low
+        self._queue = Queue()      # (item, size)
+        self._guard = threading.Lock()
+        self._bytes = 0            # Size of items queued or about to be
+        self._waiting = deque()    # (Future, size) of putters waiting for room
+        self._closed = False
+        self._high = False
+
+    def __repr__(self):
+        return '<thredo.ByteQueue size=%d bytes=%d>' % (self._queue.qsize(), self._bytes)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def empty(self):
+        return self._queue.empty()
+
+    def full(self):
+        return self._bytes >= self.maxbytes
 
     def qsize(self):
         return self._queue.qsize()
 
-    def task_done(self):
-        return AWAIT(self._queue.task_done)
+    @property
+    def closed(self):
+        return self._closed
+
+    # Must be called with the guard held
+    def _fits(self, size):
+        return self._bytes + size <= self.maxbytes or not self._bytes
+
+    # Must be called with the guard held. Returns the watermark callback
+    # to call, if any, once the guard is released.
+    def _take(self, size):
+        self._bytes += size
+        if not self._high and self._bytes >= self.high_water:
+            self._high = True
+            return self._on_high
+        return None
+
+    # Must be called with the guard held.  Hands room to waiting putters
+    # in order for as long as the first one fits.
+    def _grant(self):
+        waiting = self._waiting
+        while waiting:
+            fut, n = waiting[0]
+            if fut.cancelled():
+                waiting.popleft()
+                continue
+            if not self._fits(n):
+                break
+            waiting.popleft()
+            if fut.set_running_or_notify_cancel():
+                self._bytes += n
+                fut.set_result(None)
+
+    def _release(self, size):
+        with self._guard:
+            self._bytes -= size
+            self._grant()
+            if self._high and self._bytes <= self.low_water:
+                self._high = False
+                callback = self._on_low
+            else:
+                callback = None
+        if callback:
+            callback(self)
+
+    def put(self, item):
+        size = self._sizeof(item)
+        with self._guard:
+            if self._closed:
+                raise QueueClosed()
+            if not self._waiting and self._fits(size):
+                callback = self._take(size)
+                fut = None
+            else:
+                fut = Future()
+                self._waiting.append((fut, size))
+        if fut:
+            try:
+                park(fut, 'queue')
+            except BaseException:
+                with self._guard:
+                    try:
+                        self._waiting.remove((fut, size))
+                        granted = False
+                    except ValueError:
+                        granted = not fut.cancelled() and fut.result() is not _CLOSED
+                    if not granted:
+                        # Somebody else may be first now
+                        self._grant()
+                if granted:
+                    self._release(size)
+                raise
+            if fut.result() is _CLOSED:
+                raise QueueClosed()
+            with self._guard:
+                # The room was taken for us by _release()
+                self._bytes -= size
+                callback = self._take(size)
+        if callback:
+            callback(self)
+        try:
+            self._queue.put((item, size))
+        except QueueClosed:
+            self._release(size)
+            raise
+
+    def put_many(self, items):
+        for item in items:
+            self.put(item)
+
+    def get(self):
+        item, size = self._queue.get()
+        self._release(size)
+        return item
+
+    def get_many(self, max_items, min_items=1):
+        entries = self._queue.get_many(max_items, min_items)
+        self._release(sum(size for item, size in entries))
+        return [ item for item, size in entries ]
+
+    def close(self):
+        '''
+        Close the queue.  See Queue.close().
+        '''
+        with self._guard:
+            self._closed = True
+            while self._waiting:
+                fut, size = self._waiting.popleft()
+                if fut.set_running_or_notify_cancel():
+                    fut.set_result(_CLOSED)
+        self._queue.close()
+
+    def join(self):
+        self._queue.join()
+
+    def task_done(self, n=1):
+        self._queue.task_done(n)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return self.get()
+        try:
+            return self.get()
+        except QueueClosed:
+            raise StopIteration
@@ -0,0 +1,191 @@
+# ratelimit.py
+#
+# Token bucket rate limiting.  Throttling with sleep() in a loop wakes
+# every throttled thread over and over just to find out that it still
+# can't go.  Here, threads that have to wait are parked in the kernel
+# in the order they arrived.  A single timer is set for the moment the
+# first of them can go ahead.  When it fires, all of the waiting threads
+# that the accumulated tokens allow are released together and a timer
+# is set for the next one.
+
+__all__ = ['RateLimiter', 'KeyedRateLimiter']
+
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from functools import partial
+
+# -- Thredo
+from .thr import park
+from . import timer
+
+# Slack allowed when comparing token counts. Timers never fire early,
+# but the refill computed when one fires may still be a rounding error
+# short of what was asked for.
+_EPSILON = 1e-9
+
+class RateLimiter(object):
+    '''
+    Token bucket.  Tokens are added at rate per second, up to a maximum
+    of burst.  acquire(n) takes n tokens, waiting for them if necessary.
+    Waiting threads are served in order.  Timers have a resolution of
+    a millisecond, so a rate much higher than burst per millisecond
+    can't be reached.
+    '''
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        if burst < 1:
+            raise ValueError('burst must be >= 1')
+        self.rate = rate
+        self.burst = burst
+        self._guard = threading.Lock()
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._waiting = deque()    # (Future, tokens)
+        self._timer = None         # Pending Timer
+        self._wakeup = None        # Deadline of the pending Timer
+
+    def __repr__(self):
+        return '<thredo.RateLimiter rate=%g burst=%g waiting=%d>' % (
+            self.rate, self.burst, len(self._waiting))
+
+    @property
+    def tokens(self):
+        '''
+        Number of tokens available right now.
+        '''
+        with self._guard:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def try_acquire(self, n=1):
+        '''
+        Take n tokens if they're available without waiting. Returns
+        True if they were taken.
+        '''
+        with self._guard:
+            if self._waiting:
+                return False
+            self._refill(time.monotonic())
+            if self._tokens < n - _EPSILON:
+                return False
+            self._tokens -= n
+            return True
+
+    def acquire(self, n=1):
+        if n > self.burst:
+            raise ValueError('Can not acquire more than burst tokens')
+        with self._guard:
+            if not self._waiting:
+                self._refill(time.monotonic())
+                if self._tokens >= n - _EPSILON:
+                    self._tokens -= n
+                    return True
+            fut = Future()
+            self._waiting.append((fut, n))
+            if len(self._waiting) == 1:
+                self._schedule()
+        try:
+            park(fut, 'rate')
+        except BaseException:
+            with self._guard:
+                try:
+                    self._waiting.remove((fut, n))
+                except ValueError:
+                    if not fut.cancelled():
+                        # Released while being cancelled. The tokens weren't used.
+                        self._tokens = min(self._tokens + n, self.burst)
+                # Somebody else may be first now
+                self._release(time.monotonic())
+            raise
+        return True
+
+    def _refill(self, now):
+        self._tokens = min(self._tokens + (now - self._stamp) * self.rate, self.burst)
+        self._stamp = now
+
+    # Must be called with the guard held.  Releases waiting threads in
+    # order for as long as there are tokens.
+    def _release(self, now):
+        self._refill(now)
+        waiting = self._waiting
+        while waiting:
+            fut, n = waiting[0]
+            if fut.cancelled():
+                waiting.popleft()
+                continue
+            if self._tokens < n - _EPSILON:
+                self._schedule()
+                break
+            waiting.popleft()
+            if fut.set_running_or_notify_cancel():
+                self._tokens -= n
+                fut.set_result(None)
+
+    # Must be called with the guard held.  Makes sure that a timer fires
+    # once there are enough tokens for the first waiting thread.
+    def _schedule(self):
+        fut, n = self._waiting[0]
+        deadline = self._stamp + (n - self._tokens) / self.rate
+        if self._timer is not None:
+            if self._wakeup <= deadline:
+                return
+            timer._wheel.cancel(self._timer)
+        self._wakeup = deadline
+        self._timer = timer._wheel.add(deadline, partial(self._expire, deadline))
+
+    # Timer callback. Runs in the kernel.
+    def _expire(self, deadline):
+        with self._guard:
+            if self._wakeup == deadline:
+                self._timer = self._wakeup = None
+            self._release(time.monotonic())
+
+class KeyedRateLimiter(object):
+    '''
+    A separate RateLimiter(rate, burst) for each key, such as a host
+    name.  Limiters are created on first use.  At most maxsize of them
+    are kept.  Beyond that, the least recently used limiter without
+    waiting threads is discarded.
+    '''
+    def __init__(self, rate, burst=1, maxsize=1024):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._guard = threading.Lock()
+        self._limiters = OrderedDict()
+
+    def __repr__(self):
+        return '<thredo.KeyedRateLimiter rate=%g burst=%g keys=%d>' % (
+            self.rate, self.burst, len(self._limiters))
+
+    def __len__(self):
+        return len(self._limiters)
+
+    def __contains__(self, key):
+        return key in self._limiters
+
+    def __getitem__(self, key):
+        with self._guard:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = RateLimiter(self.rate, self.burst)
+                if len(self._limiters) > self.maxsize:
+                    self._evict()
+            else:
+                self._limiters.move_to_end(key)
+            return limiter
+
+    def _evict(self):
+        for key, limiter in self._limiters.items():
+            if not limiter._waiting:
+                del self._limiters[key]
+                break
+
+    def try_acquire(self, key, n=1):
+        return self[key].try_acquire(n)
+
+    def acquire(self, key, n=1):
+        return self[key].acquire(n)
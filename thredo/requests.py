@@ -6,8 +6,11 @@
 
 __all__ = ['get_session']
 
+from urllib.parse import urlsplit
+
 # -- Thredo
 from . import socket
+from .ratelimit import KeyedRateLimiter
 
 # -- Requests/third party
 import requests
@@ -16,7 +19,27 @@ from requests.packages.urllib3 import PoolManager, HTTPConnectionPool
 from requests.packages.urllib3 import HTTPSConnectionPool
 from http.client import HTTPConnection, HTTPSConnection
 
+_DEFAULT_PORTS = { 'http': 80, 'https': 443 }
+
+# Key of the host a request goes to.  Credentials in the URL are left
+# out, so all of them share the host's limiter.
+def _host_key(url):
+    parts = urlsplit(url)
+    return parts.hostname, parts.port or _DEFAULT_PORTS.get(parts.scheme)
+
 class ThredoAdapter(HTTPAdapter):
+    def __init__(self, limiter=None, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        # Throttle before taking a connection from the pool
+        if isinstance(self.limiter, KeyedRateLimiter):
+            self.limiter.acquire(_host_key(request.url))
+        elif self.limiter is not None:
+            self.limiter.acquire()
+        return super().send(request, **kwargs)
+
     def init_poolmanager(self, connections, maxsize, block):
         self.poolmanager = ThredoPoolManager(num_pools=connections,
                                                maxsize=maxsize,
@@ -73,9 +96,15 @@ class ThredoHTTPSConnection(HTTPSConnection):
             
         self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname)
 
-def get_session():
+def get_session(limiter=None):
+    '''
+    Return a requests Session that uses thredo sockets.  limiter is an
+    optional RateLimiter that every request has to go through, or a
+    KeyedRateLimiter, which throttles each (host name, port) separately.
+    '''
     s = requests.Session()
-    s.mount('http://', ThredoAdapter())
-    s.mount('https://', ThredoAdapter())
+    adapter = ThredoAdapter(limiter)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
     return s
 
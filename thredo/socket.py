@@ -10,8 +10,11 @@ __all__ = _socket.__all__
 from socket import *
 from socket import _GLOBAL_DEFAULT_TIMEOUT
 
-from functools import wraps
+from functools import wraps, partial
+from curio import run_in_thread
 from . import io
+from .thr import TAWAIT as AWAIT
+from .core import timeout_after, ThreadTimeout
 import sys
     
 @wraps(_socket.socket)
@@ -35,11 +38,69 @@ def socketpair(*args, **kwargs):
 def fromfd(*args, **kwargs):
     return io.Socket(_socket.fromfd(*args, **kwargs))
 
-# Replacements for blocking functions related to domain names and DNS
+# Replacements for blocking functions related to domain names and DNS.
+# The resolver can't be made non-blocking, so lookups are carried out
+# in a separate thread.  The calling thread waits in the kernel, where
+# it can be cancelled.
 
-@wraps(_socket.create_connection)
-def create_connection(*args, **kwargs):
-    sock = _socket.create_connection(*args, **kwargs)
-    return io.Socket(sock)
+@wraps(_socket.getaddrinfo)
+def getaddrinfo(*args, **kwargs):
+    return AWAIT(run_in_thread, partial(_socket.getaddrinfo, *args, **kwargs))
 
+@wraps(_socket.getnameinfo)
+def getnameinfo(*args, **kwargs):
+    return AWAIT(run_in_thread, partial(_socket.getnameinfo, *args, **kwargs))
 
+@wraps(_socket.gethostbyname)
+def gethostbyname(*args, **kwargs):
+    return AWAIT(run_in_thread, partial(_socket.gethostbyname, *args, **kwargs))
+
+@wraps(_socket.gethostbyname_ex)
+def gethostbyname_ex(*args, **kwargs):
+    return AWAIT(run_in_thread, partial(_socket.gethostbyname_ex, *args, **kwargs))
+
+@wraps(_socket.gethostbyaddr)
+def gethostbyaddr(*args, **kwargs):
+    return AWAIT(run_in_thread, partial(_socket.gethostbyaddr, *args, **kwargs))
+
+def create_connection(address, timeout=_GLOBAL_DEFAULT_TIMEOUT, source_address=None, *,
+                      all_errors=False):
+    '''
+    Like socket.create_connection(), but both the name lookup and the
+    connection attempts can be cancelled.  timeout limits each connection
+    attempt as in the standard library, raising socket.timeout.  It does
+    not apply to the socket returned. Use thredo's timeout functions for
+    that.
+    '''
+    if all_errors and sys.version_info < (3, 11):
+        raise TypeError('all_errors requires Python 3.11 or newer')
+    host, port = address
+    exceptions = []
+    for af, socktype, proto, canonname, sa in getaddrinfo(host, port, 0, SOCK_STREAM):
+        sock = None
+        try:
+            sock = socket(af, socktype, proto)
+            if source_address:
+                sock.bind(source_address)
+            if timeout is _GLOBAL_DEFAULT_TIMEOUT or timeout is None:
+                sock.connect(sa)
+            else:
+                try:
+                    with timeout_after(timeout):
+                        sock.connect(sa)
+                except ThreadTimeout:
+                    raise _socket.timeout('timed out') from None
+            return sock
+        except BaseException as e:
+            if sock is not None:
+                sock.close()
+            if not isinstance(e, OSError):
+                raise
+            if not all_errors:
+                exceptions.clear()
+            exceptions.append(e)
+    if exceptions:
+        if not all_errors:
+            raise exceptions[0]
+        raise ExceptionGroup('create_connection failed', exceptions)
+    raise error('getaddrinfo returns an empty list')
@@ -2,86 +2,795 @@
 #
 # The basic synchronization primitives such as locks, semaphores, and condition variables.
 
-__all__ = [ 'Event', 'Lock', 'RLock', 'Semaphore', 'BoundedSemaphore', 'Condition' ]
+__all__ = [ 'Event', 'Lock', 'RLock', 'Semaphore', 'BoundedSemaphore', 'Condition',
+            'RWLock', 'StripedLock', 'Barrier', 'BrokenBarrierError', 'CountDownLatch',
+            'Future', 'CapacityLimiter' ]
 
-import curio
+import threading
+import time
+from collections import deque
+from concurrent import futures
 
 # -- Thredo
-from .thr import TAWAIT as AWAIT
+from .thr import WaitQueue, Broadcast, park
 
 class Event(object):
     def __init__(self):
-        self._evt = curio.Event()
+        self._guard = threading.Lock()
+        self._set = False
+        self._waiting = WaitQueue()
 
     def is_set(self):
-        return self._evt.is_set()
+        return self._set
 
     def clear(self):
-        self._evt.clear()
+        self._set = False
 
-    def wait(self):
-        AWAIT(self._evt.wait)
+    def wait(self, timeout=None):
+        '''
+        Wait for the event to be set.  Returns False if that doesn't
+        happen within timeout seconds.
+        '''
+        with self._guard:
+            if self._set:
+                return True
+            fut = self._waiting.add()
+        try:
+            if park(fut, 'event', timeout):
+                return True
+        except BaseException:
+            with self._guard:
+                self._waiting.abandon(fut)
+            raise
+        with self._guard:
+            self._waiting.abandon(fut)
+        return self._set
 
     def set(self):
-        AWAIT(self._evt.set)
+        with self._guard:
+            self._set = True
+            if self._waiting:
+                self._waiting.wake(len(self._waiting))
 
 # Base class for all synchronization primitives that operate as context managers.
+#
+# Locks and semaphores keep their state in ordinary Python attributes
+# protected by a short-lived guard lock.  Uncontended operations never
+# leave the calling thread.  Only a thread that actually has to wait
+# enters the kernel, where it parks on a Future that the releasing
+# thread completes directly.  Ownership is handed straight to the
+# woken waiter so that acquisition stays FIFO-fair under contention.
 
 class _LockBase(object):
     def __enter__(self):
-        self._lock.__enter__()
+        self.acquire()
 
     def __exit__(self, *args):
-        self._lock.__exit__(*args)
+        self.release()
+
+    def _wait(self, fut):
+        try:
+            park(fut, 'lock')
+        except BaseException:
+            with self._guard:
+                if not self._waiting.abandon(fut):
+                    raise
+            # Ownership was handed to us while being cancelled. Pass it on.
+            self.release()
+            raise
+
+class Lock(_LockBase):
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locked = False
+        self._waiting = WaitQueue()
 
     def acquire(self):
-        AWAIT(self._lock.acquire)
+        with self._guard:
+            if not self._locked:
+                self._locked = True
+                return True
+            fut = self._waiting.add()
+        self._wait(fut)
+        return True
 
     def release(self):
-        AWAIT(self._lock.release)
+        with self._guard:
+            if not self._locked:
+                raise RuntimeError('Lock not acquired')
+            if not self._waiting.wake():
+                self._locked = False
 
     def locked(self):
-        return self._lock.locked()
-
-class Lock(_LockBase):
-    def __init__(self):
-        self._lock = curio.Lock()
+        return self._locked
 
 class RLock(_LockBase):
     def __init__(self):
-        self._lock = curio.RLock()
+        self._lock = Lock()
+        self._owner = None
+        self._count = 0
+
+    def acquire(self):
+        me = threading.get_ident()
+        if self._owner != me:
+            self._lock.acquire()
+            self._owner = me
+        self._count += 1
+        return True
+
+    def release(self):
+        if not self._count:
+            raise RuntimeError('RLock is not locked')
+        if self._owner != threading.get_ident():
+            raise RuntimeError('RLock can only be released by the owner')
+        self._count -= 1
+        if self._count == 0:
+            self._owner = None
+            self._lock.release()
+
+    def locked(self):
+        return self._count > 0
+
+    # Used by Condition.wait() to fully release a recursively held lock
+    def _release_save(self):
+        if self._owner != threading.get_ident():
+            raise RuntimeError('RLock can only be released by the owner')
+        count = self._count
+        self._count = 0
+        self._owner = None
+        self._lock.release()
+        return count
+
+    def _acquire_restore(self, count):
+        self._lock.acquire()
+        self._owner = threading.get_ident()
+        self._count = count
 
 class Semaphore(_LockBase):
-    def __init__(self):
-        self._lock = curio.Semaphore()
+    def __init__(self, value=1):
+        if value < 0:
+            raise ValueError('Semaphore initial value must be >= 0')
+        self._guard = threading.Lock()
+        self._value = value
+        self._waiting = WaitQueue()
+
+    def acquire(self):
+        with self._guard:
+            if self._value > 0:
+                self._value -= 1
+                return True
+            fut = self._waiting.add()
+        self._wait(fut)
+        return True
+
+    def release(self):
+        with self._guard:
+            if not self._waiting.wake():
+                self._value += 1
+
+    def locked(self):
+        return self._value == 0
 
     @property
     def value(self):
-        return self._lock.value
+        return self._value
 
 class BoundedSemaphore(Semaphore):
-    def __init__(self):
-        self._lock = curio.BoundedSemaphore()
+    def __init__(self, value=1):
+        super().__init__(value)
+        self._bound = value
+
+    @property
+    def bound(self):
+        return self._bound
+
+    def release(self):
+        with self._guard:
+            if self._value >= self._bound:
+                raise ValueError('BoundedSemaphore released too many times')
+            if not self._waiting.wake():
+                self._value += 1
+
+class CapacityLimiter(_LockBase):
+    '''
+    Limits the total amount of some capacity (connections, bytes, ...)
+    in use at once.  acquire(n) waits until n units out of total are
+    free.  Waiting threads are served strictly in order, so a large
+    request is never overtaken by smaller ones arriving after it.  A
+    request larger than total waits until total is raised.  total can be
+    changed at any time.  Used as a context manager, it acquires one
+    unit.  Use borrow(n) for more.
+    '''
+    def __init__(self, total):
+        if total < 0:
+            raise ValueError('total must be >= 0')
+        self._guard = threading.Lock()
+        self._total = total
+        self._borrowed = 0
+        self._waiting = deque()    # (Future, units)
+        self._stats = {
+            'acquired': 0,         # Successful acquire() calls
+            'waited': 0,           # acquire() calls that had to wait
+            'total_wait': 0.0,     # Total seconds spent waiting
+            'max_wait': 0.0,       # Longest single wait
+            'peak_borrowed': 0,    # Most units in use at once
+            }
+
+    def __repr__(self):
+        return '<thredo.CapacityLimiter borrowed=%d/%d waiting=%d>' % (
+            self._borrowed, self._total, len(self._waiting))
+
+    @property
+    def total(self):
+        return self._total
+
+    @total.setter
+    def total(self, total):
+        if total < 0:
+            raise ValueError('total must be >= 0')
+        with self._guard:
+            self._total = total
+            self._grant()
+
+    @property
+    def borrowed(self):
+        return self._borrowed
+
+    @property
+    def available(self):
+        return max(self._total - self._borrowed, 0)
+
+    def locked(self):
+        return self._borrowed >= self._total
+
+    def acquire(self, n=1):
+        if n < 0:
+            raise ValueError('n must be >= 0')
+        with self._guard:
+            if not self._waiting and self._borrowed + n <= self._total:
+                self._borrow(n)
+                return True
+            fut = futures.Future()
+            self._waiting.append((fut, n))
+        start = time.perf_counter()
+        try:
+            park(fut, 'lock')
+        except BaseException:
+            with self._guard:
+                try:
+                    self._waiting.remove((fut, n))
+                except ValueError:
+                    if not fut.cancelled():
+                        # Granted while being cancelled. Give it back.
+                        self._borrowed -= n
+                self._grant()
+            raise
+        waited = time.perf_counter() - start
+        with self._guard:
+            self._stats['waited'] += 1
+            self._stats['total_wait'] += waited
+            self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+        return True
+
+    def release(self, n=1):
+        with self._guard:
+            if n > self._borrowed:
+                raise RuntimeError('CapacityLimiter released more than borrowed')
+            self._borrowed -= n
+            self._grant()
+
+    def borrow(self, n):
+        '''
+        Return a context manager that acquires and releases n units.
+        '''
+        return _Borrow(self, n)
+
+    def statistics(self):
+        '''
+        Return a dict of usage statistics for tuning total.
+        '''
+        with self._guard:
+            stats = dict(self._stats)
+            stats['total'] = self._total
+            stats['borrowed'] = self._borrowed
+            stats['waiting'] = len(self._waiting)
+            stats['waiting_units'] = sum(n for fut, n in self._waiting)
+        stats['mean_wait'] = stats['total_wait'] / stats['waited'] if stats['waited'] else 0.0
+        return stats
+
+    # Must be called with the guard held
+    def _borrow(self, n):
+        self._borrowed += n
+        self._stats['acquired'] += 1
+        if self._borrowed > self._stats['peak_borrowed']:
+            self._stats['peak_borrowed'] = self._borrowed
+
+    # Must be called with the guard held.  Hands capacity to waiting
+    # threads in order, for as long as the first one fits.
+    def _grant(self):
+        waiting = self._waiting
+        while waiting:
+            fut, n = waiting[0]
+            if fut.cancelled():
+                waiting.popleft()
+                continue
+            if self._borrowed + n > self._total:
+                break
+            waiting.popleft()
+            if fut.set_running_or_notify_cancel():
+                self._borrow(n)
+                fut.set_result(None)
+
+class _Borrow(_LockBase):
+    def __init__(self, limiter, n):
+        self._limiter = limiter
+        self._n = n
+
+    def acquire(self):
+        return self._limiter.acquire(self._n)
+
+    def release(self):
+        self._limiter.release(self._n)
 
 class Condition(_LockBase):
     def __init__(self, lock=None):
-        if lock is None:
-            self._lock = curio.Condition(curio.Lock())
-        else:
-            self._lock = curio.Condition(lock._lock)
+        self._lock = Lock() if lock is None else lock
+        self._guard = threading.Lock()
+        self._waiting = WaitQueue()
+
+    def acquire(self):
+        return self._lock.acquire()
+
+    def release(self):
+        self._lock.release()
 
     def locked(self):
         return self._lock.locked()
 
-    def wait(self):
-        AWAIT(self._lock.wait)
-    
-    def wait_for(self, predicate):
-        AWAIT(self._lock.wait_for, predicate)
+    def wait(self, timeout=None):
+        '''
+        Wait to be notified.  Returns False if that doesn't happen within
+        timeout seconds.  The lock is reacquired in either case.
+        '''
+        fut, saved = self._release_wait()
+        try:
+            return self._park(fut, timeout)
+        finally:
+            self._acquire_restore(saved)
+
+    # Register as a waiter and release the lock. Returns the Future
+    # to park on and the state needed to reacquire the lock.
+    def _release_wait(self):
+        if not self.locked():
+            raise RuntimeError("Can't wait on unacquired lock")
+        with self._guard:
+            fut = self._waiting.add()
+        return fut, self._release_save()
+
+    def _park(self, fut, timeout=None):
+        try:
+            if park(fut, 'condition', timeout):
+                return True
+        except BaseException:
+            # Don't lose a notification that raced with cancellation
+            with self._guard:
+                if self._waiting.abandon(fut):
+                    self._waiting.wake()
+            raise
+        with self._guard:
+            self._waiting.abandon(fut)
+        return False
+
+    def wait_for(self, predicate, timeout=None):
+        '''
+        Wait until predicate() returns a true value and return it.  If
+        timeout seconds pass first, returns the last value of predicate().
+        '''
+        if timeout is not None:
+            expires = time.monotonic() + timeout
+        while True:
+            result = predicate()
+            if result:
+                return result
+            if timeout is None:
+                self.wait()
+            else:
+                remaining = expires - time.monotonic()
+                if remaining <= 0 or not self.wait(remaining):
+                    return predicate()
 
     def notify(self, n=1):
-        AWAIT(self._lock.notify, n)
+        if not self.locked():
+            raise RuntimeError("Can't notify on unacquired lock")
+        # Waiters only join while holding the lock, so nobody can be
+        # added behind our back
+        if self._waiting:
+            with self._guard:
+                self._waiting.wake(n)
 
     def notify_all(self):
-        AWAIT(self._lock.notify_all)
+        self.notify(len(self._waiting))
+
+    def _release_save(self):
+        if isinstance(self._lock, RLock):
+            return self._lock._release_save()
+        self._lock.release()
+
+    def _acquire_restore(self, saved):
+        if isinstance(self._lock, RLock):
+            self._lock._acquire_restore(saved)
+        else:
+            self._lock.acquire()
+
+class RWLock(object):
+    '''
+    Reader-writer lock.  It's held either by any number of readers or
+    by a single writer.  By default, readers get in whenever no writer
+    holds the lock, and readers and writers waiting on each other take
+    turns.  With prefer_writers, new readers also wait while a writer is
+    waiting.  Use read_lock and write_lock as context managers.
+    '''
+    def __init__(self, prefer_writers=False):
+        self.prefer_writers = prefer_writers
+        self._guard = threading.Lock()
+        self._readers = 0
+        self._writer = False
+        self._reading = WaitQueue()
+        self._writing = WaitQueue()
+        self._upgrading = WaitQueue()
+        self.read_lock = _ReadLock(self)
+        self.write_lock = _WriteLock(self)
+
+    def __repr__(self):
+        return '<thredo.RWLock readers=%d writer=%s>' % (self._readers, self._writer)
+
+    @property
+    def readers(self):
+        return self._readers
+
+    def locked(self):
+        return self._writer or self._readers > 0
+
+    def acquire_read(self):
+        with self._guard:
+            if not (self._writer or self._upgrading or (self.prefer_writers and self._writing)):
+                self._readers += 1
+                return True
+            fut = self._reading.add()
+        self._wait(fut, self._reading, self.release_read)
+        return True
+
+    def release_read(self):
+        with self._guard:
+            if not self._readers:
+                raise RuntimeError('RWLock not held by a reader')
+            self._readers -= 1
+            self._grant()
+
+    def acquire_write(self):
+        with self._guard:
+            if not (self._writer or self._readers):
+                self._writer = True
+                return True
+            fut = self._writing.add()
+        self._wait(fut, self._writing, self.release_write)
+        return True
+
+    def release_write(self):
+        with self._guard:
+            if not self._writer:
+                raise RuntimeError('RWLock not held by a writer')
+            self._writer = False
+            self._grant(after_write=True)
+
+    def upgrade(self):
+        '''
+        Turn a read lock held by the caller into the write lock, waiting
+        for the other readers to leave.  New readers are kept out in the
+        meantime.  Two readers upgrading at once would wait for each other
+        forever, so only one upgrade may be pending.  If the wait is
+        cancelled, the caller still holds the read lock.
+        '''
+        with self._guard:
+            if not self._readers:
+                raise RuntimeError('RWLock not held by a reader')
+            if self._upgrading:
+                raise RuntimeError('Another upgrade is already pending')
+            if self._readers == 1:
+                self._readers = 0
+                self._writer = True
+                return
+            fut = self._upgrading.add()
+        try:
+            park(fut, 'lock')
+        except BaseException:
+            with self._guard:
+                if self._upgrading.abandon(fut):
+                    # Upgraded while being cancelled. Back to reading.
+                    self._writer = False
+                    self._readers = 1
+                self._grant()
+            raise
+
+    def downgrade(self):
+        '''
+        Turn the write lock held by the caller into a read lock and let
+        in any waiting readers.
+        '''
+        with self._guard:
+            if not self._writer:
+                raise RuntimeError('RWLock not held by a writer')
+            self._writer = False
+            self._readers = 1
+            self._grant()
+
+    def _wait(self, fut, waiting, release):
+        try:
+            park(fut, 'lock')
+        except BaseException:
+            with self._guard:
+                if not waiting.abandon(fut):
+                    # A waiting writer may have been keeping readers out
+                    self._grant()
+                    raise
+            # The lock was handed to us while being cancelled. Pass it on.
+            release()
+            raise
+
+    # Must be called with the guard held.  Hands the lock to the waiting
+    # threads that can have it now.
+    def _grant(self, after_write=False):
+        if self._writer:
+            return
+        if self._upgrading:
+            if self._readers == 1:
+                fut = self._upgrading.claim()
+                if fut:
+                    self._readers = 0
+                    self._writer = True
+                    fut.set_result(None)
+            return
+        if not self._readers and self._writing and \
+           (self.prefer_writers or not after_write or not self._reading):
+            fut = self._writing.claim()
+            if fut:
+                self._writer = True
+                fut.set_result(None)
+                return
+        if self.prefer_writers and self._writing:
+            return
+        self._readers += self._reading.wake(len(self._reading))
+
+class _ReadLock(_LockBase):
+    def __init__(self, rwlock):
+        self._rwlock = rwlock
+
+    def acquire(self):
+        return self._rwlock.acquire_read()
+
+    def release(self):
+        self._rwlock.release_read()
+
+class _WriteLock(_LockBase):
+    def __init__(self, rwlock):
+        self._rwlock = rwlock
+
+    def acquire(self):
+        return self._rwlock.acquire_write()
+
+    def release(self):
+        self._rwlock.release_write()
+
+class StripedLock(object):
+    '''
+    A fixed set of n locks made by factory.  Each key maps to one of
+    them by its hash, so threads working on different keys rarely wait
+    for each other.  striped[key] is the lock for key.
+    striped.many(keys) locks all of the keys at once.
+    '''
+    def __init__(self, n=16, factory=Lock):
+        if n <= 0:
+            raise ValueError('n must be greater than 0')
+        self._locks = [ factory() for _ in range(n) ]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __getitem__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def many(self, keys):
+        '''
+        Return a lock for all of keys.  The underlying locks are always
+        acquired in the same order, so it can't deadlock with other
+        users of many().
+        '''
+        n = len(self._locks)
+        return _LockSet([ self._locks[i] for i in sorted({ hash(key) % n for key in keys }) ])
+
+class _LockSet(_LockBase):
+    def __init__(self, locks):
+        self._locks = locks
+
+    def acquire(self):
+        acquired = []
+        try:
+            for lock in self._locks:
+                lock.acquire()
+                acquired.append(lock)
+        except BaseException:
+            for lock in reversed(acquired):
+                lock.release()
+            raise
+        return True
+
+    def release(self):
+        for lock in reversed(self._locks):
+            lock.release()
+
+# Barriers, latches and futures release all of their waiters at once.
+# They wait on a Broadcast, which does that with a single operation in
+# the kernel, however many threads are waiting.
+
+BrokenBarrierError = threading.BrokenBarrierError
+
+class Barrier(object):
+    '''
+    Barrier for parties threads.  Threads calling wait() are held until
+    all parties have called it.  The last to arrive runs action (if
+    given) and releases the others.  wait() returns the arrival index of
+    the thread, from 0 to parties-1.  The barrier is then ready for the
+    next round.  If a waiting thread is cancelled or times out, or
+    abort() is called, the barrier is broken.  wait() raises
+    BrokenBarrierError until reset() is called.
+    '''
+    def __init__(self, parties, action=None):
+        if parties < 1:
+            raise ValueError('parties must be at least 1')
+        self.parties = parties
+        self._action = action
+        self._guard = threading.Lock()
+        self._count = 0
+        self._broken = False
+        self._release = Broadcast()
+
+    def __repr__(self):
+        return '<thredo.Barrier parties=%d waiting=%d>' % (self.parties, self._count)
+
+    @property
+    def n_waiting(self):
+        return self._count
+
+    @property
+    def broken(self):
+        return self._broken
+
+    def wait(self):
+        with self._guard:
+            if self._broken:
+                raise BrokenBarrierError
+            index = self._count
+            release = self._release
+            last = index + 1 == self.parties
+            if last:
+                self._count = 0
+                self._release = Broadcast()
+            else:
+                self._count += 1
+
+        if last:
+            if self._action:
+                try:
+                    self._action()
+                except BaseException:
+                    with self._guard:
+                        self._broken = True
+                    release.fire(False)
+                    raise
+            release.fire(True)
+            return index
+
+        try:
+            released = release.wait()
+        except BaseException:
+            self._break(release)
+            raise
+        if not released:
+            raise BrokenBarrierError
+        return index
+
+    # Break the round of waiters on release, unless it's already complete
+    def _break(self, release):
+        with self._guard:
+            if release is not self._release:
+                return
+            self._broken = True
+            self._count = 0
+            self._release = Broadcast()
+        release.fire(False)
+
+    def abort(self):
+        with self._guard:
+            self._broken = True
+            release = self._release
+            self._count = 0
+            self._release = Broadcast()
+        release.fire(False)
+
+    def reset(self):
+        '''
+        Return the barrier to its initial state.  Threads still waiting
+        get BrokenBarrierError.
+        '''
+        with self._guard:
+            self._broken = False
+            release = self._release
+            self._count = 0
+            self._release = Broadcast()
+        release.fire(False)
+
+class CountDownLatch(object):
+    '''
+    Counter that threads wait on to reach zero.  Each count_down()
+    decrements it.  Once it reaches zero, all waiting threads are
+    released and wait() no longer blocks.
+    '''
+    def __init__(self, count):
+        if count < 0:
+            raise ValueError('count must be >= 0')
+        self._guard = threading.Lock()
+        self._count = count
+        self._release = Broadcast()
+        if count == 0:
+            self._release.fire()
+
+    def __repr__(self):
+        return '<thredo.CountDownLatch count=%d>' % self._count
+
+    @property
+    def count(self):
+        return self._count
+
+    def count_down(self, n=1):
+        with self._guard:
+            if not self._count:
+                return
+            self._count = max(self._count - n, 0)
+            if self._count:
+                return
+        self._release.fire()
+
+    def wait(self):
+        self._release.wait()
+
+class Future(object):
+    '''
+    Result handed from one thread to any number of others.  It's set
+    once with set_result() or set_exception().  Threads calling result()
+    wait until then.
+    '''
+    def __init__(self):
+        self._release = Broadcast()
+
+    def __repr__(self):
+        return '<thredo.Future %s>' % ('done' if self.done() else 'pending')
+
+    def done(self):
+        return self._release.fired
+
+    def set_result(self, value):
+        if not self._release.fire((value, None)):
+            raise RuntimeError('Future is already done')
+
+    def set_exception(self, exc):
+        if not self._release.fire((None, exc)):
+            raise RuntimeError('Future is already done')
+
+    def result(self):
+        value, exc = self._release.wait()
+        if exc is not None:
+            raise exc
+        return value
 
+    def exception(self):
+        return self._release.wait()[1]
@@ -2,24 +2,456 @@
 #
 # Functions that allow normal threads to promote into Curio async threads.
 
+import threading
+import time
+import math
+import weakref
 from concurrent.futures import Future
+from collections import deque
 from curio.thread import is_async_thread, _locals, AWAIT, AsyncThread
-from curio import spawn, UniversalQueue
+from curio.traps import _future_wait, _scheduler_wait, _scheduler_wake
+from curio.sched import SchedFIFO
+from curio import spawn, UniversalQueue, timeout_at
+from curio.errors import TaskTimeout
+from . import timer
+from . import kernel as _kernel
 
 _request_queue = None
 
 def TAWAIT(coro, *args, **kwargs):
     '''
     Ensure that the caller is an async thread (promoting if necessary),
-    then await for a coroutine
+    then await for a coroutine.  Inside a batch() block, the operation
+    is deferred and None is returned.
     '''
+    b = getattr(_locals, 'batch', None)
+    if b is not None:
+        b._calls.append((coro, args, kwargs))
+        return None
     if not is_async_thread():
         enable_async()
+    trap = getattr(coro, '__name__', 'await')
+    deadlines = getattr(_locals, 'deadlines', None)
+    if deadlines:
+        deadline = min(deadlines)
+        if deadline < math.inf:
+            _check_deadline(deadline)
+            coro, args, kwargs = _deadline_call, (deadline, coro, args, kwargs), {}
+    if _collect:
+        return _hop(trap, coro, args, kwargs)
     return AWAIT(coro, *args, **kwargs)
 
+async def _deadline_call(deadline, coro, args, kwargs):
+    if callable(coro):
+        coro = coro(*args, **kwargs)
+    async with timeout_at(deadline):
+        return await coro
+
+def _check_deadline(deadline):
+    now = time.monotonic()
+    if now >= deadline:
+        raise TaskTimeout(now)
+
+def park(fut, trap='park', timeout=None):
+    '''
+    Block the calling thread in the kernel until the Future fut is
+    completed by some other thread.  The wait is cancellable.  Any
+    operations deferred by batch() are carried out first.  If the
+    thread is inside a timeout block, TaskTimeout is raised once the
+    deadline passes.  If timeout is given, the wait also ends after that
+    many seconds.  In that case, fut is cancelled and False is returned.
+    Otherwise, returns True.  trap names the kind of wait in the thread
+    statistics.
+    '''
+    b = getattr(_locals, 'batch', None)
+    if b is not None:
+        b._flush()
+    if not is_async_thread():
+        enable_async()
+    deadlines = getattr(_locals, 'deadlines', None)
+    deadline = min(deadlines) if deadlines else math.inf
+    if deadline == math.inf and timeout is None:
+        _park(fut, trap)
+        return True
+
+    # The wait is limited by a timeout.  The timer cancels fut unless
+    # some other thread completes it first.
+    _check_deadline(deadline)
+    expires = math.inf
+    if timeout is not None:
+        expires = time.monotonic() + timeout
+        if timeout <= 0:
+            return not fut.cancel()
+    t = timer._wheel.add(min(deadline, expires), fut.cancel)
+    try:
+        _park(fut, trap)
+    finally:
+        timer._wheel.cancel(t)
+    if fut.cancelled():
+        now = time.monotonic()
+        if now >= deadline:
+            raise TaskTimeout(now)
+        return False
+    return True
+
+def _park(fut, trap):
+    if _collect:
+        _hop(trap, _future_wait, (fut,), {})
+    else:
+        AWAIT(_future_wait, fut)
+
+# Per-thread statistics.  Collection only costs a couple of clock reads
+# per trip to the kernel and is on by default.
+_collect = True
+_all_stats = weakref.WeakSet()
+_all_stats_lock = threading.Lock()
+
+class ThreadStats(object):
+    '''
+    Scheduling statistics of a single thread.  hops is the number of
+    trips to the kernel, blocked the total seconds spent in the kernel,
+    running the total seconds spent running outside of it (from the
+    start of the thread to its latest trip, or to its exit) and traps
+    the number of trips by the kind of operation.
+    '''
+    __slots__ = ('hops', 'blocked', 'traps', '_first', '_last', '__weakref__')
+
+    def __init__(self):
+        self.hops = 0
+        self.blocked = 0.0
+        self.traps = { }
+        self._first = self._last = time.perf_counter()
+
+    def __repr__(self):
+        return '<ThreadStats hops=%d blocked=%.6f running=%.6f>' % (self.hops, self.blocked, self.running)
+
+    @property
+    def running(self):
+        return self._last - self._first - self.blocked
+
+    def as_dict(self):
+        return {
+            'hops': self.hops,
+            'blocked': self.blocked,
+            'running': self.running,
+            'traps': dict(self.traps),
+            }
+
+def thread_stats(athread):
+    '''
+    Return the ThreadStats of an AsyncThread, creating it if needed.
+    '''
+    try:
+        return athread._stats
+    except AttributeError:
+        st = athread._stats = ThreadStats()
+        # Account for the time since the thread started, up to its exit
+        # if it already exited
+        st._first = getattr(athread, '_started', st._first)
+        st._last = getattr(athread, '_exited', st._last)
+        with _all_stats_lock:
+            _all_stats.add(st)
+        return st
+
+# Called by the OS thread running athread when it starts and exits.
+# The ThreadStats itself is only created when first needed.
+def _stats_start(athread):
+    athread._started = now = time.perf_counter()
+    st = getattr(athread, '_stats', None)
+    if st is not None:
+        st._first = st._last = now
+
+def _stats_exit(athread):
+    now = time.perf_counter()
+    st = getattr(athread, '_stats', None)
+    if st is None:
+        athread._exited = now
+    else:
+        st._last = now
+
+def _hop(trap, coro, args, kwargs, _clock=time.perf_counter):
+    try:
+        st = _locals.thread._stats
+    except AttributeError:
+        st = thread_stats(_locals.thread)
+    st._last = start = _clock()
+    try:
+        return AWAIT(coro, *args, **kwargs)
+    finally:
+        st._last = end = _clock()
+        st.blocked += end - start
+        st.hops += 1
+        traps = st.traps
+        traps[trap] = traps.get(trap, 0) + 1
+
+def stats():
+    '''
+    Return a snapshot of the statistics summed over all threads that
+    still exist.
+    '''
+    with _all_stats_lock:
+        all_stats = list(_all_stats)
+    result = { 'threads': len(all_stats), 'hops': 0, 'blocked': 0.0,
+               'running': 0.0, 'traps': { } }
+    for st in all_stats:
+        result['hops'] += st.hops
+        result['blocked'] += st.blocked
+        result['running'] += st.running
+        for trap, count in list(st.traps.items()):
+            result['traps'][trap] = result['traps'].get(trap, 0) + count
+    return result
+
+async def _run_many(calls):
+    results = []
+    for coro, args, kwargs in calls:
+        if callable(coro):
+            coro = coro(*args, **kwargs)
+        results.append(await coro)
+    return results
+
+def await_many(calls):
+    '''
+    Perform several kernel operations in a single trip to the kernel.
+    calls is a sequence of (coro, args, kwargs) tuples as would be
+    given to TAWAIT().  Returns a list of results in the same order.
+    If an operation raises an exception, the remaining operations are
+    not performed.
+    '''
+    calls = list(calls)
+    if not calls:
+        return []
+    return TAWAIT(_run_many, calls)
+
+class batch(object):
+    '''
+    Context manager that collects the kernel operations made by the
+    calling thread and performs them in a single trip to the kernel
+    when the block exits.  For example:
+
+        with thredo.batch() as b:
+            for evt in events:
+                evt.set()
+
+    Deferred operations return None.  Their results are available
+    in order as b.results once the block has exited.  Don't use
+    operations whose result is needed right away, such as spawn() or
+    Queue.get(), inside a batch.  An operation that must block the
+    thread (e.g., a contended lock) first flushes everything deferred
+    so far.
+    '''
+    def __init__(self):
+        self.results = []
+        self._calls = []
+
+    def __enter__(self):
+        if getattr(_locals, 'batch', None) is not None:
+            raise RuntimeError('batch() blocks may not be nested')
+        _locals.batch = self
+        return self
+
+    def __exit__(self, ty, val, tb):
+        try:
+            self._flush()
+        finally:
+            _locals.batch = None
+
+    def _flush(self):
+        calls = self._calls
+        if calls:
+            self._calls = []
+            _locals.batch = None
+            try:
+                self.results.extend(await_many(calls))
+            finally:
+                _locals.batch = self
+
+class WaitQueue(object):
+    '''
+    FIFO queue of threads parked in the kernel.  Each waiter is
+    represented by a Future.  Waking a waiter only requires completing
+    its Future, so it can be done by any thread without a trip through
+    the kernel.  The caller is responsible for serializing access with
+    the lock that guards the owning primitive.
+    '''
+    def __init__(self):
+        self._waiters = deque()
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def add(self):
+        fut = Future()
+        self._waiters.append(fut)
+        return fut
+
+    def claim(self):
+        '''
+        Remove the next waiter and return its Future in the running
+        state.  The caller must complete it.  Returns None if there are
+        no waiters.
+        '''
+        while self._waiters:
+            fut = self._waiters.popleft()
+            # A waiter whose Future was cancelled by the kernel
+            # (cancellation or timeout) is skipped
+            if fut.set_running_or_notify_cancel():
+                return fut
+        return None
+
+    def wake(self, n=1, value=None):
+        '''
+        Wake up to n waiters, handing each of them value.  Returns the
+        number of waiters actually woken.
+        '''
+        woken = 0
+        while woken < n:
+            fut = self.claim()
+            if fut is None:
+                break
+            fut.set_result(value)
+            woken += 1
+        return woken
+
+    def abandon(self, fut):
+        '''
+        Remove a waiter that stopped waiting due to cancellation.  Returns
+        True if the waiter had already been woken, in which case the caller
+        owns whatever was handed to it and must pass it on.
+        '''
+        try:
+            self._waiters.remove(fut)
+            return False
+        except ValueError:
+            return not fut.cancelled()
+
+class Broadcast(object):
+    '''
+    One-shot release of any number of parked threads.  Waiters park on
+    a Curio scheduling queue in their own kernel rather than each on a
+    Future of its own.  fire() then releases all of them with a single
+    operation in each kernel instead of completing one Future (and
+    notifying the kernel) per waiter.
+    '''
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._queues = { }         # Kernel -> SchedFIFO of waiting tasks
+        self.fired = False
+        self.value = None
+
+    def wait(self):
+        '''
+        Wait until fire() is called and return the value given to it.
+        '''
+        if self.fired:
+            return self.value
+        b = getattr(_locals, 'batch', None)
+        if b is not None:
+            b._flush()
+        kernel = _kernel.current()
+        with self._guard:
+            if self.fired:
+                return self.value
+            sched = self._queues.get(kernel)
+            if sched is None:
+                sched = self._queues[kernel] = SchedFIFO()
+        TAWAIT(self._wait, sched)
+        return self.value
+
+    # fire() may happen between registering and getting here. Since
+    # the wake-up runs in the same kernel, checking first is enough.
+    async def _wait(self, sched):
+        if not self.fired:
+            await _scheduler_wait(sched, 'BROADCAST_WAIT')
+
+    def fire(self, value=None):
+        '''
+        Release all waiters, present and future, handing them value.
+        Returns False if already fired.
+        '''
+        with self._guard:
+            if self.fired:
+                return False
+            self.value = value
+            self.fired = True
+            queues = list(self._queues.items())
+        # The wake-up must happen regardless of any timeout that the
+        # caller is subject to
+        current = _kernel.current()
+        for kernel, sched in queues:
+            if kernel is not current:
+                kernel.call(_wake_all, sched)
+            else:
+                if not is_async_thread():
+                    enable_async()
+                if _collect:
+                    _hop('broadcast', _wake_all, (sched,), {})
+                else:
+                    AWAIT(_wake_all, sched)
+        return True
+
+async def _wake_all(sched):
+    if len(sched):
+        await _scheduler_wake(sched, len(sched))
+
+class _ThreadExit(object):
+    '''
+    Holder of callables to run when a thread exits.  It lives in
+    thread-local storage and runs the callables once that storage is
+    discarded.
+    '''
+    def __init__(self):
+        self._callables = []
+
+    def atexit(self, callable):
+        self._callables.append(callable)
+
+    def __del__(self):
+        for callable in self._callables:
+            callable()
+
 def thread_atexit(callable):
     _locals.thread_exit.atexit(callable)
 
+# Thredo threads currently running, by OS thread id.  Used by the
+# watchdog to find threads that don't return to the kernel.
+_threads = { }
+
+# Async threads created ahead of time by prepromote()
+_ready = deque()
+
+# Promotion latency statistics
+_stats_lock = threading.Lock()
+_stats = {
+    'promotions': 0,         # Threads promoted
+    'prepromoted': 0,        # Promotions served from the prepromote() pool
+    'total_latency': 0.0,    # Total seconds spent in enable_async()
+    'max_latency': 0.0,      # Longest single promotion
+    }
+
+def promotion_stats():
+    '''
+    Return a dict of statistics about the promotion of normal threads
+    into async threads by enable_async().
+    '''
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['mean_latency'] = stats['total_latency'] / stats['promotions'] if stats['promotions'] else 0.0
+    stats['ready'] = len(_ready)
+    return stats
+
+def prepromote(n):
+    '''
+    Create n async threads ahead of time.  Threads later promoted by
+    enable_async() take one of these instead of making a request to
+    the kernel.  May be called from any thread while thredo.run() is
+    active.
+    '''
+    if _request_queue is None:
+        raise RuntimeError('thredo.run() not active')
+    fut = Future()
+    _request_queue.put(('prepare', n, fut))
+    fut.result()
+
 def enable_async():
     '''
     Enable asynchronous operations in an existing thread.  This only
@@ -29,42 +461,69 @@ def enable_async():
         return
 
     if _request_queue is None:
-        raise RuntimeError('Curio: enable_threads not used')
+        raise RuntimeError('thredo.run() not active')
 
-    fut = Future()
-    _request_queue.put(('start', threading.current_thread(), fut))
-    _locals.thread = fut.result()
-    _locals.thread_exit = ThreadAtExit()
-    
-    def shutdown(thread=_locals.thread, rq=_request_queue):
+    start = time.perf_counter()
+    try:
+        athread = _ready.popleft()
+        prepromoted = 1
+    except IndexError:
         fut = Future()
-        rq.put(('stop', thread, fut))
-        fut.result()
+        _request_queue.put(('start', None, fut))
+        athread = fut.result()
+        prepromoted = 0
+    athread._thread = threading.current_thread()
+    _locals.thread = athread
+    _locals.thread_exit = _ThreadExit()
+    ident = threading.get_ident()
+    _threads[ident] = athread
+    _stats_start(athread)
+
+    # Shutdown only requires the backing task to be told to exit.  There
+    # is no need to wait for it.
+    def shutdown(athread=athread):
+        _stats_exit(athread)
+        if _threads.get(ident) is athread:
+            del _threads[ident]
+        athread._request.set_result(None)
     _locals.thread_exit.atexit(shutdown)
 
+    latency = time.perf_counter() - start
+    with _stats_lock:
+        _stats['promotions'] += 1
+        _stats['prepromoted'] += prepromoted
+        _stats['total_latency'] += latency
+        _stats['max_latency'] = max(_stats['max_latency'], latency)
+
+async def _new_async_thread():
+    athread = AsyncThread(None)
+    athread._task = await spawn(athread._coro_runner, daemon=True)
+    return athread
+
 async def thread_handler():
     '''
     Special handler function that allows Curio to respond to
     threads that want to access async functions.   This handler
     must be spawned manually in code that wants to allow normal
-    threads to promote to Curio async threads.
+    threads to promote to Curio async threads.  All requests that
+    are pending when the handler wakes up are served at once.
     '''
     global _request_queue
     assert _request_queue is None, "thread_handler already running"
-    _request_queue = queue.UniversalQueue()
+    _request_queue = UniversalQueue()
 
     try:
         while True:
-            request, thr, fut = await _request_queue.get()
-            if request == 'start':
-                athread = AsyncThread(None)
-                athread._task = await spawn(athread._coro_runner, daemon=True)
-                athread._thread = thr
-                fut.set_result(athread)
-            elif request == 'stop':
-                thr._request.set_result(None)
-                await thr._task.join()
-                fut.set_result(None)
+            requests = [ await _request_queue.get() ]
+            while not _request_queue.empty():
+                requests.append(await _request_queue.get())
+            for request, arg, fut in requests:
+                if request == 'start':
+                    fut.set_result(await _new_async_thread())
+                elif request == 'prepare':
+                    for n in range(arg):
+                        _ready.append(await _new_async_thread())
+                    fut.set_result(None)
     finally:
         _request_queue = None
-    
+        _ready.clear()
@@ -0,0 +1,111 @@
+# timer.py
+#
+# Timer wheel used for sleep() and timeouts.  Most timeouts are
+# cancelled long before they expire, so setting and cancelling a timer
+# has to be cheap.  Timers are dropped into buckets by the clock tick
+# at which they expire.  Adding or cancelling a timer is a dictionary
+# operation done by the calling thread without a trip to the kernel.
+# A heap only orders the distinct ticks that have timers.  With a
+# coarse resolution, many timers share the same tick and the heap stays
+# small.  Cancelled timers are left in place and discarded when their
+# tick comes up.
+
+import threading
+import time
+import math
+import heapq
+from concurrent.futures import Future
+
+import curio
+from curio.traps import _future_wait
+
+class Timer(object):
+    '''
+    A timer that has been added to a TimerWheel.
+    '''
+    __slots__ = ('tick', 'callback')
+
+    def __init__(self, tick, callback):
+        self.tick = tick
+        self.callback = callback
+
+class TimerWheel(object):
+    '''
+    A collection of timers. Expired timers are fired by the run()
+    coroutine, which must be running as a task in some kernel.
+    Timers never fire early, but they may fire up to resolution
+    seconds late.
+    '''
+    def __init__(self, resolution=0.001):
+        self.resolution = resolution
+        self._guard = threading.Lock()
+        self._buckets = { }        # tick -> set of Timers
+        self._ticks = []           # Heap of ticks that have a bucket
+        self._next = None          # Tick that run() is sleeping until
+        self._wakeup = None        # Future that wakes up run()
+
+    def __len__(self):
+        with self._guard:
+            return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, deadline, callback):
+        '''
+        Arrange for callback() to be called once the monotonic clock
+        reaches deadline.  Returns a Timer that can be given to cancel().
+        callback runs in the kernel and must not block.
+        '''
+        tick = math.ceil(deadline / self.resolution)
+        timer = Timer(tick, callback)
+        with self._guard:
+            bucket = self._buckets.get(tick)
+            if bucket is None:
+                bucket = self._buckets[tick] = set()
+                heapq.heappush(self._ticks, tick)
+                if self._wakeup and (self._next is None or tick < self._next):
+                    # run() is sleeping for too long
+                    self._wakeup.cancel()
+                    self._wakeup = None
+            bucket.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        with self._guard:
+            bucket = self._buckets.get(timer.tick)
+            if bucket:
+                bucket.discard(timer)
+
+    def expire(self, now):
+        '''
+        Fire all of the timers that have expired at clock value now.
+        '''
+        tick = math.floor(now / self.resolution)
+        expired = []
+        with self._guard:
+            while self._ticks and self._ticks[0] <= tick:
+                expired.extend(self._buckets.pop(heapq.heappop(self._ticks)))
+        for timer in expired:
+            timer.callback()
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            self.expire(now)
+            wakeup = Future()
+            with self._guard:
+                self._next = self._ticks[0] if self._ticks else None
+                self._wakeup = wakeup
+            if self._next is None:
+                await _future_wait(wakeup)
+            else:
+                async with curio.ignore_after(max(self._next * self.resolution - now, 0)):
+                    await _future_wait(wakeup)
+
+def wake(fut):
+    '''
+    Timer callback that wakes a thread parked on fut.
+    '''
+    if fut.set_running_or_notify_cancel():
+        fut.set_result(None)
+
+# Timer wheel used by thredo.  Installed by thredo.run()
+_wheel = None
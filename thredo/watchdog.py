@@ -0,0 +1,123 @@
+# watchdog.py
+#
+# Detection of thredo threads that block without going through the
+# kernel.  A thread stuck in a real blocking call (a blocking socket,
+# time.sleep(), a slow C extension) can't be cancelled or timed out.
+#
+# Threads are not instrumented in any way.  An AsyncThread hands every
+# operation to its backing task through the Future in athread._request,
+# which is replaced each time the task picks up an operation.  While the
+# thread runs its own code, the task waits on that very Future.  The
+# watchdog runs in a separate OS thread and periodically looks at all
+# running thredo threads.  A thread whose task has been waiting on the
+# same request Future for more than threshold seconds hasn't entered the
+# kernel in that time.  Its stack is reported once per incident.
+#
+# A thread stuck like this does the most harm when it holds locks that
+# other threads wait for.  Locks don't keep track of their owner unless
+# deadlock detection is enabled (thredo.deadlock.enable()).  If it is,
+# the locks held by a stuck thread are included in the report, and the
+# watchdog can be told to only report threads holding locks.
+
+__all__ = ['Watchdog']
+
+import sys
+import threading
+import time
+import logging
+import traceback
+
+from . import thr
+from . import deadlock
+
+log = logging.getLogger('thredo.watchdog')
+
+def _ident(athread):
+    for ident, other in list(thr._threads.items()):
+        if other is athread:
+            return ident
+    return None
+
+def _log_blocked(athread, seconds, stack):
+    held = deadlock.held_locks(_ident(athread))
+    log.warning('Thread %r has not entered the kernel for %.3f seconds%s. Stack:\n%s',
+                athread, seconds, ' while holding %r' % held if held else '',
+                ''.join(stack.format()).rstrip())
+
+class Watchdog(object):
+    '''
+    Report thredo threads that run for more than threshold seconds
+    without entering the kernel.  Threads are checked every interval
+    seconds (by default, threshold/2).  callback(athread, seconds, stack)
+    is called from the watchdog thread for each incident.  stack is a
+    traceback.StackSummary whose last entry is the offending call.  By
+    default, a warning is logged to the 'thredo.watchdog' logger.  If
+    deadlock detection is enabled, the warning lists the locks held by
+    the thread (see thredo.deadlock.held_locks()).  With holding_only,
+    only threads holding locks are reported.  That requires deadlock
+    detection to be enabled.
+    '''
+    def __init__(self, threshold=0.1, interval=None, callback=None, holding_only=False):
+        self.threshold = threshold
+        self.holding_only = holding_only
+        self.interval = threshold / 2 if interval is None else interval
+        self.callback = callback or _log_blocked
+        self.detected = 0
+        self._seen = { }           # ident -> (request, first seen, reported)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '<thredo.Watchdog threshold=%g detected=%d>' % (self.threshold, self.detected)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='thredo-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self):
+        '''
+        Look at all running thredo threads once. Returns the number of
+        newly detected incidents.
+        '''
+        now = time.monotonic()
+        seen = { }
+        blocked = []
+        for ident, athread in list(thr._threads.items()):
+            request = athread._request
+            task = athread._task
+            if task is None or task.future is not request:
+                # In the kernel
+                continue
+            first, reported = now, False
+            prev = self._seen.get(ident)
+            if prev and prev[0] is request:
+                first, reported = prev[1], prev[2]
+            if (not reported and now - first >= self.threshold and
+                (not self.holding_only or deadlock.held_locks(ident))):
+                blocked.append((ident, athread, now - first))
+                reported = True
+            seen[ident] = (request, first, reported)
+        self._seen = seen
+
+        detected = 0
+        if blocked:
+            frames = sys._current_frames()
+            for ident, athread, seconds in blocked:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                detected += 1
+                self.callback(athread, seconds, traceback.extract_stack(frame))
+            self.detected += detected
+        return detected